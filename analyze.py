@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+import argparse, csv, hashlib, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import binlog
+
+# ======================================================
+#                 BATCH ANALYSIS
+# ======================================================
+# A run is a directory holding server_positions.(csv|bin); its clients are
+# that directory or its subdirectories holding client_display.(csv|bin)
+# (and client_metrics). Each server/client pair is one task in a process
+# pool. The server log is read in chunks into sorted (snapshot_id,
+# player_id) keys and positions, then the client log streams past it in
+# chunks, so neither is ever loaded whole into a DataFrame.
+#
+# Per-pair results (error and latency samples, loss counts) are cached as
+# .npz under CACHE_DIR, keyed by a hash of the input files. Files whose
+# mtime and size are unchanged reuse their recorded hash, so an unchanged
+# tree is not even re-read.
+CHUNK_ROWS = 1 << 20
+CACHE_DIR = ".analysis_cache"
+CACHE_VERSION = 2          # bump when analyze_pair's output changes
+SUMMARY_FILE = "analysis_summary.csv"
+HASH_BLOCK = 1 << 20
+
+SUMMARY_FIELDS = [
+    "scenario", "clients", "samples",
+    "error_mean", "error_p50", "error_p95", "error_p99",
+    "latency_mean_ms", "latency_p50_ms", "latency_p95_ms", "latency_p99_ms",
+    "loss_pct",
+]
+
+
+def find_log(directory, stem):
+    for ext in (".bin", ".csv"):
+        path = os.path.join(directory, stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def find_runs(root):
+    """Yield (scenario, server_log, client_dir) for every pair under `root`."""
+    for directory, subdirs, _ in os.walk(root):
+        subdirs[:] = sorted(d for d in subdirs if d != CACHE_DIR)
+        server = find_log(directory, "server_positions")
+        if server is None:
+            continue
+        scenario = os.path.relpath(directory, root)
+        for client_dir in [directory] + [os.path.join(directory, d) for d in subdirs]:
+            if find_log(client_dir, "client_display") is not None:
+                yield scenario, server, client_dir
+
+
+def iter_chunks(path, columns):
+    """Yield {column: ndarray} blocks of at most CHUNK_ROWS rows."""
+    if binlog.is_binlog(path):
+        records = binlog.load(path)
+        for start in range(0, len(records), CHUNK_ROWS):
+            block = records[start:start + CHUNK_ROWS]
+            yield {c: np.asarray(block[c]) for c in columns}
+        return
+
+    import pandas as pd
+    for block in pd.read_csv(path, usecols=columns, chunksize=CHUNK_ROWS):
+        yield {c: block[c].to_numpy() for c in columns}
+
+
+def position_keys(snap, pid):
+    return snap.astype(np.int64) << 16 | pid.astype(np.int64)
+
+
+def seq_gap_loss(sessions, seqs):
+    """(lost, expected) from the seq_nums a client logged, per session id.
+
+    Loss is the seq range minus the distinct seqs seen, so a late packet
+    fills its gap and a duplicate counts once. The client's running
+    lost_packets counter can go down on reorder and is not used.
+    """
+    lost = expected = 0
+    for sid in np.unique(sessions):
+        seen = np.unique(seqs[sessions == sid])
+        span = int(seen[-1] - seen[0]) + 1
+        expected += span
+        lost += span - len(seen)
+    return lost, expected
+
+# ======================================================
+#                 ONE SERVER/CLIENT PAIR
+# ======================================================
+def analyze_pair(server_path, client_dir, out_path):
+    """Compute one pair's samples and save them to `out_path` (.npz)."""
+    keys, xs, ys = [], [], []
+    for block in iter_chunks(server_path, ["snapshot_id", "player_id", "x", "y"]):
+        keys.append(position_keys(block["snapshot_id"], block["player_id"]))
+        xs.append(block["x"].astype(np.float64))
+        ys.append(block["y"].astype(np.float64))
+    keys = np.concatenate(keys) if keys else np.zeros(0, np.int64)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    xs = np.concatenate(xs)[order] if xs else np.zeros(0)
+    ys = np.concatenate(ys)[order] if ys else np.zeros(0)
+
+    # error: same join as compute_error.py (inner, on snapshot_id + player_id)
+    errors = []
+    display = find_log(client_dir, "client_display")
+    for block in iter_chunks(display, ["snapshot_id", "player_id", "displayed_x", "displayed_y"]):
+        want = position_keys(block["snapshot_id"], block["player_id"])
+        idx = np.minimum(np.searchsorted(keys, want), max(len(keys) - 1, 0))
+        hit = keys[idx] == want if len(keys) else np.zeros(len(want), bool)
+        dx = xs[idx[hit]] - block["displayed_x"][hit]
+        dy = ys[idx[hit]] - block["displayed_y"][hit]
+        errors.append(np.sqrt(dx * dx + dy * dy).astype(np.float32))
+
+    # latency samples and seq-gap loss over the client's seq_num range
+    latencies, sessions, seqs = [], [], []
+    lost = expected = 0
+    metrics = find_log(client_dir, "client_metrics")
+    if metrics is not None:
+        for block in iter_chunks(metrics, ["client_id", "seq_num", "latency_ms"]):
+            lat = block["latency_ms"].astype(np.float32)
+            latencies.append(lat[~np.isnan(lat)])
+            # a replaced session numbers its packets from scratch
+            sessions.append(block["client_id"].astype(np.int64))
+            seqs.append(block["seq_num"].astype(np.int64))
+        if seqs:
+            lost, expected = seq_gap_loss(np.concatenate(sessions), np.concatenate(seqs))
+
+    np.savez(out_path,
+             error=np.concatenate(errors) if errors else np.zeros(0, np.float32),
+             latency=np.concatenate(latencies) if latencies else np.zeros(0, np.float32),
+             loss=np.array([lost, expected], dtype=np.int64))
+    return out_path
+
+# ======================================================
+#                 CACHE
+# ======================================================
+class FileHashes:
+    """Content hashes of input files, re-read only when mtime or size changes."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def get(self, path):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        entry = self.index.get(key)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            return entry["hash"]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+        self.index[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size,
+                           "hash": digest.hexdigest()}
+        return self.index[key]["hash"]
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.path)
+
+
+def pair_inputs(server, client_dir):
+    return [server] + [p for p in (find_log(client_dir, "client_display"),
+                                   find_log(client_dir, "client_metrics")) if p]
+
+# ======================================================
+#                 SUMMARY
+# ======================================================
+def summarize(scenario, results):
+    error = np.concatenate([r["error"] for r in results])
+    latency = np.concatenate([r["latency"] for r in results])
+    lost = sum(int(r["loss"][0]) for r in results)
+    expected = sum(int(r["loss"][1]) for r in results)
+
+    def stats(values):
+        if len(values) == 0:
+            return [float("nan")] * 4
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return [float(values.mean()), float(p50), float(p95), float(p99)]
+
+    return ([scenario, len(results), len(error)] + stats(error) + stats(latency)
+            + [100.0 * lost / expected if expected else float("nan")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Error, latency and loss summary over a results tree.")
+    parser.add_argument("root", nargs="?", default="results_phase2",
+                        help="Results directory to scan (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument("--out", default=None,
+                        help=f"Summary CSV (default: ROOT/{SUMMARY_FILE})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Recompute every pair, ignoring and not updating the cache")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    pairs = list(find_runs(args.root))
+    if not pairs:
+        sys.exit(f"no server_positions logs under {args.root}")
+
+    cache_dir = os.path.join(args.root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    hashes = FileHashes(os.path.join(cache_dir, "files.json"))
+
+    # one cache entry per pair, named by the hash of all its inputs
+    targets = []
+    todo = []
+    for scenario, server, client_dir in pairs:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(b"v%d" % CACHE_VERSION)
+        for path in pair_inputs(server, client_dir):
+            digest.update(hashes.get(path).encode())
+        out = os.path.join(cache_dir, digest.hexdigest() + ".npz")
+        targets.append((scenario, out))
+        if args.no_cache or not os.path.exists(out):
+            todo.append((server, client_dir, out))
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            for _ in pool.map(analyze_pair, *zip(*todo)):
+                pass
+    if not args.no_cache:
+        hashes.save()
+
+    by_scenario = {}
+    for scenario, out in targets:
+        with np.load(out) as data:
+            by_scenario.setdefault(scenario, []).append({k: data[k] for k in data.files})
+
+    rows = [summarize(s, results) for s, results in sorted(by_scenario.items())]
+    out_path = args.out or os.path.join(args.root, SUMMARY_FILE)
+    with open(out_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        writer.writerows(rows)
+
+    print(f"{'scenario':<20} {'err mean':>8} {'p50':>6} {'p95':>6} {'p99':>6} "
+          f"{'lat p50':>8} {'p95':>7} {'p99':>7} {'loss %':>7}")
+    for r in rows:
+        print(f"{r[0]:<20} {r[3]:>8.3f} {r[4]:>6.2f} {r[5]:>6.2f} {r[6]:>6.2f} "
+              f"{r[8]:>8.1f} {r[9]:>7.1f} {r[10]:>7.1f} {r[11]:>7.2f}")
+    print(f"{len(pairs)} client logs ({len(todo)} analysed, {len(pairs) - len(todo)} cached) "
+          f"in {time.monotonic() - started:.2f} s -> {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import struct
+import numpy as np
+
+# ======================================================
+#                 WIRE LAYOUT
+# ======================================================
+# Matches the server's ENTITY_FMT (">HHH"), so a slice of this dtype is a
+# ready-to-send snapshot body.
+WIRE_DTYPE = np.dtype([("id", ">u2"), ("x", ">u2"), ("y", ">u2")])
+
+# Matches the server_positions binary log schema.
+POSITION_DTYPE = np.dtype([("timestamp_ms", "<i8"), ("snapshot_id", "<u4"),
+                           ("player_id", "<u4"), ("x", "<i4"), ("y", "<i4")])
+
+
+# ======================================================
+#                 ARRAY-BACKED WORLD STORE
+# ======================================================
+class ArrayWorld:
+    """Player state held column-wise in contiguous NumPy arrays.
+
+    Rows 0..n-1 are live; removal swaps the last row into the hole so the
+    live range stays dense. New per-entity fields are added as more
+    columns of the same length. Not thread-safe: server.py holds its
+    session_lock around add/remove and around each tick's reads.
+    """
+
+    def __init__(self, size, capacity=1024, seed=None):
+        self.size = size
+        self.n = 0
+        self.ids = np.zeros(capacity, dtype=np.int32)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.row = {}          # player_id -> row index
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self):
+        cap = len(self.ids) * 2
+        for name in ("ids", "x", "y"):
+            col = np.zeros(cap, dtype=np.int32)
+            col[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, col)
+
+    def add(self, pid, x, y):
+        if self.n == len(self.ids):
+            self._grow()
+        i = self.n
+        self.ids[i], self.x[i], self.y[i] = pid, x, y
+        self.row[pid] = i
+        self.n += 1
+
+    def remove(self, pid):
+        i = self.row.pop(pid)
+        last = self.n - 1
+        if i != last:
+            for col in (self.ids, self.x, self.y):
+                col[i] = col[last]
+            self.row[int(self.ids[i])] = i
+        self.n = last
+
+    def position(self, pid):
+        i = self.row[pid]
+        return int(self.x[i]), int(self.y[i])
+
+    def step(self):
+        """Random-walk every player by -1/0/+1 per axis, wrapping at the edge."""
+        n = self.n
+        moves = self.rng.integers(-1, 2, size=(2, n), dtype=np.int32)
+        x, y = self.x[:n], self.y[:n]
+        np.add(x, moves[0], out=x)
+        np.add(y, moves[1], out=y)
+        np.mod(x, self.size, out=x)
+        np.mod(y, self.size, out=y)
+
+    def to_dict(self):
+        n = self.n
+        return dict(zip(self.ids[:n].tolist(),
+                        zip(self.x[:n].tolist(), self.y[:n].tolist())))
+
+    def pack_into(self, buf, offset):
+        """Write a full snapshot body (count + entity records) at `offset`."""
+        n = self.n
+        struct.pack_into(">H", buf, offset, n)
+        out = np.frombuffer(buf, dtype=WIRE_DTYPE, count=n, offset=offset + 2)
+        out["id"] = self.ids[:n]
+        out["x"] = self.x[:n]
+        out["y"] = self.y[:n]
+
+    def format_positions(self, ts, snap_id):
+        """This tick's server_positions CSV rows as one string."""
+        n = self.n
+        if n == 0:
+            return ""
+        rows = np.empty((n, 5), dtype=np.int64)
+        rows[:, 0] = ts
+        rows[:, 1] = snap_id
+        rows[:, 2] = self.ids[:n]
+        rows[:, 3] = self.x[:n]
+        rows[:, 4] = self.y[:n]
+        # csv.writer terminates rows with \r\n; keep the file uniform
+        return ("%d,%d,%d,%d,%d\r\n" * n) % tuple(rows.ravel().tolist())
+
+    def pack_positions(self, ts, snap_id):
+        """This tick's server_positions binary log records as one bytes object."""
+        n = self.n
+        rows = np.empty(n, dtype=POSITION_DTYPE)
+        rows["timestamp_ms"] = ts
+        rows["snapshot_id"] = snap_id
+        rows["player_id"] = self.ids[:n]
+        rows["x"] = self.x[:n]
+        rows["y"] = self.y[:n]
+        return rows.tobytes()
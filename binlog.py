@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import argparse, csv, json, os, struct
+
+# ======================================================
+#                 FILE FORMAT
+# ======================================================
+# An append-only file of fixed-width little-endian records:
+#
+#   b"GCLB" | u32 schema_len | schema JSON | zero padding to 8 bytes | records
+#
+# The schema is {"version": 1, "fields": [[name, code], ...]} with codes
+# from TYPE_CODES. Records are packed without padding, so the data section
+# maps directly onto a NumPy structured dtype.
+MAGIC = b"GCLB"
+FORMAT_VERSION = 1
+TYPE_CODES = {"i8": "q", "i4": "i", "u4": "I", "u2": "H", "f8": "d", "f4": "f"}
+
+
+def record_struct(fields):
+    return struct.Struct("<" + "".join(TYPE_CODES[code] for _, code in fields))
+
+
+def write_header(f, fields):
+    for name, code in fields:
+        if code not in TYPE_CODES:
+            raise ValueError(f"Unsupported type '{code}' for column '{name}'")
+    schema = json.dumps({"version": FORMAT_VERSION, "fields": [list(fd) for fd in fields]})
+    schema = schema.encode()
+    head = MAGIC + struct.pack("<I", len(schema)) + schema
+    f.write(head + b"\0" * (-len(head) % 8))
+
+
+def read_header(path):
+    """Return (fields, data_offset) of a binary log."""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary log")
+        (schema_len,) = struct.unpack("<I", f.read(4))
+        schema = json.loads(f.read(schema_len))
+    if schema.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported binary log version {schema.get('version')}")
+    head_len = 8 + schema_len
+    return [tuple(fd) for fd in schema["fields"]], head_len + (-head_len % 8)
+
+
+def is_binlog(path):
+    with open(path, "rb") as f:
+        return f.read(4) == MAGIC
+
+# ======================================================
+#                 READING
+# ======================================================
+def numpy_dtype(fields):
+    import numpy as np
+    return np.dtype([(name, "<" + code) for name, code in fields])
+
+
+def load(path):
+    """Memory-map a binary log as a read-only NumPy structured array.
+
+    A record cut short by a writer that was killed mid-append is ignored.
+    """
+    import numpy as np
+
+    fields, offset = read_header(path)
+    dtype = numpy_dtype(fields)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def load_frame(path):
+    """Load a CSV or binary log into a pandas DataFrame."""
+    import pandas as pd
+
+    if not is_binlog(path):
+        return pd.read_csv(path)
+    records = load(path)
+    return pd.DataFrame({name: records[name] for name in records.dtype.names})
+
+# ======================================================
+#                 WRITING
+# ======================================================
+def write_records(path, fields, rows):
+    rec = record_struct(fields)
+    with open(path, "wb") as f:
+        write_header(f, fields)
+        for row in rows:
+            f.write(rec.pack(*row))
+
+
+def write_frame(df, path):
+    """Write a DataFrame as a binary log (int columns as i8, the rest as f8)."""
+    fields = [(str(col), "i8" if df[col].dtype.kind in "iub" else "f8") for col in df.columns]
+    write_records(path, fields, df.itertuples(index=False, name=None))
+
+# ======================================================
+#                 CSV CONVERSION
+# ======================================================
+def csv_to_bin(csv_path, bin_path):
+    # first pass: a column is integer only if every value parses as one
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        is_int = [True] * len(names)
+        for row in reader:
+            for i, val in enumerate(row):
+                if is_int[i]:
+                    try:
+                        int(val)
+                    except ValueError:
+                        is_int[i] = False
+
+    fields = [(name, "i8" if is_int[i] else "f8") for i, name in enumerate(names)]
+    casts = [int if flag else float for flag in is_int]
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        write_records(bin_path, fields,
+                      ([cast(v) for cast, v in zip(casts, row)] for row in reader))
+
+
+def bin_to_csv(bin_path, csv_path, chunk=65536):
+    records = load(bin_path)
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(records.dtype.names)
+        for start in range(0, len(records), chunk):
+            writer.writerows(records[start:start + chunk].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between CSV and binary GCLB logs.")
+    parser.add_argument("direction", choices=["to-csv", "from-csv"])
+    parser.add_argument("src", help="Input file")
+    parser.add_argument("dst", nargs="?", help="Output file (default: src with swapped extension)")
+    args = parser.parse_args()
+
+    ext = ".csv" if args.direction == "to-csv" else ".bin"
+    dst = args.dst or os.path.splitext(args.src)[0] + ext
+    if args.direction == "to-csv":
+        bin_to_csv(args.src, dst)
+    else:
+        csv_to_bin(args.src, dst)
+    print(f"Saved → {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,98 @@
 #!/usr/bin/env python3
-import socket, struct, time, csv, os
+import socket, struct, time, os, argparse, functools
+from collections import OrderedDict, deque
+from itertools import chain, repeat
+
+import binlog
+import telemetry
 
 # ======================================================
 #                 PROTOCOL CONSTANTS
 # ======================================================
-MAGIC = b"GCL1"; VERSION = 1
+MAGIC = b"GCL1"; VERSION = 2
 MT_INIT, MT_SNAPSHOT, MT_EVENT, MT_ACK, MT_HEARTBEAT = range(5)
+MT_SNAPSHOT_DELTA = 5
+MT_SNAPSHOT_FRAG = 6
 
 HDR_FMT = ">4sBBIIQH"
 HDR_LEN = struct.calcsize(HDR_FMT)
 
+# Compact header (negotiated in MT_INIT): one byte holding COMPACT_MARK in
+# the top three bits and the msg type in the low five, then varint
+# snapshot_id, seq_num, ms since the session epoch and payload length.
+# Each side stamps its own monotonic_ms against the epoch on its own clock,
+# as in the full header: the server from the epoch it chose, the client
+# from when the INIT reply announcing that epoch arrived.
+COMPACT_MARK = 0b101
+INIT_FLAG_COMPACT = 0x01
+INIT_FLAG_RESUME = 0x02    # INIT carries (client_id, token) of a session to resume
+INIT_FLAG_DELTA = 0x04     # INIT reply: server sends deltas, so ACK applied snapshots
+
+# entity record: player_id, x, y
+ENTITY_FMT = ">HHH"
+ENTITY_LEN = struct.calcsize(ENTITY_FMT)
+
+# fragment prefix: inner msg type, fragment index, fragment count
+FRAG_FMT = ">BBB"
+FRAG_LEN = struct.calcsize(FRAG_FMT)
+
+# optional trailer after the plen-delimited payload: kind, length, body
+TRAILER_FMT = ">BH"
+TRAILER_LEN = struct.calcsize(TRAILER_FMT)
+TRAILER_EVENT_ACK = 1
+
 SERVER_ADDR = ("127.0.0.1", 7777)
 RUN_SECONDS = 10
-SMOOTH = 0.35
-EVENT_RTO_MS = 120
+EVENT_RTO_MS = 120         # initial RTO, before any RTT sample
+MIN_EVENT_RTO_MS = 40
+MAX_EVENT_RTO_MS = 2000
 MAX_EVENT_RETRIES = 4
+EVENT_WINDOW = 16          # critical events in flight at once
+EVENT_INTERVAL = 1.5       # seconds between generated critical events
+SNAPSHOT_HISTORY = 64      # applied snapshots kept as possible delta baselines
+MAX_PENDING_SNAPSHOTS = 8  # fragmented snapshots being reassembled at once
+QUIET = False              # suppress per-packet console output
+COMPACT_HEADER = False     # ask the server for the compact header
+
+# Playout: positions are rendered RENDER_HZ times a second, interpolated
+# between buffered snapshots at a delay that tracks measured latency
+# (one tick + mean + PLAYOUT_JITTER_K deviations). Through gaps the last
+# motion is extrapolated for at most MAX_EXTRAPOLATE_MS.
+RENDER_HZ = 60
+PLAYOUT_JITTER_K = 4
+MIN_PLAYOUT_MS = 20
+MAX_PLAYOUT_MS = 500
+PLAYOUT_SLEW_MS = 1.0      # most the delay moves per frame, so playback never jumps
+MAX_EXTRAPOLATE_MS = 100
+SNAP_DISTANCE = 3.0        # moves longer than this (world wrap) are not interpolated
+HEARTBEAT_INTERVAL = 1.0   # seconds between MT_HEARTBEATs (liveness + time sync)
+SYNC_BURST = 4             # heartbeats sent SYNC_BURST_INTERVAL apart after connecting
+SYNC_BURST_INTERVAL = 0.1
+CLOCK_FILTER = 8           # time-sync samples the offset estimate is picked from
+MAX_MISSING_SEQS = 1024    # seq_num gaps remembered for reorder detection
+SERVER_TIMEOUT = 3.0       # re-INIT (resume) after this long without hearing back
+REBIND_AT = None           # seconds into the run to switch to a new local port
+RECV_BUFFER = 65536        # reused receive buffer; datagrams are parsed in place
+HEADLESS = False           # decode, ACK and measure, but render and log no frames
+
+# log schemas (column names, binlog type codes), shared with replay.py
+METRICS_FIELDS = ["client_id", "snapshot_id", "seq_num",
+                  "server_timestamp_ms", "recv_time_ms",
+                  "latency_ms", "jitter_ms", "rtt_ms", "clock_offset_ms",
+                  "lost_packets", "partial_snapshots", "playout_delay_ms", "late_snapshots"]
+METRICS_TYPES = ["u4", "u4", "u4", "i8", "i8", "f8", "f8", "f8", "f8", "u4", "u4", "f8", "u4"]
+DISPLAY_FIELDS = ["timestamp_ms", "snapshot_id", "player_id", "displayed_x", "displayed_y"]
+DISPLAY_TYPES = ["i8", "u4", "u4", "f8", "f8"]
 
 # ======================================================
 #                 HELPER FUNCTIONS
 # ======================================================
 def monotonic_ms():
-    return time.time_ns() // 1_000_000
+    return time.monotonic_ns() // 1_000_000
+
+
+def monotonic_us():
+    return time.monotonic_ns() // 1_000
 
 
 def pack_header(msg_type, snapshot_id, seq_num, ts, payload):
@@ -31,12 +103,448 @@ def pack_header(msg_type, snapshot_id, seq_num, ts, payload):
     ) + payload
 
 
-def smooth_pos(old, new):
-    if old is None:
-        return new
-    ox, oy = old
-    nx, ny = new
-    return (ox + SMOOTH*(nx-ox), oy + SMOOTH*(ny-oy))
+def encode_varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return out
+
+
+def decode_varint(data, offset):
+    value = shift = 0
+    while True:
+        b = data[offset]
+        offset += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, offset
+        shift += 7
+
+
+def pack_compact(msg_type, snapshot_id, seq_num, ts, payload, epoch):
+    hdr = bytearray([COMPACT_MARK << 5 | msg_type])
+    for field in (snapshot_id, seq_num, max(0, ts - epoch), len(payload)):
+        hdr += encode_varint(field)
+    return bytes(hdr) + payload
+
+
+def parse_header(data, epoch=None):
+    """Return (mtype, snap, seq, server_ts_ms, plen, hdr_len), or None."""
+    if not data:
+        return None
+    if data[0] >> 5 == COMPACT_MARK:
+        if epoch is None:
+            return None
+        try:
+            snap, off = decode_varint(data, 1)
+            seq, off = decode_varint(data, off)
+            ts, off = decode_varint(data, off)
+            plen, off = decode_varint(data, off)
+        except IndexError:
+            return None
+        return data[0] & 0x1F, snap, seq, epoch + ts, plen, off
+
+    if len(data) < HDR_LEN:
+        return None
+    magic, ver, mtype, snap, seq, ts, plen = struct.unpack_from(HDR_FMT, data, 0)
+    if magic != MAGIC or ver != VERSION:
+        return None
+    return mtype, snap, seq, ts, plen, HDR_LEN
+
+
+def trace(msg):
+    if not QUIET:
+        print(msg)
+
+
+# ======================================================
+#                 PLAYOUT BUFFER (interpolation)
+# ======================================================
+# World state is kept as a frame: parallel (ids, xs, ys) columns in wire
+# order, straight from one bulk unpack. Interpolation runs column-wise and
+# only falls back to matching by id when players joined or left.
+def new_playout():
+    return {
+        "frames": OrderedDict(),   # snapshot_id -> (server_ms, frame), oldest first
+        "offset": None,            # server_ms - arrival_ms of the first snapshot
+        "lat_mean": None,          # arrival lateness relative to that first snapshot
+        "lat_dev": 0.0,
+        "tick_ms": None,
+        "delay_ms": None,
+        "render_ms": None,         # server time of the last rendered frame
+        "newest": None,            # (snapshot_id, server_ms) of the newest snapshot
+    }
+
+
+def playout_late(pb, server_ms):
+    """True if a snapshot stamped `server_ms` is older than what was rendered."""
+    return pb["render_ms"] is not None and server_ms <= pb["render_ms"]
+
+
+def playout_insert(pb, snap, server_ms, frame, arrival_ms):
+    if pb["offset"] is None:
+        # any fixed clock mapping works: its error cancels out of the delay
+        pb["offset"] = server_ms - arrival_ms
+
+    # lateness statistics, smoothed like RFC 6298 SRTT/RTTVAR
+    lateness = arrival_ms + pb["offset"] - server_ms
+    if pb["lat_mean"] is None:
+        pb["lat_mean"] = lateness
+    else:
+        pb["lat_dev"] += (abs(lateness - pb["lat_mean"]) - pb["lat_dev"]) / 4
+        pb["lat_mean"] += (lateness - pb["lat_mean"]) / 8
+
+    newest = pb["newest"]
+    if newest is None or snap > newest[0]:
+        if newest is not None:
+            gap = (server_ms - newest[1]) / (snap - newest[0])
+            pb["tick_ms"] = gap if pb["tick_ms"] is None else pb["tick_ms"] + (gap - pb["tick_ms"]) / 8
+        pb["newest"] = (snap, server_ms)
+
+    frames = pb["frames"]
+    reordered = bool(frames) and snap < next(reversed(frames))
+    frames[snap] = (server_ms, frame)
+    if reordered:
+        pb["frames"] = OrderedDict(sorted(frames.items()))
+
+
+def playout_target(pb):
+    tick = pb["tick_ms"] or 1000 / 20
+    target = tick + pb["lat_mean"] + PLAYOUT_JITTER_K * pb["lat_dev"]
+    return min(MAX_PLAYOUT_MS, max(MIN_PLAYOUT_MS, target))
+
+
+def lerp_column(a, b, alpha):
+    # moves longer than SNAP_DISTANCE (world wrap) switch over at the midpoint
+    far = SNAP_DISTANCE
+    jump = b if alpha >= 0.5 else a
+    return [p + alpha * (q - p) if -far <= q - p <= far else float(j)
+            for p, q, j in zip(a, b, jump)]
+
+
+def float_frame(frame):
+    ids, xs, ys = frame
+    return ids, list(map(float, xs)), list(map(float, ys))
+
+
+def lerp_frames(a, b, alpha):
+    """Interpolate frame `a` toward `b`; the result has b's players."""
+    a_ids, ax, ay = a
+    b_ids, bx, by = b
+    if a_ids != b_ids:
+        # players joined or left: line a's columns up with b's, new ones at b
+        row = dict(zip(a_ids, range(len(a_ids))))
+        rows = [row.get(pid) for pid in b_ids]
+        ax = [bx[i] if r is None else ax[r] for i, r in enumerate(rows)]
+        ay = [by[i] if r is None else ay[r] for i, r in enumerate(rows)]
+    return b_ids, lerp_column(ax, bx, alpha), lerp_column(ay, by, alpha)
+
+
+def playout_render(pb, now_ms):
+    """Frame to show at `now_ms`, as (render_snapshot, frame), or None.
+
+    render_snapshot is the (fractional) server tick being shown.
+    """
+    frames = pb["frames"]
+    if not frames:
+        return None
+
+    target = playout_target(pb)
+    if pb["delay_ms"] is None:
+        pb["delay_ms"] = target
+    else:
+        step = max(-PLAYOUT_SLEW_MS, min(PLAYOUT_SLEW_MS, target - pb["delay_ms"]))
+        pb["delay_ms"] += step
+    render_ms = now_ms + pb["offset"] - pb["delay_ms"]
+    pb["render_ms"] = render_ms
+
+    # keep the newest frame at or before render_ms, and one before it for velocity
+    items = list(frames.items())
+    while len(items) >= 3 and items[2][1][0] <= render_ms:
+        del frames[items[0][0]]
+        items.pop(0)
+
+    after = [(snap, frame) for snap, frame in items if frame[0] > render_ms]
+    before = [(snap, frame) for snap, frame in items if frame[0] <= render_ms]
+
+    if not before:
+        snap, (_, frame) = after[0]
+        return float(snap), float_frame(frame)
+
+    a_snap, (a_ms, a_frame) = before[-1]
+    if after:
+        b_snap, (b_ms, b_frame) = after[0]
+        # catch-up ticks can share a timestamp
+        alpha = (render_ms - a_ms) / (b_ms - a_ms) if b_ms > a_ms else 1.0
+        return a_snap + alpha * (b_snap - a_snap), lerp_frames(a_frame, b_frame, alpha)
+
+    # buffer ran dry (loss or a late snapshot): extrapolate the last motion
+    tick = pb["tick_ms"] or 1000 / 20
+    render_snap = a_snap + (render_ms - a_ms) / tick
+    p_ms, p_frame = before[-2][1] if len(before) >= 2 else (a_ms, a_frame)
+    if p_ms >= a_ms:
+        return render_snap, float_frame(a_frame)
+    ahead = min(render_ms - a_ms, MAX_EXTRAPOLATE_MS) / (a_ms - p_ms)
+    return render_snap, lerp_frames(p_frame, a_frame, 1.0 + ahead)
+
+
+@functools.lru_cache(maxsize=64)
+def display_struct(count):
+    return struct.Struct("<" + "".join(binlog.TYPE_CODES[t] for t in DISPLAY_TYPES) * count)
+
+
+def log_display(log, frame_ms, snap, frame):
+    """Queue one client_display row per player of `frame` as a single chunk."""
+    ids, xs, ys = frame
+    n = len(ids)
+    if n == 0:
+        return
+    rows = chain.from_iterable(zip(repeat(frame_ms, n), repeat(snap, n), ids, xs, ys))
+    if log.binary:
+        log.write_raw(display_struct(n).pack(*rows))
+    else:
+        # floats as csv.writer prints them (repr), rows ending in \r\n likewise
+        log.write_raw(("%d,%d,%d,%r,%r\r\n" * n) % tuple(rows))
+
+
+def update_rto(rtt, sample_ms):
+    """Fold one RTT sample into the estimator (RFC 6298) and recompute the RTO."""
+    if rtt["srtt"] is None:
+        rtt["srtt"] = sample_ms
+        rtt["rttvar"] = sample_ms / 2
+    else:
+        rtt["rttvar"] = 0.75 * rtt["rttvar"] + 0.25 * abs(rtt["srtt"] - sample_ms)
+        rtt["srtt"] = 0.875 * rtt["srtt"] + 0.125 * sample_ms
+    rto = rtt["srtt"] + max(1.0, 4 * rtt["rttvar"])
+    rtt["rto"] = min(MAX_EVENT_RTO_MS, max(MIN_EVENT_RTO_MS, rto))
+
+
+def new_seq_tracker():
+    return {"highest": None, "received": 0, "lost": 0, "missing": set()}
+
+
+def track_seq(tracker, seq):
+    """Count one server packet; loss is gaps in seq_num, which every packet
+    to us carries consecutively, so ticks the server chose not to send us
+    are not loss. A late packet filling a gap is a reorder, not a loss."""
+    tracker["received"] += 1
+    highest = tracker["highest"]
+    if highest is None:
+        tracker["highest"] = seq
+        return
+    if seq > highest:
+        missing = tracker["missing"]
+        if seq > highest + 1:
+            tracker["lost"] += seq - highest - 1
+            missing.update(range(max(highest + 1, seq - MAX_MISSING_SEQS), seq))
+            if len(missing) > MAX_MISSING_SEQS:
+                tracker["missing"] = {s for s in missing if s > seq - MAX_MISSING_SEQS}
+        tracker["highest"] = seq
+    elif seq in tracker["missing"]:
+        tracker["missing"].discard(seq)
+        tracker["lost"] -= 1
+
+
+def update_clock(sync, t0, t1, t2, t3):
+    """Fold one NTP-style exchange (microsecond timestamps) into `sync`.
+
+    t0/t3 are our send/receive times, t1/t2 the server's. Like NTP's clock
+    filter, the estimate comes from the lowest-RTT sample of the last
+    CLOCK_FILTER, since queueing delay inflates RTT and skews the offset.
+    """
+    rtt = (t3 - t0) - (t2 - t1)
+    offset = ((t1 - t0) + (t2 - t3)) / 2
+    sync["samples"].append((rtt, offset))
+    best_rtt, best_offset = min(sync["samples"])
+    sync["rtt_ms"] = best_rtt / 1000
+    sync["offset_ms"] = best_offset / 1000
+
+
+def parse_event_ack(payload):
+    """Return the set of event seqs an MT_ACK acknowledges.
+
+    The payload is the seq that triggered the ACK, optionally followed by
+    the server's cumulative ACK, a 32-bit selective-ACK bitmap for the
+    seqs right after it, and extra explicitly ACKed seqs.
+    """
+    (ack_seq,) = struct.unpack_from(">I", payload, 0)
+    if len(payload) < 12:
+        return {ack_seq}, 0
+    cum_ack, bitmap = struct.unpack_from(">II", payload, 4)
+    acked = {ack_seq}
+    for i in range(32):
+        if bitmap >> i & 1:
+            acked.add(cum_ack + 1 + i)
+    extra = (len(payload) - 12) // 4
+    acked.update(struct.unpack_from(f">{extra}I", payload, 12))
+    return acked, cum_ack
+
+
+def parse_trailers(extra):
+    """Yield (kind, body) for each trailer in the bytes after a payload."""
+    offset = 0
+    while offset + TRAILER_LEN <= len(extra):
+        kind, length = struct.unpack_from(TRAILER_FMT, extra, offset)
+        offset += TRAILER_LEN
+        yield kind, extra[offset:offset + length]
+        offset += length
+
+
+@functools.lru_cache(maxsize=256)
+def entities_struct(count):
+    return struct.Struct(">" + "HHH" * count)
+
+
+def unpack_entities(payload, offset, count):
+    """`count` entity records at `offset` as (ids, xs, ys) in one unpack."""
+    flat = entities_struct(count).unpack_from(payload, offset)
+    return flat[0::3], flat[1::3], flat[2::3]
+
+
+def decode_snapshot(payload):
+    if len(payload) < 2:
+        return None
+
+    (num_players,) = struct.unpack_from(">H", payload, 0)
+    # a truncated snapshot still yields the records that fit
+    num_players = min(num_players, (len(payload) - 2) // ENTITY_LEN)
+    return unpack_entities(payload, 2, num_players)
+
+
+def decode_delta(payload, history):
+    """Rebuild the full frame from an MT_SNAPSHOT_DELTA and its baseline.
+
+    Returns None when the baseline is no longer in `history`.
+    """
+    if len(payload) < 8:
+        return None
+
+    baseline_id, num_changed, num_removed = struct.unpack_from(">IHH", payload, 0)
+    baseline = history.get(baseline_id)
+    if baseline is None or len(payload) < 8 + ENTITY_LEN*num_changed + 2*num_removed:
+        return None
+
+    ids, xs, ys = baseline
+    state = dict(zip(ids, zip(xs, ys)))
+    c_ids, c_xs, c_ys = unpack_entities(payload, 8, num_changed)
+    state.update(zip(c_ids, zip(c_xs, c_ys)))
+    for pid in struct.unpack_from(f">{num_removed}H", payload, 8 + ENTITY_LEN*num_changed):
+        state.pop(pid, None)
+    if not state:
+        return (), (), ()
+    xs, ys = zip(*state.values())
+    return tuple(state), xs, ys
+
+
+def parse_init_reply(payload):
+    """(client_id, x, y, epoch or None, token or None, delta) from an INIT reply.
+
+    `delta` is whether the server sends delta snapshots, i.e. whether
+    applied snapshots should be ACKed.
+    """
+    cid, x, y = struct.unpack_from(ENTITY_FMT, payload)
+    reply_epoch = token = None
+    delta = False
+    # server's answer to our flags, the session epoch and the resume token
+    if len(payload) >= ENTITY_LEN + 9:
+        ack_flags, ack_epoch = struct.unpack_from(">BQ", payload, ENTITY_LEN)
+        if ack_flags & INIT_FLAG_COMPACT:
+            reply_epoch = ack_epoch
+        delta = bool(ack_flags & INIT_FLAG_DELTA)
+    if len(payload) >= ENTITY_LEN + 13:
+        (token,) = struct.unpack_from(">I", payload, ENTITY_LEN + 9)
+    return int(cid), x, y, reply_epoch, token, delta
+
+
+def add_fragment(pending, snap, payload):
+    """Store one MT_SNAPSHOT_FRAG; return (inner_type, body) once complete."""
+    if len(payload) < FRAG_LEN:
+        return None
+    inner_type, index, count = struct.unpack_from(FRAG_FMT, payload, 0)
+    if index >= count:
+        return None
+
+    entry = pending.get(snap)
+    if entry is None:
+        entry = pending[snap] = {"type": inner_type, "count": count, "parts": {}}
+    # copied: `payload` may be a view of the reused receive buffer
+    entry["parts"][index] = bytes(payload[FRAG_LEN:])
+
+    if len(entry["parts"]) < entry["count"]:
+        return None
+    del pending[snap]
+    parts = entry["parts"]
+    return entry["type"], b"".join(parts[i] for i in range(entry["count"]))
+
+# ======================================================
+#                 SNAPSHOT RECEIVE PATH
+# ======================================================
+# Everything between a parsed snapshot packet and a full frame: duplicate
+# and lateness checks, fragment reassembly, delta decoding and the history
+# of baselines. main() and replay.py both feed packets through here.
+def new_receiver():
+    return {
+        "history": OrderedDict(),  # snapshot_id -> full frame, for delta decoding
+        "pending": OrderedDict(),  # snapshot_id -> fragments being reassembled
+        "playout": new_playout(),
+        "dups": 0,                 # snapshot packets for an already applied snapshot
+        "partial": 0,              # some fragments arrived but never all of them
+        "late": 0,                 # arrived after their moment was already rendered
+        "undecodable": 0,          # deltas whose baseline was already evicted
+    }
+
+
+def receive_snapshot(rx, mtype, snap, server_ms, payload):
+    """Apply one snapshot packet; return the new full frame, or None.
+
+    None means nothing new to show: a duplicate, a snapshot whose moment
+    was already rendered, a fragment of an incomplete snapshot, or a delta
+    whose baseline is gone.
+    """
+    history = rx["history"]
+    if snap in history:
+        rx["dups"] += 1
+        return None
+
+    # reordered snapshots are still played out unless their moment has
+    # already been rendered
+    if playout_late(rx["playout"], server_ms):
+        rx["late"] += 1
+        return None
+
+    if mtype == MT_SNAPSHOT_FRAG:
+        pending = rx["pending"]
+        done = add_fragment(pending, snap, payload)
+        while len(pending) > MAX_PENDING_SNAPSHOTS:
+            pending.popitem(last=False)
+            rx["partial"] += 1
+        if done is None:
+            return None
+        mtype, payload = done
+
+        # a newer snapshot completed: older partial ones are useless
+        for old in [s for s in pending if s < snap]:
+            del pending[old]
+            rx["partial"] += 1
+
+    if mtype == MT_SNAPSHOT:
+        frame = decode_snapshot(payload)
+    else:
+        frame = decode_delta(payload, history)
+        if frame is None:
+            # baseline already evicted; the server falls back to a full
+            # snapshot once our ACKs age out of its history
+            rx["undecodable"] += 1
+            return None
+    if frame is None:
+        return None
+
+    history[snap] = frame
+    while len(history) > SNAPSHOT_HISTORY:
+        history.popitem(last=False)
+    return frame
 
 # ======================================================
 #                 CLIENT MAIN
@@ -46,26 +554,44 @@ def main(client_name="player1"):
     sock.settimeout(0.1)
 
     seq_out = 1
-    last_recv = None
+    last_transit = None        # server-to-client transit of the previous snapshot
+    jitter = 0.0               # RFC 3550 interarrival jitter estimate
+    # server clock minus ours, and RTT, from heartbeat time-sync exchanges
+    sync = {"samples": deque(maxlen=CLOCK_FILTER), "offset_ms": None, "rtt_ms": None}
 
-    # packet loss mechanism
-    expected_snapshot = 1
-    lost_snapshots = 0
+    # packet loss, from seq_num gaps; also reported to the server in heartbeats
+    seqs = new_seq_tracker()
 
     client_id = None
-    players_raw = {}
-    players_smooth = {}
+    rx = new_receiver()
+    playout = rx["playout"]
 
     # We will open CSV files *after* we learn client_id to avoid filename collisions
-    metrics_f = None
-    metrics_w = None
-    disp_f = None
-    disp_w = None
+    metrics_log = None
+    disp_log = None
+    events_log = None
+    epoch = None               # session epoch once the compact header is agreed
+    local_epoch = None         # the same instant on our clock, for what we send
+    token = None               # echoed back to resume the session from a new address
+    delta = False              # server sends deltas: ACK applied snapshots as baselines
+
+    def make_packet(msg_type, snapshot_id, seq_num, ts, payload):
+        if epoch is None:
+            return pack_header(msg_type, snapshot_id, seq_num, ts, payload)
+        return pack_compact(msg_type, snapshot_id, seq_num, ts, payload, local_epoch)
+
+    def make_init(resume=None):
+        # INIT payload: name length, name, flags, then (client_id, token) to resume
+        flags = INIT_FLAG_COMPACT if COMPACT_HEADER else 0
+        payload = bytes([len(client_name)]) + client_name.encode()
+        if resume is None:
+            return payload + bytes([flags])
+        return payload + bytes([flags | INIT_FLAG_RESUME]) + struct.pack(">HI", *resume)
 
     # --------------------------
     # SEND INIT
     # --------------------------
-    init_payload = bytes([len(client_name)]) + client_name.encode()
+    init_payload = make_init()
     pkt = pack_header(MT_INIT, 0, seq_out, monotonic_ms(), init_payload)
     sock.sendto(pkt, SERVER_ADDR)
     seq_out += 1
@@ -80,21 +606,18 @@ def main(client_name="player1"):
             seq_out += 1
             continue
 
-        if len(data) < HDR_LEN:
-            continue
-
-        magic, ver, mtype, snap, seq, ser_ms, plen = struct.unpack(HDR_FMT, data[:HDR_LEN])
-        if magic != MAGIC or ver != VERSION or mtype != MT_ACK:
+        header = parse_header(data)
+        if header is None or header[0] != MT_INIT:
             continue
+        mtype, snap, seq, ser_ms, plen, hdr_len = header
 
-        payload = data[HDR_LEN:HDR_LEN+plen]
-        if len(payload) < 3:
+        payload = data[hdr_len:hdr_len+plen]
+        if len(payload) < ENTITY_LEN:
             continue
 
-        cid, x, y = struct.unpack(">BBB", payload)
-        client_id = int(cid)
-        players_raw[client_id] = (float(x), float(y))
-        players_smooth[client_id] = (float(x), float(y))
+        client_id, x, y, epoch, token, delta = parse_init_reply(payload)
+        local_epoch = monotonic_ms()
+        track_seq(seqs, seq)
         print(f"Connected as client {client_id} at ({x},{y})")
 
         # Now open per-client CSV files (safe from collisions)
@@ -104,169 +627,296 @@ def main(client_name="player1"):
         # Ensure no leftover files with same name; open fresh
         if os.path.exists(metrics_fname):
             os.remove(metrics_fname)
-        if os.path.exists(disp_fname):
+        if os.path.exists(disp_fname) and not HEADLESS:
             os.remove(disp_fname)
 
-        metrics_f = open(metrics_fname, "w", newline="")
-        metrics_w = csv.writer(metrics_f)
-        metrics_w.writerow([
-            "client_id","snapshot_id","seq_num",
-            "server_timestamp_ms","recv_time_ms",
-            "latency_ms","jitter_ms","lost_snapshots"
-        ])
-        metrics_f.flush()
-
-        disp_f = open(disp_fname, "w", newline="")
-        disp_w = csv.writer(disp_f)
-        disp_w.writerow(["timestamp_ms","snapshot_id","player_id","displayed_x","displayed_y"])
-        disp_f.flush()
-
-    # EVENT RDT
-    event_seq = 0
-    outstanding_event = None
-    next_event_time = time.time() + 2.0
+        metrics_log = telemetry.TelemetryWriter(metrics_fname, METRICS_FIELDS, METRICS_TYPES)
+        if not HEADLESS:
+            disp_log = telemetry.TelemetryWriter(disp_fname, DISPLAY_FIELDS, DISPLAY_TYPES)
+        events_log = telemetry.TelemetryWriter("client_events.csv", [
+            "event_seq","first_sent_ms","acked_ms","delivery_ms","attempts","rto_ms"
+        ], ["u4","i8","i8","f8","u4","f8"])
+
+    # SESSION LIVENESS: periodic heartbeats (also time sync), resume when the server goes quiet
+    last_heard = time.monotonic()
+    last_resume = 0.0
+    next_heartbeat = last_heard   # start with a burst to get a clock offset quickly
+    heartbeats = 0
+    rebind_at = REBIND_AT
+
+    def send(msg_type, snapshot_id, payload):
+        nonlocal seq_out
+        # stamp at send time: now_ms may predate a blocking recv
+        sent_ms = monotonic_ms()
+        pkt = make_packet(msg_type, snapshot_id, seq_out, sent_ms, payload)
+        sock.sendto(pkt, SERVER_ADDR)
+        seq_out += 1
+        return sent_ms
 
-    def send_critical_event(event_type, now_ms):
-        nonlocal event_seq, seq_out, outstanding_event
-        event_seq += 1
-        payload = struct.pack(">BI", event_type, event_seq)
-        pkt = pack_header(MT_EVENT, 0, seq_out, now_ms, payload)
+    def request_resume():
+        nonlocal seq_out, last_resume
+        resume = (client_id, token) if token is not None else None
+        pkt = pack_header(MT_INIT, 0, seq_out, monotonic_ms(), make_init(resume))
         sock.sendto(pkt, SERVER_ADDR)
         seq_out += 1
+        last_resume = time.monotonic()
+
+    # EVENT RDT: sliding window with selective ACKs and an adaptive RTO
+    event_seq = 0
+    in_flight = {}             # event_seq -> event state
+    rtt = {"srtt": None, "rttvar": None, "rto": EVENT_RTO_MS}
+    next_event_time = time.monotonic() + 2.0
+
+    def transmit_event(ev):
+        payload = struct.pack(">BI", ev["type"], ev["seq"])
+        ev["last"] = send(MT_EVENT, 0, payload)
+        return ev["last"]
 
-        outstanding_event = {
+    def send_critical_event(event_type):
+        nonlocal event_seq
+        event_seq += 1
+        ev = {
             "seq": event_seq,
             "type": event_type,
             "attempts": 1,
-            "last": now_ms
+            "rto": rtt["rto"]
         }
-
-        print(f"[EVENT] Sent event {event_type}, seq={event_seq}")
-
-    start = time.time()
-    last_applied = 0
+        in_flight[event_seq] = ev
+        ev["first"] = transmit_event(ev)
+
+        trace(f"[EVENT] Sent event {event_type}, seq={event_seq}")
+
+    def handle_event_ack(ack_payload, recv_ms):
+        acked, cum_ack = parse_event_ack(ack_payload)
+        for ev_seq in list(in_flight):
+            if ev_seq > cum_ack and ev_seq not in acked:
+                continue
+            ev = in_flight.pop(ev_seq)
+            # Karn: only unambiguous (never retransmitted) events give RTT samples
+            if ev["attempts"] == 1:
+                update_rto(rtt, recv_ms - ev["first"])
+            events_log.write([ev_seq, ev["first"], recv_ms, recv_ms - ev["first"],
+                              ev["attempts"], rtt["rto"]])
+            trace(f"[EVENT-ACK] seq={ev_seq}")
+
+    start = time.monotonic()
+    frame_interval = 1 / RENDER_HZ
+    next_frame = start
+    # datagrams land in one reused buffer and are parsed through views of it;
+    # anything kept past this iteration (fragments) is copied out
+    recv_buf = bytearray(RECV_BUFFER)
+    recv_view = memoryview(recv_buf)
 
     # =====================================================
     #            MAIN RECEIVE / UPDATE LOOP
     # =====================================================
-    while time.time() - start < RUN_SECONDS:
-        now_ms = monotonic_ms()
-
-        # Receive packet
+    while time.monotonic() - start < RUN_SECONDS:
+        # Receive packet, waking up in time for the next frame
+        sock.settimeout(max(0.001, next_frame - time.monotonic()))
         try:
-            data, _ = sock.recvfrom(4096)
-            recv_ms = monotonic_ms()
+            data = recv_view[:sock.recv_into(recv_buf)]
+            recv_us = monotonic_us()
+            recv_ms = recv_us // 1000
         except socket.timeout:
             data = None
 
-        if data and len(data) >= HDR_LEN:
-            magic, ver, mtype, snap, seq, ser_ms, plen = struct.unpack(
-                HDR_FMT, data[:HDR_LEN]
-            )
-            payload = data[HDR_LEN:HDR_LEN+plen]
+        header = parse_header(data, epoch) if data else None
+        if header is not None:
+            mtype, snap, seq, ser_ms, plen, hdr_len = header
+            payload = data[hdr_len:hdr_len+plen]
+            last_heard = time.monotonic()
+            # INIT replies are counted below, once we know which session sent them
+            if mtype != MT_INIT:
+                lost_before = seqs["lost"]
+                track_seq(seqs, seq)
+                if seqs["lost"] > lost_before:
+                    trace(f"[LOSS] {seqs['lost'] - lost_before} packets lost before seq {seq} "
+                          f"(total={seqs['lost']})")
+
+            # event ACKs piggybacked on any packet, even a stale snapshot
+            if len(data) > hdr_len + plen:
+                for kind, body in parse_trailers(data[hdr_len+plen:]):
+                    if kind == TRAILER_EVENT_ACK and len(body) >= 4:
+                        handle_event_ack(body, recv_ms)
 
             # --------------------------
             # SNAPSHOT PROCESSING
             # --------------------------
-            if mtype == MT_SNAPSHOT:
-
-                # ---- PACKET LOSS ESTIMATION ----
-                if snap > expected_snapshot:
-                    lost_here = snap - expected_snapshot
-                    lost_snapshots += lost_here
-                    print(f"[LOSS] {lost_here} snapshots lost before {snap} (total={lost_snapshots})")
-                expected_snapshot = snap + 1
-
-                # ---- DUPLICATE / OLD CHECK ----
-                if snap <= last_applied:
+            if mtype in (MT_SNAPSHOT, MT_SNAPSHOT_DELTA, MT_SNAPSHOT_FRAG):
+                # duplicate, too late, incomplete or undecodable -> None
+                new_frame = receive_snapshot(rx, mtype, snap, ser_ms, payload)
+                if new_frame is None:
                     continue
 
-                if plen < 2:
-                    continue
-
-                (num_players,) = struct.unpack_from(">H", payload, 0)
-                offset = 2
-
-                new_positions = {}
-                for _ in range(num_players):
-                    if offset + 3 > len(payload):
-                        break
-                    pid, x, y = struct.unpack_from(">BBB", payload, offset)
-                    offset += 3
-                    new_positions[int(pid)] = (float(x), float(y))
-
-                # latency & jitter
-                latency = recv_ms - ser_ms
-                jitter = 0 if last_recv is None else abs((recv_ms - last_recv))
-                last_recv = recv_ms
-
-                # apply smoothing
-                for pid, pos in new_positions.items():
-                    players_raw[pid] = pos
-                for pid, raw_pos in players_raw.items():
-                    old_pos = players_smooth.get(pid)
-                    players_smooth[pid] = smooth_pos(old_pos, raw_pos)
-
-                # log displayed positions
-                for pid, (sx, sy) in players_smooth.items():
-                    # ensure consistent primitive types
-                    disp_w.writerow([int(recv_ms), int(snap), int(pid), float(sx), float(sy)])
-                disp_f.flush()
+                # ACK the applied snapshot so the server can delta against it
+                if delta:
+                    send(MT_ACK, snap, b"")
+
+                # one-way latency in our clock (NaN until the first time sync)
+                # and RFC 3550 interarrival jitter, which needs no sync
+                offset_ms = sync["offset_ms"]
+                latency = float("nan") if offset_ms is None else recv_ms - (ser_ms - offset_ms)
+                transit = recv_ms - ser_ms
+                if last_transit is not None:
+                    jitter += (abs(transit - last_transit) - jitter) / 16
+                last_transit = transit
+
+                if not HEADLESS:
+                    playout_insert(playout, snap, ser_ms, new_frame, recv_ms)
+                # what the jitter buffer adds on top of network latency
+                buffer_ms = float("nan")
+                if playout["delay_ms"] is not None:
+                    buffer_ms = playout["delay_ms"] - playout["lat_mean"]
 
                 # metrics log
-                metrics_w.writerow([
+                metrics_log.write([
                     int(client_id), int(snap), int(seq),
                     int(ser_ms), int(recv_ms),
-                    float(latency), float(jitter), int(lost_snapshots)
+                    float(latency), float(jitter),
+                    float("nan") if sync["rtt_ms"] is None else sync["rtt_ms"],
+                    float("nan") if offset_ms is None else offset_ms,
+                    int(seqs["lost"]),
+                    int(rx["partial"]), float(buffer_ms), int(rx["late"])
                 ])
-                metrics_f.flush()
 
-                last_applied = snap
-                print(f"[SNAP {snap}] latency={latency}, jitter={jitter}, lost_total={lost_snapshots}")
+                trace(f"[SNAP {snap}] latency={latency:.2f}, jitter={jitter:.2f}, lost_total={seqs['lost']}")
 
             # --------------------------
             # EVENT ACK
             # --------------------------
             elif mtype == MT_ACK and plen >= 4:
-                (ack_seq,) = struct.unpack(">I", payload[:4])
-                if outstanding_event and ack_seq == outstanding_event["seq"]:
-                    print(f"[EVENT-ACK] seq={ack_seq}")
-                    outstanding_event = None
+                handle_event_ack(payload, recv_ms)
+
+            # --------------------------
+            # TIME SYNC REPLY
+            # --------------------------
+            elif mtype == MT_HEARTBEAT and plen >= 24:
+                t0, t1, t2 = struct.unpack_from(">QQQ", payload)
+                update_clock(sync, t0, t1, t2, recv_us)
+
+            # --------------------------
+            # INIT REPLY (session resumed, or replaced after eviction)
+            # --------------------------
+            elif mtype == MT_INIT and plen >= ENTITY_LEN:
+                cid, _, _, new_epoch, token, delta = parse_init_reply(payload)
+                if new_epoch != epoch:
+                    # a resume keeps the epoch; a replaced session starts a new one
+                    epoch, local_epoch = new_epoch, recv_ms
+                if cid != client_id:
+                    print(f"[SESSION] Session expired, reconnected as client {cid}")
+                    client_id = cid
+                    # the new session numbers its packets from scratch
+                    seqs = new_seq_tracker()
+                else:
+                    trace(f"[SESSION] Resumed as client {cid}")
+                track_seq(seqs, seq)
+
+        # --------------------------
+        # RENDER FRAME
+        # --------------------------
+        now = time.monotonic()
+        if now >= next_frame:
+            next_frame = max(next_frame + frame_interval, now)
+            frame_ms = monotonic_ms()
+            frame = None if HEADLESS else playout_render(playout, frame_ms)
+            if frame is not None:
+                # logged against the server tick on screen, so compute_error
+                # compares with the state the client is actually showing
+                render_snap, shown = frame
+                log_display(disp_log, frame_ms, int(round(render_snap)), shown)
 
         # --------------------------
         # EVENT RDT RETRANSMISSION
         # --------------------------
-        if outstanding_event:
-            if now_ms - outstanding_event["last"] >= EVENT_RTO_MS:
-                if outstanding_event["attempts"] >= MAX_EVENT_RETRIES:
-                    print(f"[EVENT] Giving up on seq={outstanding_event['seq']}")
-                    outstanding_event = None
-                else:
-                    # retransmit
-                    payload = struct.pack(">BI",
-                                          outstanding_event["type"],
-                                          outstanding_event["seq"])
-                    pkt = pack_header(MT_EVENT, 0, seq_out, now_ms, payload)
-                    sock.sendto(pkt, SERVER_ADDR)
-                    seq_out += 1
-                    outstanding_event["attempts"] += 1
-                    outstanding_event["last"] = now_ms
-                    print(f"[EVENT] Retransmit seq={outstanding_event['seq']} attempt {outstanding_event['attempts']}")
+        now_ms = monotonic_ms()
+        for ev in list(in_flight.values()):
+            if now_ms - ev["last"] < ev["rto"]:
+                continue
+            if ev["attempts"] >= MAX_EVENT_RETRIES:
+                print(f"[EVENT] Giving up on seq={ev['seq']}")
+                del in_flight[ev["seq"]]
+                events_log.write([ev["seq"], ev["first"], -1, -1.0, ev["attempts"], rtt["rto"]])
+                continue
+            # retransmit with exponential backoff
+            ev["attempts"] += 1
+            ev["rto"] = min(MAX_EVENT_RTO_MS, ev["rto"] * 2)
+            transmit_event(ev)
+            trace(f"[EVENT] Retransmit seq={ev['seq']} attempt {ev['attempts']}")
+
+        # --------------------------
+        # SESSION LIVENESS
+        # --------------------------
+        now = time.monotonic()
+        if rebind_at is not None and now - start >= rebind_at:
+            # switch local ports, as a NAT rebinding would, and resume from there
+            rebind_at = None
+            sock.close()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(0.1)
+            print("[SESSION] Rebound to a new local port, resuming")
+            request_resume()
+        elif now - last_heard >= SERVER_TIMEOUT:
+            if now - last_resume >= HEARTBEAT_INTERVAL:
+                request_resume()
+        elif now >= next_heartbeat:
+            # time-sync t0 plus a receiver report for the server's rate control
+            rtt_ms = min(0xFFFF, max(1, round(sync["rtt_ms"]))) if sync["rtt_ms"] is not None else 0
+            report = struct.pack(">QIIH", monotonic_us(), seqs["highest"] or 0,
+                                 seqs["received"] & 0xFFFFFFFF, rtt_ms)
+            send(MT_HEARTBEAT, 0, report)
+            heartbeats += 1
+            next_heartbeat = now + (SYNC_BURST_INTERVAL if heartbeats < SYNC_BURST
+                                    else HEARTBEAT_INTERVAL)
 
         # --------------------------
         # GENERATE NEXT CRITICAL EVENT
         # --------------------------
-        if outstanding_event is None and time.time() >= next_event_time:
-            send_critical_event(event_type=2, now_ms=now_ms)
-            next_event_time = time.time() + 1.5
+        while len(in_flight) < EVENT_WINDOW and time.monotonic() >= next_event_time:
+            send_critical_event(event_type=2)
+            next_event_time += EVENT_INTERVAL
+
+    if rx["undecodable"]:
+        print(f"[DELTA] {rx['undecodable']} deltas dropped for missing baseline")
 
     # Cleanup
-    if metrics_f:
-        metrics_f.close()
-    if disp_f:
-        disp_f.close()
+    for log in (metrics_log, disp_log, events_log):
+        if log is not None:
+            log.close()
+            if log.dropped:
+                print(f"[LOG] {log.dropped} records dropped (buffer full)")
     sock.close()
     print("Client finished.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GCL1 game client.")
+    parser.add_argument("--server", default=f"{SERVER_ADDR[0]}:{SERVER_ADDR[1]}",
+                        help="Server (or impairment proxy) host:port (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=RUN_SECONDS,
+                        help="Seconds to run before exiting (default: %(default)s)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Suppress per-packet console output")
+    parser.add_argument("--log-format", choices=["csv", "bin"], default=telemetry.FORMAT,
+                        help="Write logs as CSV or fixed-width binary records (see binlog.py)")
+    parser.add_argument("--event-interval", type=float, default=EVENT_INTERVAL,
+                        help="Seconds between critical events (default: %(default)s)")
+    parser.add_argument("--compact-header", action="store_true",
+                        help="Negotiate the compact variable-length header with the server")
+    parser.add_argument("--render-hz", type=int, default=RENDER_HZ,
+                        help="Frames per second rendered from the playout buffer (default: %(default)s)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Decode, ACK and log metrics only: no rendering or client_display log")
+    parser.add_argument("--rebind-at", type=float, default=REBIND_AT,
+                        help="Switch to a new local port this many seconds in and resume the session")
+    args = parser.parse_args()
+
+    host, _, port = args.server.rpartition(":")
+    SERVER_ADDR = (host, int(port))
+    RUN_SECONDS = args.duration
+    QUIET = args.quiet
+    COMPACT_HEADER = args.compact_header
+    REBIND_AT = args.rebind_at
+    HEADLESS = args.headless
+    RENDER_HZ = args.render_hz
+    EVENT_INTERVAL = args.event_interval
+    telemetry.FORMAT = args.log_format
     main("player1")
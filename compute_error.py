@@ -5,12 +5,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 
+import binlog
+
 # -----------------------------------------------------
 #   LOAD DATA
 # -----------------------------------------------------
 def load_csv(server_path, client_path):
-    server = pd.read_csv(server_path)
-    client = pd.read_csv(client_path)
+    # CSV or binary (.bin) logs are both accepted
+    server = binlog.load_frame(server_path)
+    client = binlog.load_frame(client_path)
 
     # Necessary columns must exist
     for col in ["snapshot_id", "player_id", "x", "y"]:
@@ -48,11 +51,14 @@ def compute_errors(server, client):
 #   SAVE ERROR CSV AND PLOTS
 # -----------------------------------------------------
 def save_outputs(errors_df, out_csv, out_plot_dir):
-    os.makedirs(os.path.dirname(out_csv), exist_ok=True)
+    os.makedirs(os.path.dirname(out_csv) or ".", exist_ok=True)
     os.makedirs(out_plot_dir, exist_ok=True)
 
-    # Save CSV
-    errors_df.to_csv(out_csv, index=False)
+    # Save CSV (or a binary log when asked for .bin)
+    if out_csv.endswith(".bin"):
+        binlog.write_frame(errors_df, out_csv)
+    else:
+        errors_df.to_csv(out_csv, index=False)
 
     # Time-series plot
     plt.figure(figsize=(10,5))
@@ -82,9 +88,9 @@ def save_outputs(errors_df, out_csv, out_plot_dir):
 # -----------------------------------------------------
 def main():
     parser = argparse.ArgumentParser(description="Compute client prediction error.")
-    parser.add_argument("--server", required=True, help="Path to server_positions.csv")
-    parser.add_argument("--client", required=True, help="Path to client_display.csv")
-    parser.add_argument("--out_csv", required=True, help="Path for saving error_results.csv")
+    parser.add_argument("--server", required=True, help="Path to server_positions.csv (or .bin)")
+    parser.add_argument("--client", required=True, help="Path to client_display.csv (or .bin)")
+    parser.add_argument("--out_csv", required=True, help="Path for saving error_results.csv (or .bin)")
     parser.add_argument("--out_plot", required=True, help="Directory to save plots")
     args = parser.parse_args()
 
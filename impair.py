@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+import argparse, csv, heapq, math, random, selectors, signal, socket, time
+
+# ======================================================
+#                 PROXY CONFIGURATION
+# ======================================================
+# Clients talk to LISTEN_ADDR; each client address gets its own socket
+# towards the server, so the server still sees one address per client.
+# Every packet is scheduled on a single timer heap and sent from one
+# selector loop: no thread or sleep per packet.
+LISTEN_ADDR = ("127.0.0.1", 7777)
+SERVER_ADDR = ("127.0.0.1", 7778)
+RECV_BATCH = 64            # datagrams drained from one socket per wakeup
+IDLE_TIMEOUT = 60.0        # forget a client's upstream socket after this much silence
+IDLE_POLL = 1.0
+DEFAULT_LIMIT_MS = 1000    # rate-limited queue depth before tail drop
+
+SPEC_KEYS = {
+    "loss": float,         # % of packets dropped
+    "delay": float,        # ms added to every packet
+    "jitter": float,       # ms, standard deviation around `delay` (clipped at 0)
+    "reorder": float,      # % of packets sent without the delay, overtaking others
+    "dup": float,          # % of packets sent twice
+    "rate": float,         # kbit/s link rate; packets queue behind each other
+    "limit": float,        # ms of queued data beyond which rate-limited packets drop
+    "trace": str,          # per-packet delay/loss trace replayed instead of loss/delay/jitter
+}
+
+
+def parse_spec(text):
+    """'loss=2,delay=50,jitter=10' -> {'loss': 2.0, 'delay': 50.0, 'jitter': 10.0}"""
+    spec = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        key, sep, value = item.partition("=")
+        if not sep or key not in SPEC_KEYS:
+            raise ValueError(f"bad impairment '{item}' (keys: {', '.join(SPEC_KEYS)})")
+        spec[key] = SPEC_KEYS[key](value)
+    return spec
+
+
+def load_trace(path):
+    """Per-packet delays in seconds, None for a lost packet.
+
+    The CSV needs a delay_ms column; an optional lost column (non-zero =
+    lost), an empty or NaN delay, or a negative one also mark a loss.
+    """
+    delays = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            lost = row.get("lost", "0").strip() not in ("", "0")
+            try:
+                delay = float(row["delay_ms"])
+            except (KeyError, ValueError):
+                delay = math.nan
+            if lost or math.isnan(delay) or delay < 0:
+                delays.append(None)
+            else:
+                delays.append(delay / 1000)
+    if not delays:
+        raise ValueError(f"empty trace: {path}")
+    return delays
+
+# ======================================================
+#                 ONE DIRECTION OF THE LINK
+# ======================================================
+class Link:
+    """Impairments for one direction, with its own seeded RNG."""
+
+    def __init__(self, spec, seed=None):
+        self.rng = random.Random(seed)
+        self.loss = spec.get("loss", 0.0) / 100
+        self.delay = spec.get("delay", 0.0) / 1000
+        self.jitter = spec.get("jitter", 0.0) / 1000
+        self.reorder = spec.get("reorder", 0.0) / 100
+        self.dup = spec.get("dup", 0.0) / 100
+        self.rate = spec.get("rate", 0.0) * 1000          # bit/s, 0 = unlimited
+        self.limit = spec.get("limit", DEFAULT_LIMIT_MS) / 1000
+        self.trace = load_trace(spec["trace"]) if "trace" in spec else None
+        self.trace_pos = 0
+        self.link_free = 0.0      # when the rate-limited link finishes its backlog
+        self.stats = {"packets": 0, "sent": 0, "lost": 0, "queue_drops": 0,
+                      "duplicated": 0, "reordered": 0}
+
+    def sample_delay(self):
+        """Delay in seconds for one copy of a packet, or None to drop it."""
+        if self.trace is not None:
+            delay = self.trace[self.trace_pos]
+            self.trace_pos = (self.trace_pos + 1) % len(self.trace)
+            return delay
+        if self.loss and self.rng.random() < self.loss:
+            return None
+        if self.jitter:
+            return max(0.0, self.rng.gauss(self.delay, self.jitter))
+        return self.delay
+
+    def schedule(self, now, size):
+        """Send times (monotonic seconds) for a packet arriving `now`; [] if dropped."""
+        stats = self.stats
+        stats["packets"] += 1
+        copies = 1
+        if self.dup and self.rng.random() < self.dup:
+            copies = 2
+            stats["duplicated"] += 1
+
+        times = []
+        for _ in range(copies):
+            delay = self.sample_delay()
+            if delay is None:
+                stats["lost"] += 1
+                continue
+            depart = now
+            if self.rate:
+                # serialize behind the packets already queued on the link
+                start = max(now, self.link_free)
+                if start - now > self.limit:
+                    stats["queue_drops"] += 1
+                    continue
+                self.link_free = depart = start + size * 8 / self.rate
+            if self.reorder and self.rng.random() < self.reorder:
+                stats["reordered"] += 1
+                delay = 0.0
+            times.append(depart + delay)
+        stats["sent"] += len(times)
+        return times
+
+# ======================================================
+#                 PROXY LOOP
+# ======================================================
+def run_proxy(up, down, duration=None):
+    front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    front.bind(LISTEN_ADDR)
+    front.setblocking(False)
+
+    sel = selectors.DefaultSelector()
+    sel.register(front, selectors.EVENT_READ, None)
+    peers = {}                 # client addr -> [upstream socket, last packet time]
+    timers = []                # (send_time, n, socket, client addr or None, data)
+    n = 0
+
+    print(f"PROXY {LISTEN_ADDR} -> {SERVER_ADDR}")
+    # treat SIGTERM like Ctrl-C so the summary is still printed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    stop = None if duration is None else time.monotonic() + duration
+    next_idle_check = time.monotonic() + IDLE_POLL
+
+    try:
+        while stop is None or time.monotonic() < stop:
+            now = time.monotonic()
+            timeout = min(IDLE_POLL, max(0.0, timers[0][0] - now)) if timers else IDLE_POLL
+            for key, _ in sel.select(timeout):
+                sock, client_addr = key.fileobj, key.data
+                for _ in range(RECV_BATCH):
+                    try:
+                        data, addr = sock.recvfrom(65535)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+                    now = time.monotonic()
+                    if client_addr is None:
+                        # client -> server
+                        peer = peers.get(addr)
+                        if peer is None:
+                            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                            upstream.setblocking(False)
+                            upstream.connect(SERVER_ADDR)
+                            sel.register(upstream, selectors.EVENT_READ, addr)
+                            peer = peers[addr] = [upstream, now]
+                        peer[1] = now
+                        for t in up.schedule(now, len(data)):
+                            heapq.heappush(timers, (t, n, peer[0], None, data))
+                            n += 1
+                    else:
+                        # server -> client
+                        for t in down.schedule(now, len(data)):
+                            heapq.heappush(timers, (t, n, front, client_addr, data))
+                            n += 1
+
+            now = time.monotonic()
+            while timers and timers[0][0] <= now:
+                _, _, sock, addr, data = heapq.heappop(timers)
+                try:
+                    if addr is None:
+                        sock.send(data)
+                    else:
+                        sock.sendto(data, addr)
+                except OSError:
+                    pass   # server not up yet, or the upstream socket was expired
+
+            if now >= next_idle_check:
+                next_idle_check = now + IDLE_POLL
+                for addr, (upstream, last) in list(peers.items()):
+                    if now - last >= IDLE_TIMEOUT:
+                        sel.unregister(upstream)
+                        upstream.close()
+                        del peers[addr]
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for upstream, _ in peers.values():
+            upstream.close()
+        front.close()
+
+    for name, link in (("up", up), ("down", down)):
+        s = link.stats
+        print(f"[{name}] packets={s['packets']} sent={s['sent']} lost={s['lost']} "
+              f"queue_drops={s['queue_drops']} duplicated={s['duplicated']} "
+              f"reordered={s['reordered']}")
+
+
+def parse_addr(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="UDP impairment proxy (userspace netem) between clients and server.py.",
+        epilog="SPEC is comma-separated key=value: loss (%%), delay (ms), jitter (ms), "
+               "reorder (%%), dup (%%), rate (kbit/s), limit (ms queued), trace (CSV path)."
+    )
+    parser.add_argument("--listen", type=parse_addr, default=LISTEN_ADDR,
+                        help="host:port clients connect to (default: 127.0.0.1:7777)")
+    parser.add_argument("--server", type=parse_addr, default=SERVER_ADDR,
+                        help="host:port of server.py (default: 127.0.0.1:7778)")
+    parser.add_argument("--both", metavar="SPEC", default="",
+                        help="Impairments applied in both directions")
+    parser.add_argument("--up", metavar="SPEC", default="",
+                        help="Client -> server impairments (override --both)")
+    parser.add_argument("--down", metavar="SPEC", default="",
+                        help="Server -> client impairments (override --both)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed the per-direction RNGs for a reproducible run")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Exit (and print stats) after this many seconds")
+    args = parser.parse_args()
+
+    try:
+        both = parse_spec(args.both)
+        up_spec = {**both, **parse_spec(args.up)}
+        down_spec = {**both, **parse_spec(args.down)}
+    except ValueError as e:
+        parser.error(str(e))
+
+    LISTEN_ADDR = args.listen
+    SERVER_ADDR = args.server
+    # independent streams, so changing one direction leaves the other's draws alone
+    up_seed = None if args.seed is None else args.seed * 2
+    down_seed = None if args.seed is None else args.seed * 2 + 1
+    run_proxy(Link(up_spec, up_seed), Link(down_spec, down_seed), args.duration)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import math, threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ======================================================
+#                 SHARDED INSTRUMENTS
+# ======================================================
+# Every thread that records gets its own shard, registered once under a
+# lock; after that an increment only touches the calling thread's shard,
+# so the hot path takes no lock. Readers sum the shards. Shard key sets
+# are fixed at creation (keyed counters use a nested dict), so a reader
+# never iterates a dict that another thread is resizing.
+class _Sharded:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def local(self):
+        """The calling thread's shard."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def shards(self):
+        with self._lock:
+            return list(self._shards)
+
+
+class Counters(_Sharded):
+    """Monotonic counters, e.g. stats.local()["packets_recv"] += 1.
+
+    `names` maps counter name -> help text. `keyed` maps name -> (label,
+    help) for counters split by a key: stats.local()["dropped"]["oversize"] += 1.
+    """
+
+    def __init__(self, names, keyed=None):
+        super().__init__()
+        self.names = dict(names)
+        self.keyed = dict(keyed or {})
+
+    def _new_shard(self):
+        shard = dict.fromkeys(self.names, 0)
+        for name in self.keyed:
+            shard[name] = defaultdict(int)
+        return shard
+
+    def totals(self):
+        shards = self.shards()
+        return {name: sum(s[name] for s in shards) for name in self.names}
+
+    def keyed_totals(self, name):
+        out = defaultdict(int)
+        for s in self.shards():
+            # dict() copies in one step, so the owner may keep adding keys
+            for key, value in dict(s[name]).items():
+                out[key] += value
+        return dict(out)
+
+
+# Histogram buckets are log-spaced: HIST_SUB per power of two, from
+# 2**HIST_MIN_EXP to 2**HIST_MAX_EXP. Out-of-range values land in the
+# first or last bucket.
+HIST_SUB = 2
+HIST_MIN_EXP = -4
+HIST_MAX_EXP = 24
+HIST_BOUNDS = [2.0 ** e * (1 + j / HIST_SUB)
+               for e in range(HIST_MIN_EXP, HIST_MAX_EXP) for j in range(1, HIST_SUB + 1)]
+
+
+class Histogram(_Sharded):
+    """Log-bucketed distribution; observe() is lock-free like Counters."""
+
+    def __init__(self, help_text):
+        super().__init__()
+        self.help = help_text
+
+    def _new_shard(self):
+        return [0] * len(HIST_BOUNDS) + [0.0]     # bucket counts, then the sum
+
+    def observe(self, value):
+        shard = self.local()
+        if value > 0:
+            mant, exp = math.frexp(value)        # value = mant * 2**exp, mant in [0.5, 1)
+            # bucket upper bound: smallest 2**(exp-1) * (1 + j/HIST_SUB) >= value
+            j = math.ceil((mant * 2 - 1) * HIST_SUB)
+            index = (exp - 1 - HIST_MIN_EXP) * HIST_SUB + j - 1
+            index = min(len(HIST_BOUNDS) - 1, max(0, index))
+        else:
+            index = 0
+        shard[index] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """(bucket counts, sum) over all threads."""
+        counts = [0] * (len(HIST_BOUNDS) + 1)
+        for shard in self.shards():
+            for i, v in enumerate(shard):
+                counts[i] += v
+        return counts[:-1], counts[-1]
+
+# ======================================================
+#                 TEXT EXPOSITION
+# ======================================================
+class Registry:
+    """Named instruments rendered in the Prometheus text format."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.counters = []
+        self.histograms = {}
+        self.gauges = {}
+
+    def add_counters(self, counters):
+        self.counters.append(counters)
+        return counters
+
+    def add_histogram(self, name, help_text):
+        self.histograms[name] = Histogram(help_text)
+        return self.histograms[name]
+
+    def add_gauge(self, name, help_text, read):
+        """`read` is called at scrape time and returns the current value."""
+        self.gauges[name] = (help_text, read)
+
+    def render(self):
+        p = self.prefix
+        lines = []
+        for counters in self.counters:
+            totals = counters.totals()
+            for name, help_text in counters.names.items():
+                lines += [f"# HELP {p}{name}_total {help_text}",
+                          f"# TYPE {p}{name}_total counter",
+                          f"{p}{name}_total {totals[name]}"]
+            for name, (label, help_text) in counters.keyed.items():
+                lines += [f"# HELP {p}{name}_total {help_text}",
+                          f"# TYPE {p}{name}_total counter"]
+                for key, value in sorted(counters.keyed_totals(name).items()):
+                    lines.append(f'{p}{name}_total{{{label}="{key}"}} {value}')
+
+        for name, (help_text, read) in self.gauges.items():
+            lines += [f"# HELP {p}{name} {help_text}", f"# TYPE {p}{name} gauge",
+                      f"{p}{name} {read()}"]
+
+        for name, hist in self.histograms.items():
+            counts, total = hist.snapshot()
+            lines += [f"# HELP {p}{name} {hist.help}", f"# TYPE {p}{name} histogram"]
+            # buckets up to the highest one in use; +Inf covers the rest
+            used = max((i for i, c in enumerate(counts) if c), default=-1)
+            cumulative = 0
+            for bound, count in zip(HIST_BOUNDS[:used + 1], counts):
+                cumulative += count
+                lines.append(f'{p}{name}_bucket{{le="{bound:g}"}} {cumulative}')
+            count = sum(counts)
+            lines += [f'{p}{name}_bucket{{le="+Inf"}} {count}',
+                      f"{p}{name}_sum {total}", f"{p}{name}_count {count}"]
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry, host, port):
+    """Serve registry.render() at http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass   # scrapes would flood the server console
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
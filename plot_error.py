@@ -1,22 +1,29 @@
 import csv
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+import binlog
+
 ERROR_FILE = "error_results.csv"
 
-def load_errors():
+def load_errors(path=ERROR_FILE):
+    if binlog.is_binlog(path):
+        records = binlog.load(path)
+        return records["snapshot_id"].tolist(), records["error"].tolist()
+
     snap_ids = []
     errors = []
-    with open(ERROR_FILE, "r") as f:
-        reader = csv.reader(f)
-        next(reader)  # skip header
-        for snap, pid, sx, sy, dx, dy, err in reader:
-            snap_ids.append(int(snap))
-            errors.append(float(err))
+    with open(path, "r") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            snap_ids.append(int(row["snapshot_id"]))
+            errors.append(float(row["error"]))
     return snap_ids, errors
 
 def main():
-    snap_ids, errors = load_errors()
+    # optional argument: error file from compute_error.py (CSV or .bin)
+    snap_ids, errors = load_errors(sys.argv[1] if len(sys.argv) > 1 else ERROR_FILE)
 
     errors_np = np.array(errors)
     mean_error = float(np.mean(errors_np))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import json, mmap, struct
+
+import telemetry
+
+# ======================================================
+#                 FILE FORMAT
+# ======================================================
+# Every datagram the server sends, as it went on the wire:
+#
+#   b"GCLR" | u32 meta_len | meta JSON | records
+#   record: i8 send time (monotonic us) | u4 client_id | u2 length | datagram
+#
+# Little-endian like binlog.py. The meta JSON holds the server settings
+# that shaped the stream (seed, tick rate, world size, ...). Records are
+# appended by a background TelemetryWriter, so sending never waits on disk.
+MAGIC = b"GCLR"
+FORMAT_VERSION = 1
+RECORD_STRUCT = struct.Struct("<qIH")
+META_STRUCT = struct.Struct("<I")
+
+
+class PacketRecorder:
+    """Append-only recording of sent datagrams (see FILE FORMAT)."""
+
+    def __init__(self, path, meta):
+        # "block": a dropped record would replay as a packet the network lost
+        self.log = telemetry.TelemetryWriter(path, None, policy="block")
+        self.path = path
+        head = json.dumps({"version": FORMAT_VERSION, **meta}).encode()
+        self.log.write_raw(MAGIC + META_STRUCT.pack(len(head)) + head)
+
+    def record(self, ts_us, cid, data):
+        self.log.write_raw(RECORD_STRUCT.pack(ts_us, cid, len(data)) + data)
+
+    def close(self):
+        self.log.close()
+
+
+def read_meta(buf):
+    """(meta, offset of the first record) of a mapped recording."""
+    if buf[:4] != MAGIC:
+        raise ValueError("not a packet recording")
+    (meta_len,) = META_STRUCT.unpack_from(buf, 4)
+    meta = json.loads(bytes(buf[8:8 + meta_len]))
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported recording version {meta.get('version')}")
+    return meta, 8 + meta_len
+
+
+def iter_records(buf, offset):
+    """Yield (ts_us, client_id, datagram view) from offset on.
+
+    A record cut short by a server that was killed mid-append is ignored.
+    """
+    view = memoryview(buf)
+    unpack = RECORD_STRUCT.unpack_from
+    head = RECORD_STRUCT.size
+    end = len(buf)
+    while offset + head <= end:
+        ts_us, cid, length = unpack(buf, offset)
+        offset += head
+        if offset + length > end:
+            return
+        yield ts_us, cid, view[offset:offset + length]
+        offset += length
+
+
+def open_recording(path):
+    """Memory-map a recording; returns (mmap, meta, first record offset)."""
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        meta, offset = read_meta(buf)
+    except (ValueError, struct.error):
+        buf.close()
+        raise ValueError(f"{path} is not a packet recording")
+    return buf, meta, offset
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+import argparse, csv, heapq, math, os, sys, time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import client
+import impair
+import recording
+import telemetry
+
+# ======================================================
+#                 VIRTUAL-TIME REPLAY
+# ======================================================
+# A recording (server.py --record) holds every datagram the server sent,
+# stamped with its send time. Each recorded client is played through the
+# client's own receive path (client.receive_snapshot, playout_insert,
+# playout_render, log_display) on a virtual clock: one heap of packet
+# arrivals and RENDER_HZ render ticks, no sockets and no sleeps, so hours
+# of traffic replay in seconds.
+#
+# Arrival time is send time through an impair.Link for the down
+# direction, seeded per client id. Replay is open loop: what the server
+# sent (delta baselines, snapshot rates) is what it decided during the
+# recorded run, and the session setup is taken from the recording.
+#
+# Position error is scored as frames are rendered: every record is also
+# decoded, unimpaired, at its send time, and each frame is compared with
+# that truth for the server tick on screen (the join compute_error.py
+# does between client_display and server_positions).
+SNAPSHOT_TYPES = (client.MT_SNAPSHOT, client.MT_SNAPSHOT_DELTA, client.MT_SNAPSHOT_FRAG)
+TRUTH_FRAMES = 256         # unimpaired snapshots kept per client for scoring
+SUMMARY_FILE = "replay_summary.csv"
+
+SUMMARY_FIELDS = [
+    "client_id", "snapshots", "frames", "loss_pct", "late", "partial", "undecodable",
+    "latency_mean_ms", "error_mean", "error_p50", "error_p95", "error_p99",
+]
+
+
+def link_seed(seed, cid):
+    # per client, so a client's draws don't depend on who else is replayed
+    return None if seed is None else seed * 65536 + cid
+
+
+def percentiles(values, qs):
+    if not values:
+        return [float("nan")] * len(qs)
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(q * len(values)))] for q in qs]
+
+# ======================================================
+#                 ONE RECORDED CLIENT
+# ======================================================
+class ReplayClient:
+    """Receive path, playout, logs and error samples of one client id."""
+
+    def __init__(self, cid, link, out_dir=None, log_format=None):
+        self.cid = cid
+        self.link = link
+        self.rx = client.new_receiver()
+        self.seqs = client.new_seq_tracker()
+        self.epoch = None
+        self.jitter = 0.0
+        self.last_transit = None
+        self.last_arrival = 0          # us, latest scheduled arrival
+        self.rendering = False
+        self.snapshots = 0
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.errors = array("f")
+
+        # the same stream decoded at send time, without impairment
+        self.truth_rx = client.new_receiver()
+        self.truth = OrderedDict()     # snapshot_id -> frame
+        self.truth_cache = (None, {})  # (snapshot_id, {player_id: (x, y)})
+
+        self.metrics_log = self.disp_log = None
+        if out_dir is not None:
+            c_dir = os.path.join(out_dir, f"client_{cid}")
+            os.makedirs(c_dir, exist_ok=True)
+            # "block": virtual time outruns any flush interval
+            self.metrics_log = telemetry.TelemetryWriter(
+                os.path.join(c_dir, "client_metrics.csv"), client.METRICS_FIELDS,
+                client.METRICS_TYPES, policy="block", fmt=log_format)
+            self.disp_log = telemetry.TelemetryWriter(
+                os.path.join(c_dir, "client_display.csv"), client.DISPLAY_FIELDS,
+                client.DISPLAY_TYPES, policy="block", fmt=log_format)
+
+    def sent(self, data):
+        """A record, at its send time: session setup and the truth frames."""
+        header = client.parse_header(data, self.epoch)
+        if header is None:
+            return
+        mtype, snap, _, ser_ms, plen, hdr_len = header
+        payload = data[hdr_len:hdr_len + plen]
+        if mtype == client.MT_INIT and plen >= client.ENTITY_LEN:
+            self.epoch = client.parse_init_reply(payload)[3]
+        elif mtype in SNAPSHOT_TYPES:
+            frame = client.receive_snapshot(self.truth_rx, mtype, snap, ser_ms, payload)
+            if frame is not None:
+                self.truth[snap] = frame
+                if len(self.truth) > TRUTH_FRAMES:
+                    self.truth.popitem(last=False)
+
+    def arrive(self, t_us, data):
+        """A datagram reaching the client at virtual time t_us."""
+        header = client.parse_header(data, self.epoch)
+        if header is None:
+            return
+        mtype, snap, seq, ser_ms, plen, hdr_len = header
+        client.track_seq(self.seqs, seq)
+        if mtype not in SNAPSHOT_TYPES:
+            return
+        frame = client.receive_snapshot(self.rx, mtype, snap, ser_ms,
+                                        data[hdr_len:hdr_len + plen])
+        if frame is None:
+            return
+
+        # one clock on both ends: latency is exact and needs no time sync
+        recv_ms = t_us // 1000
+        latency = recv_ms - ser_ms
+        if self.last_transit is not None:
+            self.jitter += (abs(latency - self.last_transit) - self.jitter) / 16
+        self.last_transit = latency
+        self.snapshots += 1
+        self.latency_sum += latency
+
+        playout = self.rx["playout"]
+        client.playout_insert(playout, snap, ser_ms, frame, recv_ms)
+        if self.metrics_log is not None:
+            buffer_ms = float("nan")
+            if playout["delay_ms"] is not None:
+                buffer_ms = playout["delay_ms"] - playout["lat_mean"]
+            self.metrics_log.write([
+                self.cid, snap, seq, ser_ms, recv_ms, float(latency), float(self.jitter),
+                float("nan"), 0.0, self.seqs["lost"], self.rx["partial"], float(buffer_ms),
+                self.rx["late"],
+            ])
+
+    def render(self, t_us):
+        frame_ms = t_us // 1000
+        frame = client.playout_render(self.rx["playout"], frame_ms)
+        if frame is None:
+            return
+        render_snap, shown = frame
+        snap = int(round(render_snap))
+        self.frames += 1
+        if self.disp_log is not None:
+            client.log_display(self.disp_log, frame_ms, snap, shown)
+
+        if self.truth_cache[0] != snap:
+            truth = self.truth.get(snap)
+            if truth is None:
+                return
+            ids, xs, ys = truth
+            self.truth_cache = (snap, dict(zip(ids, zip(xs, ys))))
+        positions = self.truth_cache[1]
+        hypot = math.hypot
+        for pid, x, y in zip(*shown):
+            pos = positions.get(pid)
+            if pos is not None:
+                self.errors.append(hypot(pos[0] - x, pos[1] - y))
+
+    def close(self):
+        for log in (self.metrics_log, self.disp_log):
+            if log is not None:
+                log.close()
+
+    def summary(self):
+        seqs = self.seqs
+        packets = seqs["received"] + seqs["lost"]
+        errors = list(self.errors)
+        return [
+            self.cid, self.snapshots, self.frames,
+            100.0 * seqs["lost"] / packets if packets else float("nan"),
+            self.rx["late"], self.rx["partial"], self.rx["undecodable"],
+            self.latency_sum / self.snapshots if self.snapshots else float("nan"),
+            sum(errors) / len(errors) if errors else float("nan"),
+        ] + percentiles(errors, (0.50, 0.95, 0.99))
+
+# ======================================================
+#                 EVENT LOOP
+# ======================================================
+def replay(path, down_spec, seed=None, out_dir=None, log_format=None, render_hz=None,
+           only=None, part=(0, 1)):
+    """Replay the clients of one recording whose id % part[1] == part[0].
+
+    Returns (summary rows, error samples as bytes, first and last send
+    time in us).
+    """
+    if render_hz is not None:
+        client.RENDER_HZ = render_hz
+    buf, _, offset = recording.open_recording(path)
+    frame_us = 1_000_000 // client.RENDER_HZ
+    # after its last packet a client keeps rendering through the playout delay
+    linger_us = (client.MAX_PLAYOUT_MS + client.MAX_EXTRAPOLATE_MS) * 1000
+
+    clients = {}
+    events = []                # (time_us, n, ReplayClient, datagram or None to render)
+    n = 0
+    first = last = None
+
+    def run_until(limit):
+        nonlocal n
+        while events and events[0][0] <= limit:
+            t, _, c, data = heapq.heappop(events)
+            if data is not None:
+                c.arrive(t, data)
+            elif t < c.last_arrival + linger_us:
+                c.render(t)
+                heapq.heappush(events, (t + frame_us, n, c, None))
+                n += 1
+            else:
+                c.rendering = False
+
+    for ts_us, cid, data in recording.iter_records(buf, offset):
+        if cid % part[1] != part[0] or (only and cid not in only):
+            continue
+        if first is None:
+            first = ts_us
+        last = ts_us
+        # nothing sent later can arrive before it was sent
+        run_until(ts_us)
+
+        c = clients.get(cid)
+        if c is None:
+            c = clients[cid] = ReplayClient(cid, impair.Link(down_spec, link_seed(seed, cid)),
+                                            out_dir, log_format)
+        c.sent(data)
+        for t in c.link.schedule(ts_us / 1e6, len(data)):
+            t_us = max(ts_us, round(t * 1e6))
+            heapq.heappush(events, (t_us, n, c, data))
+            n += 1
+            c.last_arrival = max(c.last_arrival, t_us)
+            if not c.rendering:
+                c.rendering = True
+                heapq.heappush(events, (t_us, n, c, None))
+                n += 1
+    run_until(math.inf)
+
+    errors = array("f")
+    rows = []
+    for cid in sorted(clients):
+        c = clients[cid]
+        c.close()
+        rows.append(c.summary())
+        errors.extend(c.errors)
+    return rows, errors.tobytes(), first, last
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a server.py --record stream through the client pipeline in virtual time.",
+        epilog="SPEC is an impair.py spec applied server -> client, e.g. 'loss=5,delay=40,jitter=10'."
+    )
+    parser.add_argument("recording", help="File written by server.py --record")
+    parser.add_argument("--down", metavar="SPEC", default="",
+                        help="Impairments applied to the recorded stream")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed the per-client impairment RNGs")
+    parser.add_argument("--client", type=int, action="append", default=None,
+                        help="Replay only this client id (repeatable; default: all)")
+    parser.add_argument("--render-hz", type=int, default=client.RENDER_HZ,
+                        help="Frames rendered per virtual second (default: %(default)s)")
+    parser.add_argument("--out", default=None,
+                        help="Write client_<id>/client_display and client_metrics logs and "
+                             f"{SUMMARY_FILE} here (default: summary on stdout only)")
+    parser.add_argument("--log-format", choices=["csv", "bin"], default=telemetry.FORMAT,
+                        help="Format of the --out logs")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes, each replaying a share of the clients")
+    args = parser.parse_args()
+
+    try:
+        spec = impair.parse_spec(args.down)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+    only = set(args.client) if args.client else None
+    common = (args.recording, spec, args.seed, args.out, args.log_format, args.render_hz, only)
+
+    started = time.monotonic()
+    try:
+        if args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                results = list(pool.map(replay, *zip(*[common + ((i, args.jobs),)
+                                                        for i in range(args.jobs)])))
+        else:
+            results = [replay(*common)]
+    except ValueError as e:
+        sys.exit(str(e))
+    wall = time.monotonic() - started
+
+    rows = sorted(row for r in results for row in r[0])
+    if not rows:
+        sys.exit(f"no client packets in {args.recording}")
+    errors = array("f")
+    for r in results:
+        errors.frombytes(r[1])
+    span_s = (max(r[3] for r in results if r[3] is not None)
+              - min(r[2] for r in results if r[2] is not None)) / 1e6
+
+    print(f"{'client':>6} {'snaps':>8} {'loss %':>7} {'late':>6} {'lat ms':>7} "
+          f"{'err mean':>8} {'p50':>6} {'p95':>6} {'p99':>6}")
+    for r in rows:
+        print(f"{r[0]:>6} {r[1]:>8} {r[3]:>7.2f} {r[4]:>6} {r[7]:>7.1f} "
+              f"{r[8]:>8.3f} {r[9]:>6.2f} {r[10]:>6.2f} {r[11]:>6.2f}")
+    values = list(errors)
+    mean = sum(values) / len(values) if values else float("nan")
+    p50, p95, p99 = percentiles(values, (0.50, 0.95, 0.99))
+    print(f"{'all':>6} {sum(r[1] for r in rows):>8} {'':>7} {sum(r[4] for r in rows):>6} {'':>7} "
+          f"{mean:>8.3f} {p50:>6.2f} {p95:>6.2f} {p99:>6.2f}")
+
+    if args.out is not None:
+        path = os.path.join(args.out, SUMMARY_FILE)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(SUMMARY_FIELDS)
+            writer.writerows(rows)
+        print(f"Saved → {path}")
+    print(f"Replayed {span_s:.1f} s of traffic for {len(rows)} clients in {wall:.2f} s "
+          f"({span_s / wall if wall else float('inf'):.0f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+import argparse, csv, json, math, os, shutil, signal, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+# ======================================================
+#                 SCENARIO MATRIX
+# ======================================================
+# Each run gets its own server port, impairment proxy port, output
+# directory and seed, so runs are isolated and execute side by side.
+# Impairments are impair.py specs applied in both directions, as netem on
+# the loopback interface affected both.
+SCENARIOS = [
+    ("baseline", ""),
+    ("loss_2pct", "loss=2"),
+    ("loss_5pct", "loss=5"),
+    ("delay_100ms", "delay=100"),
+    ("jitter_10ms", "delay=20,jitter=10"),
+    ("reorder_20pct", "delay=10,reorder=20"),
+    ("duplicate_5pct", "dup=5"),
+]
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_ROOT = "results_phase2"
+RECORD_FILE = "server_packets.gclr"   # server.py --record output, for replay.py
+DURATION = 15              # seconds each client runs
+CLIENTS = 2
+BASE_PORT = 17000          # run i uses BASE_PORT + 2i (proxy) and + 2i + 1 (server)
+SEED = 1
+STARTUP_TIMEOUT = 5.0      # for the server to report it is listening
+GRACE = 10.0               # beyond DURATION before clients are killed
+STOP_TIMEOUT = 10.0        # for server/proxy to flush logs after SIGTERM
+
+# every child process still running, for teardown on Ctrl-C
+live = set()
+live_lock = threading.Lock()
+
+
+def spawn(cmd, cwd, log_path):
+    env = dict(os.environ, PYTHONUNBUFFERED="1", MPLBACKEND="Agg")
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                start_new_session=True)
+    with live_lock:
+        live.add(proc)
+    return proc
+
+
+def stop(proc, timeout=STOP_TIMEOUT):
+    """SIGTERM (server and proxy flush on it), then SIGKILL. Returns the exit code."""
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    with live_lock:
+        live.discard(proc)
+    return proc.returncode
+
+
+def wait_for_output(path, text, proc, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        with open(path) as f:
+            if text in f.read():
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def summary_errors(path):
+    """scenario -> error_mean from analyze.py's summary CSV (NaN rows left out)."""
+    errors = {}
+    try:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    value = float(row["error_mean"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not math.isnan(value):
+                    errors[row["scenario"]] = value
+    except OSError:
+        return {}
+    return errors
+
+# ======================================================
+#                 ONE RUN
+# ======================================================
+def run_scenario(index, name, spec, args):
+    out_dir = os.path.abspath(os.path.join(args.results, name))
+    os.makedirs(out_dir, exist_ok=True)
+    proxy_port = args.base_port + 2 * index
+    server_port = proxy_port + 1
+    seed = args.seed + index
+    record = {
+        "name": name, "impairment": spec, "seed": seed, "dir": out_dir,
+        "proxy_port": proxy_port, "server_port": server_port,
+        "clients": args.clients, "duration_s": args.duration,
+        "status": "ok", "exit_codes": {},
+    }
+    started = time.monotonic()
+    record["started_at"] = time.time()
+    print(f"[start] {name} (impairment: {spec or 'none'}, ports {proxy_port}/{server_port})")
+
+    py = sys.executable
+    server_cmd = [py, os.path.join(REPO_DIR, "server.py"), "--port", str(server_port),
+                  "--seed", str(seed)]
+    if args.record:
+        server_cmd += ["--record", RECORD_FILE]
+    server = spawn(server_cmd + args.server_args, out_dir,
+                   os.path.join(out_dir, "server_output.txt"))
+    procs = {"server": server}
+    try:
+        if not wait_for_output(os.path.join(out_dir, "server_output.txt"), "SERVER running",
+                               server, STARTUP_TIMEOUT):
+            record["status"] = "server_failed"
+            return record
+
+        proxy_cmd = [py, os.path.join(REPO_DIR, "impair.py"),
+                     "--listen", f"127.0.0.1:{proxy_port}",
+                     "--server", f"127.0.0.1:{server_port}",
+                     "--both", spec, "--seed", str(seed)]
+        procs["proxy"] = spawn(proxy_cmd, out_dir, os.path.join(out_dir, "proxy_output.txt"))
+        if not wait_for_output(os.path.join(out_dir, "proxy_output.txt"), "PROXY",
+                               procs["proxy"], STARTUP_TIMEOUT):
+            record["status"] = "proxy_failed"
+            return record
+
+        if args.pcap:
+            # both legs of the run: client <-> proxy and proxy <-> server
+            procs["tcpdump"] = spawn(
+                ["tcpdump", "-i", args.iface, "-w", os.path.join(out_dir, "trace.pcap"),
+                 f"udp port {proxy_port} or udp port {server_port}"],
+                out_dir, os.path.join(out_dir, "tcpdump_output.txt")
+            )
+
+        clients = []
+        for i in range(1, args.clients + 1):
+            c_dir = os.path.join(out_dir, f"client_{i}")
+            os.makedirs(c_dir, exist_ok=True)
+            clients.append(spawn(
+                [py, os.path.join(REPO_DIR, "client.py"), "--quiet",
+                 "--server", f"127.0.0.1:{proxy_port}", "--duration", str(args.duration)],
+                c_dir, os.path.join(c_dir, "client_output.txt")
+            ))
+            procs[f"client_{i}"] = clients[-1]
+
+        deadline = time.monotonic() + args.duration + GRACE
+        for proc in clients:
+            try:
+                proc.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                record["status"] = "timeout"
+    finally:
+        # clients first, then capture and proxy, and the server last so it logs the whole run
+        order = {"tcpdump": 1, "proxy": 2, "server": 3}
+        for key in sorted(procs, key=lambda k: (order.get(k, 0), k)):
+            record["exit_codes"][key] = stop(procs[key])
+        record["wall_s"] = round(time.monotonic() - started, 2)
+
+    trace = os.path.join(out_dir, "trace.pcap")
+    if args.pcap and os.path.exists(trace):
+        # per-session throughput, interarrival, loss and reordering on both legs
+        done = subprocess.run(
+            [py, os.path.join(REPO_DIR, "wire.py"), trace, "--port", str(proxy_port),
+             "--port", str(server_port), "--out", os.path.join(out_dir, "wire_summary.csv")],
+            cwd=out_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        if done.returncode != 0:
+            print(f"[warn] {name}: wire.py failed: {done.stderr.strip().splitlines()[-1:]}")
+
+    if record["status"] == "ok" and args.plots:
+        # per-client error CSVs and plots; the summary comes from analyze.py
+        for i in range(1, args.clients + 1):
+            display = os.path.join(out_dir, f"client_{i}", "client_display.csv")
+            if not os.path.exists(display):
+                print(f"[warn] {name}: missing {display}")
+                continue
+            out_csv = os.path.join(out_dir, f"error_client{i}.csv")
+            done = subprocess.run(
+                [py, os.path.join(REPO_DIR, "compute_error.py"),
+                 "--server", os.path.join(out_dir, "server_positions.csv"),
+                 "--client", display, "--out_csv", out_csv,
+                 "--out_plot", os.path.join(out_dir, f"plots_client{i}")],
+                cwd=out_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                env=dict(os.environ, MPLBACKEND="Agg"),
+            )
+            if done.returncode != 0:
+                print(f"[warn] {name}: compute_error.py failed for client {i}: "
+                      f"{done.stderr.strip().splitlines()[-1:]}")
+
+    record["wall_s"] = round(time.monotonic() - started, 2)
+    print(f"[done] {name}: {record['status']} in {record['wall_s']} s")
+    return record
+
+# ======================================================
+#                 MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Run the scenario matrix in parallel, isolated runs.")
+    parser.add_argument("--scenarios", nargs="*", default=None,
+                        help="Names to run (default: all of %s)" % ", ".join(n for n, _ in SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Runs in parallel (default: all scenarios at once; lower it "
+                             "on a host too small for that)")
+    parser.add_argument("--duration", type=float, default=float(os.environ.get("DURATION", DURATION)),
+                        help="Seconds each client runs (default: $DURATION or %d)" % DURATION)
+    parser.add_argument("--clients", type=int, default=int(os.environ.get("CLIENTS", CLIENTS)),
+                        help="Clients per run (default: $CLIENTS or %d)" % CLIENTS)
+    parser.add_argument("--results", default=RESULTS_ROOT,
+                        help="Output root; one directory per scenario (default: %(default)s)")
+    parser.add_argument("--base-port", type=int, default=BASE_PORT,
+                        help="First port; each run uses two consecutive ports (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=SEED,
+                        help="Base seed; run i uses seed + i (default: %(default)s)")
+    parser.add_argument("--plots", action="store_true",
+                        help="Also run compute_error.py per client for error CSVs and plots")
+    parser.add_argument("--pcap", action="store_true",
+                        help="Capture each run to trace.pcap with tcpdump (needs capture rights) "
+                             "and summarize it into wire_summary.csv")
+    parser.add_argument("--record", action="store_true",
+                        help=f"Have each server record its sent packets to {RECORD_FILE} for replay.py")
+    parser.add_argument("--iface", default=os.environ.get("IFACE", "lo"),
+                        help="Interface for --pcap (default: $IFACE or lo)")
+    parser.add_argument("--server-args", default="",
+                        help="Extra server.py arguments for every run, e.g. '--delta'")
+    args = parser.parse_args()
+    args.server_args = args.server_args.split()
+
+    if args.pcap and shutil.which("tcpdump") is None:
+        parser.error("--pcap needs tcpdump on PATH")
+
+    matrix = SCENARIOS
+    if args.scenarios:
+        unknown = set(args.scenarios) - {n for n, _ in SCENARIOS}
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        matrix = [(n, s) for n, s in SCENARIOS if n in args.scenarios]
+    # runs mostly wait on sockets and sleeps, so the CPU count is no limit
+    jobs = args.jobs or len(matrix)
+
+    os.makedirs(args.results, exist_ok=True)
+    print(f"[info] {len(matrix)} scenarios, {jobs} in parallel, duration={args.duration}s, "
+          f"clients={args.clients}")
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        # ports and seeds follow the position in the full matrix, so a
+        # scenario keeps them when run on its own
+        index = {n: i for i, (n, _) in enumerate(SCENARIOS)}
+        futures = [pool.submit(run_scenario, index[n], n, s, args) for n, s in matrix]
+        runs = [f.result() for f in futures]
+    except KeyboardInterrupt:
+        print("[stop] interrupted, stopping all runs")
+        pool.shutdown(wait=False, cancel_futures=True)
+        with live_lock:
+            procs = list(live)
+        for proc in procs:
+            stop(proc)
+        raise
+    pool.shutdown()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    # one cached, parallel pass over every run for the cross-scenario summary
+    summary = os.path.join(args.results, "analysis_summary.csv")
+    analysis = subprocess.run([sys.executable, os.path.join(REPO_DIR, "analyze.py"), args.results,
+                               "--out", summary])
+    # mean_error is only recorded for runs the summary has a value for
+    errors = summary_errors(summary) if analysis.returncode == 0 else {}
+    for run in runs:
+        if run["name"] in errors:
+            run["mean_error"] = errors[run["name"]]
+    manifest = {
+        "command": sys.argv,
+        "commit": commit,
+        "jobs": jobs,
+        "wall_s": round(time.monotonic() - started, 2),
+        "summary": summary if analysis.returncode == 0 else None,
+        "runs": runs,
+    }
+    path = os.path.join(args.results, "manifest.json")
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[info] all scenarios done in {manifest['wall_s']} s; manifest -> {path}")
+    return 0 if all(r["status"] == "ok" for r in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
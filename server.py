@@ -1,40 +1,238 @@
 #!/usr/bin/env python3
-import socket, struct, time, csv, threading, random
+import socket, struct, time, threading, random, selectors, argparse, signal
+import itertools, functools, multiprocessing, heapq, math
+from collections import OrderedDict
+
+import metrics
+import recording
+import sharding
+import telemetry
 
 # ======================================================
 #                 PROTOCOL CONSTANTS
 # ======================================================
-MAGIC = b"GCL1"; VERSION = 1
+MAGIC = b"GCL1"; VERSION = 2
 MT_INIT, MT_SNAPSHOT, MT_EVENT, MT_ACK, MT_HEARTBEAT = range(5)
+MT_SNAPSHOT_DELTA = 5
+MT_SNAPSHOT_FRAG = 6
 
 HDR_FMT = ">4sBBIIQH"
 HDR_LEN = struct.calcsize(HDR_FMT)
+HDR_STRUCT = struct.Struct(HDR_FMT)
+SEQ_STRUCT = struct.Struct(">I")
+SEQ_OFFSET = struct.calcsize(">4sBBI")    # seq_num follows magic/ver/type/snapshot_id
+
+# Time sync (NTP-style): a client MT_HEARTBEAT carries its send time t0 in
+# microseconds; the server echoes it with its own receive and send times
+# t1, t2 so the client can estimate RTT and clock offset.
+SYNC_REQ_STRUCT = struct.Struct(">Q")
+SYNC_REPLY_STRUCT = struct.Struct(">QQQ")
+
+# Receiver report appended to a heartbeat's t0 (RTCP-style): highest
+# seq_num received from us, packets received in total, and RTT in ms
+# (0 = unknown).
+REPORT_STRUCT = struct.Struct(">QIIH")
+
+# Compact header (negotiated in MT_INIT): one byte holding COMPACT_MARK in
+# the top three bits and the msg type in the low five, then varint
+# snapshot_id, seq_num, ms since the session epoch and payload length.
+# The legacy header starts with "G" (0b010...), so the two never collide.
+COMPACT_MARK = 0b101
+INIT_FLAG_COMPACT = 0x01
+
+# INIT flag: the payload continues with (client_id, session token) from an
+# earlier INIT reply, asking to resume that session from this address.
+INIT_FLAG_RESUME = 0x02
+
+# INIT reply flag: snapshots may be deltas, so the client ACKs each applied
+# snapshot as a possible baseline. Without it, snapshot ACKs are not sent.
+INIT_FLAG_DELTA = 0x04
+
+# entity record: player_id, x, y
+ENTITY_FMT = "HHH"
+ENTITY_LEN = struct.calcsize(">" + ENTITY_FMT)
+
+# fragment prefix: inner msg type, fragment index, fragment count
+FRAG_STRUCT = struct.Struct(">BBB")
+
+# Optional trailer after a packet's plen-delimited payload: kind, length,
+# body. Receivers that don't know it never read past plen.
+TRAILER_STRUCT = struct.Struct(">BH")
+TRAILER_EVENT_ACK = 1
+MAX_EXTRA_ACKS = 64        # explicit seqs beyond the SACK bitmap per ACK
 
 SERVER_ADDR = ("127.0.0.1", 7777)
 PAYLOAD_LIMIT = 1200
+FRAG_CHUNK = PAYLOAD_LIMIT - FRAG_STRUCT.size
+MAX_FRAGMENTS = 255
 TICK_HZ = 20
 MAX_CLIENTS = 4
+METRICS_INTERVAL = 1.0
+MAX_DATAGRAM = 2048        # larger datagrams are dropped as oversize
+RECV_BUFFER = 65536        # big enough to see that a datagram is oversize
+METRICS_PORT = None        # serve live metrics at http://127.0.0.1:PORT/metrics
+
+# World is a WORLD_SIZE x WORLD_SIZE torus. With AOI_RADIUS set, each
+# client only receives entities within that many units (per axis) of its
+# own player, looked up through a uniform grid of GRID_CELL-sized cells.
+WORLD_SIZE = 20
+AOI_RADIUS = None
+GRID_CELL = None           # defaults to AOI_RADIUS
+
+# Tick scheduling: ticks are pinned to absolute deadlines. When the loop
+# falls more than one period behind, "catchup" runs the missed ticks
+# back-to-back (at most MAX_CATCHUP_TICKS per wakeup, the rest are skipped)
+# and "skip" runs only the latest one.
+TICK_POLICY = "catchup"
+MAX_CATCHUP_TICKS = 4
+
+# Delta snapshots: encode only entities that changed since the last
+# snapshot the client ACKed. Baselines older than DELTA_HISTORY ticks
+# fall back to a full snapshot.
+DELTA_SNAPSHOTS = False
+DELTA_HISTORY = 32
+
+# Reliable events: clients may have many events in flight. Seqs more than
+# EVENT_REORDER_WINDOW past the cumulative ACK push it forward, writing off
+# holes the client has long since given up on.
+EVENT_REORDER_WINDOW = 256
+
+# ACK coalescing: event ACKs wait for the client's next snapshot and ride
+# in its trailer; a standalone MT_ACK goes out if none is sent within
+# ACK_MAX_DELAY_MS.
+ACK_COALESCE = False
+ACK_MAX_DELAY_MS = 20
+
+ALLOW_COMPACT_HEADER = True
+
+# Sharding: with WORKERS > 1 the server forks that many processes bound to
+# the same port with SO_REUSEPORT. The kernel hashes each client address to
+# one worker, which owns that session and simulates its player. Workers
+# publish their players to a shared-memory ShardTable every tick and merge
+# the other partitions into their own view, so snapshots still cover the
+# whole world (remote players may lag by one tick).
+#
+# Session resume only works within one worker. After a NAT rebinding the
+# kernel hashes the new address afresh and may pick another worker, which
+# has no record of the session or its token. That worker answers the
+# resume with a new session and client id (the client treats it like an
+# expired session), and the old worker evicts its copy after
+# SESSION_TIMEOUT.
+WORKERS = 1
+
+# Session liveness: any packet from a client refreshes its last-seen time
+# (clients send MT_HEARTBEAT when they have nothing else to say). Sessions
+# silent for SESSION_TIMEOUT seconds are evicted and their player ids
+# reused. Expiry runs off a timer wheel of WHEEL_RESOLUTION-second slots,
+# so each tick only visits the sessions filed under the slots it passes.
+SESSION_TIMEOUT = 5.0
+WHEEL_RESOLUTION = 0.25
+
+# Congestion control: with RATE_CONTROL each client's snapshot rate
+# follows AIMD on the loss in its receiver reports, from TICK_HZ down to
+# MIN_SNAPSHOT_HZ: +RATE_INCREASE_HZ per report under LOSS_LOW, halved
+# above LOSS_HIGH. Independently, CLIENT_BUDGET_KBPS and EGRESS_CAP_KBPS
+# (split evenly across clients) cap snapshot bytes with a token bucket
+# holding up to BUDGET_BURST_TICKS ticks of allowance.
+RATE_CONTROL = False
+MIN_SNAPSHOT_HZ = 2
+RATE_INCREASE_HZ = 1
+LOSS_LOW = 0.02
+LOSS_HIGH = 0.10
+CLIENT_BUDGET_KBPS = None
+EGRESS_CAP_KBPS = None
+BUDGET_BURST_TICKS = 4
+
+# Reproducibility: SEED seeds the world RNG (spawn points and movement), so
+# runs whose sessions join at the same ticks simulate the same world;
+# session tokens stay on the unseeded global RNG. With RECORD_PATH every
+# sent datagram is recorded with its send time (see recording.py), for
+# replay.py to play back through the client pipeline offline.
+SEED = None
+RECORD_PATH = None
 
 # ======================================================
 #                 STATE VARIABLES
 # ======================================================
 players = {}               # client_id -> (x, y)
+world = None               # ArrayWorld when running with --array-world
+world_rng = random.Random()   # spawn points and movement, seeded with SEED
 clients = {}               # addr -> client_id
 seq_nums = {}              # addr -> next seq num
+acked_snapshot = {}        # addr -> newest snapshot_id the client ACKed
+event_cum = {}             # addr -> highest event seq with no gaps below it
+event_seen = {}            # addr -> event seqs received above event_cum
+ack_pending = {}           # addr -> event seqs waiting for an ACK (coalescing)
+ack_due = {}               # addr -> monotonic deadline for a standalone ACK
+compact_epoch = {}         # addr -> session epoch (ms) for compact-header clients
+sent_history = {}          # addr -> OrderedDict(snapshot_id -> world state sent)
+last_seen = {}             # addr -> monotonic time of the client's last packet
+client_addr = {}           # client_id -> addr
+session_token = {}         # client_id -> token a resuming client must echo
+free_ids = []              # heap of evicted client_ids, handed out first
+idle_wheel = None          # session expiry timer wheel, see new_idle_wheel()
+send_rate = {}             # addr -> snapshot rate / budget state, see new_send_rate()
+grid = {}                  # (cx, cy) -> set of player_ids in that cell
+player_cell = {}           # player_id -> (cx, cy)
 next_client_id = 1
 snapshot_id = 0
 
-packet_sent = 0
-packet_recv = 0
-bytes_sent_per_client = {}
+shard = None               # (worker index, ShardTable) inside a sharded worker
+owned = None               # player_ids this worker simulates (sharded only)
+remote_ids = set()         # player_ids mirrored from other workers
+tick_epoch = None          # shared monotonic start that aligns worker tick numbers
+
+# Live metrics: per-thread counters and histograms (see metrics.py), so
+# the per-packet paths take no lock. metrics_tick turns them into the CSV
+# rows; --metrics-port serves them as text.
+registry = metrics.Registry("gcl_")
+stats = registry.add_counters(metrics.Counters({
+    "packets_recv": "Datagrams received",
+    "packets_sent": "Datagrams sent",
+    "bytes_recv": "Bytes received",
+    "bytes_sent": "Bytes sent",
+    "events_new": "Critical events applied",
+    "events_dup": "Retransmitted events re-ACKed",
+    "sessions_opened": "Sessions opened",
+    "sessions_evicted": "Idle sessions evicted",
+    "sessions_resumed": "Sessions resumed from a new address",
+}, keyed={
+    "dropped": ("reason", "Datagrams dropped on receive, or snapshots too large to send"),
+    "client_bytes": ("client_id", "Bytes sent per player id"),
+}))
+tick_hist = registry.add_histogram("tick_duration_ms", "Work per tick")
+lateness_hist = registry.add_histogram("tick_lateness_ms", "Tick start past its deadline")
+send_hist = registry.add_histogram("tick_send_ms", "Snapshot fan-out time per tick")
+sent_size_hist = registry.add_histogram("sent_packet_bytes", "Size of sent datagrams")
+recv_size_hist = registry.add_histogram("recv_packet_bytes", "Size of received datagrams")
+client_kbps_hist = registry.add_histogram("client_kbps", "Per-client bandwidth, sampled each metrics interval")
+registry.add_gauge("sessions", "Live sessions", lambda: len(clients))
+registry.add_gauge("players", "Players in this process's world view", lambda: len(players))
+registry.add_gauge("log_records_dropped", "Telemetry records dropped (buffer full)",
+                   lambda: sum(log.dropped for log in (server_pos_log, tick_log, metrics_log, clients_log)))
+
+# tick budget accounting since the last metrics sample (per tick, not per packet)
+tick_stats = {"ticks": 0, "busy_s": 0.0, "skipped": 0, "max_late_ms": 0.0}
+
+# reusable snapshot packet buffer, header + body, written in place every
+# tick and grown on demand when the world outgrows it
+snapshot_buf = bytearray(HDR_LEN + PAYLOAD_LIMIT)
+
+oversize_warned = False    # a snapshot too large to fragment was reported once
 
 metrics_lock = threading.Lock()
+ack_lock = threading.Lock()
+session_lock = threading.Lock()   # session create/move/evict vs. the tick thread
 
 # ======================================================
 #                 HELPER FUNCTIONS
 # ======================================================
 def monotonic_ms():
-    return time.time_ns() // 1_000_000
+    return time.monotonic_ns() // 1_000_000
+
+
+def monotonic_us():
+    return time.monotonic_ns() // 1_000
 
 
 def pack_header(msg_type, snapshot_id, seq_num, ts, payload):
@@ -46,185 +244,1322 @@ def pack_header(msg_type, snapshot_id, seq_num, ts, payload):
         snapshot_id, seq_num, ts, len(payload)
     ) + payload
 
-# ======================================================
-#                 CSV LOGGING FILES
-# ======================================================
-metrics_file = open("server_metrics.csv", "w", newline="")
-metrics_writer = csv.writer(metrics_file)
-metrics_writer.writerow(["cpu_percent", "bandwidth_per_client_kbps"])
-metrics_file.flush()
-
-server_pos_file = open("server_positions.csv", "w", newline="")
-server_pos_writer = csv.writer(server_pos_file)
-server_pos_writer.writerow(["timestamp_ms", "snapshot_id", "player_id", "x", "y"])
-server_pos_file.flush()
 
 # ======================================================
-#                 RECEIVE LOOP
+#                 COMPACT HEADER
 # ======================================================
-def recv_loop(sock: socket.socket):
-    global packet_recv, next_client_id, packet_sent
+def encode_varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return out
 
+
+def decode_varint(data, offset):
+    value = shift = 0
     while True:
+        b = data[offset]
+        offset += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, offset
+        shift += 7
+
+
+def compact_header(mtype, snap, seq, ts, plen, epoch):
+    hdr = bytearray([COMPACT_MARK << 5 | mtype])
+    for field in (snap, seq, max(0, ts - epoch), plen):
+        hdr += encode_varint(field)
+    return hdr
+
+
+def to_compact(pkt, epoch):
+    """Re-header a legacy packet for a compact-header session."""
+    _, _, mtype, snap, seq, ts, plen = HDR_STRUCT.unpack_from(pkt, 0)
+    return compact_header(mtype, snap, seq, ts, plen, epoch) + pkt[HDR_LEN:]
+
+
+def parse_header(data):
+    """Return (mtype, snap, seq, ts_or_delta, plen, hdr_len), or None.
+
+    Compact headers report the timestamp as ms since the session epoch.
+    """
+    if not data:
+        return None
+    if data[0] >> 5 == COMPACT_MARK:
         try:
-            data, addr = sock.recvfrom(2048)
-        except socket.timeout:
-            continue
+            snap, off = decode_varint(data, 1)
+            seq, off = decode_varint(data, off)
+            ts, off = decode_varint(data, off)
+            plen, off = decode_varint(data, off)
+        except IndexError:
+            return None
+        return data[0] & 0x1F, snap, seq, ts, plen, off
 
-        with metrics_lock:
-            packet_recv += 1
+    if len(data) < HDR_LEN:
+        return None
+    magic, ver, mtype, snap, seq, ts, plen = HDR_STRUCT.unpack_from(data, 0)
+    if magic != MAGIC or ver != VERSION:
+        return None
+    return mtype, snap, seq, ts, plen, HDR_LEN
 
-        if len(data) < HDR_LEN:
-            continue
 
-        magic, ver, mtype, snap, seq, ser_ms, plen = struct.unpack(
-            HDR_FMT, data[:HDR_LEN]
+def send_packet(sock, pkt, addr, cid):
+    epoch = compact_epoch.get(addr)
+    if epoch is not None:
+        pkt = to_compact(pkt, epoch)
+    try:
+        sock.sendto(pkt, addr)
+    except BlockingIOError:
+        # non-blocking socket with a full send buffer: drop like the network would
+        return
+
+    counts = stats.local()
+    counts["packets_sent"] += 1
+    counts["bytes_sent"] += len(pkt)
+    counts["client_bytes"][cid] += len(pkt)
+    sent_size_hist.observe(len(pkt))
+    if recorder is not None:
+        recorder.record(monotonic_us(), cid, pkt)
+
+
+def send_batch(sock, packets, targets):
+    """Send the same encoded packets to many clients, patching only seq_num.
+
+    `targets` is a list of (addr, cid, first_seq); packet i goes out with
+    seq_num first_seq + i. Counters are updated once for the whole batch
+    instead of once per datagram.
+    """
+    sendto = sock.sendto
+    pack_seq = SEQ_STRUCT.pack_into
+    sent = []
+
+    for i, buf in enumerate(packets):
+        _, _, mtype, snap, _, ts, plen = HDR_STRUCT.unpack_from(buf, 0)
+        body = memoryview(buf)[HDR_LEN:]
+
+        for addr, cid, seq in targets:
+            # pending event ACKs ride on the first packet to this client
+            trailer = take_ack_trailer(addr) if i == 0 and ack_pending else None
+            epoch = compact_epoch.get(addr) if compact_epoch else None
+
+            if epoch is None:
+                pack_seq(buf, SEQ_OFFSET, seq + i)
+                parts = [buf]
+            else:
+                # compact sessions get their own header over the shared body
+                parts = [compact_header(mtype, snap, seq + i, ts, plen, epoch), body]
+            if trailer is not None:
+                parts.append(trailer)
+
+            try:
+                if len(parts) == 1:
+                    sendto(buf, addr)
+                elif hasattr(sock, "sendmsg"):
+                    sock.sendmsg(parts, (), 0, addr)
+                else:
+                    sendto(b"".join(parts), addr)
+            except BlockingIOError:
+                continue
+            sent.append((cid, sum(len(part) for part in parts)))
+            if recorder is not None:
+                recorder.record(monotonic_us(), cid, b"".join(parts))
+
+    counts = stats.local()
+    client_bytes = counts["client_bytes"]
+    total = 0
+    for cid, size in sent:
+        client_bytes[cid] += size
+        sent_size_hist.observe(size)
+        total += size
+    counts["packets_sent"] += len(sent)
+    counts["bytes_sent"] += total
+
+
+def packetize(buf, msg_type, snap_id, ts, body_len):
+    """Turn a body encoded at buf[HDR_LEN:] into a list of packets.
+
+    Bodies that fit in PAYLOAD_LIMIT go out as one packet built in place.
+    Larger ones are split into MT_SNAPSHOT_FRAG packets carrying the inner
+    msg type and fragment index/count. Headers get seq_num 0.
+    """
+    if body_len <= PAYLOAD_LIMIT:
+        HDR_STRUCT.pack_into(buf, 0, MAGIC, VERSION, msg_type, snap_id, 0, ts, body_len)
+        return [memoryview(buf)[:HDR_LEN + body_len]]
+
+    count = -(-body_len // FRAG_CHUNK)
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Snapshot of {body_len} bytes needs more than {MAX_FRAGMENTS} fragments")
+
+    body = memoryview(buf)[HDR_LEN:HDR_LEN + body_len]
+    fragments = []
+    for i in range(count):
+        chunk = body[i*FRAG_CHUNK:(i+1)*FRAG_CHUNK]
+        plen = FRAG_STRUCT.size + len(chunk)
+        pkt = bytearray(HDR_LEN + plen)
+        HDR_STRUCT.pack_into(pkt, 0, MAGIC, VERSION, MT_SNAPSHOT_FRAG, snap_id, 0, ts, plen)
+        FRAG_STRUCT.pack_into(pkt, HDR_LEN, msg_type, i, count)
+        pkt[HDR_LEN + FRAG_STRUCT.size:] = chunk
+        fragments.append(pkt)
+    return fragments
+
+
+@functools.lru_cache(maxsize=256)
+def snapshot_body_struct(num_players):
+    return struct.Struct(">H" + ENTITY_FMT * num_players)
+
+
+def encode_snapshot(snap_id, ts, entities, reuse=False):
+    """Encode a full MT_SNAPSHOT and return its packets (see packetize).
+
+    With `reuse`, the body is written into the shared snapshot_buf, so the
+    result is only valid until the next reusing call.
+    """
+    global snapshot_buf
+
+    size = HDR_LEN + 2 + ENTITY_LEN * len(entities)
+    if not reuse:
+        buf = bytearray(size)
+    else:
+        if len(snapshot_buf) < size:
+            snapshot_buf = bytearray(size)
+        buf = snapshot_buf
+
+    if isinstance(entities, dict):
+        snapshot_body_struct(len(entities)).pack_into(
+            buf, HDR_LEN, len(entities),
+            *itertools.chain.from_iterable((pid, x, y) for pid, (x, y) in entities.items())
         )
-        if magic != MAGIC or ver != VERSION:
-            continue
+    else:
+        # array-backed world: the columns are converted to wire order in bulk
+        entities.pack_into(buf, HDR_LEN)
+    return packetize(buf, MT_SNAPSHOT, snap_id, ts, size - HDR_LEN)
 
-        payload = data[HDR_LEN:HDR_LEN+plen]
 
-        # ----------------------
-        # INIT FROM NEW CLIENT
-        # ----------------------
-        if mtype == MT_INIT:
-            if addr not in clients and len(clients) < MAX_CLIENTS:
-                cid = next_client_id
-                next_client_id += 1
+@functools.lru_cache(maxsize=256)
+def delta_body_struct(num_changed, num_removed):
+    return struct.Struct(">IHH" + ENTITY_FMT * num_changed + "H" * num_removed)
+
+
+def encode_delta(snap_id, ts, baseline_id, baseline, state):
+    """Encode an MT_SNAPSHOT_DELTA of `state` against `baseline`.
+
+    Returns its packets (see packetize), or None when the delta would not
+    be smaller than a full snapshot.
+    """
+    changed = [(pid, pos) for pid, pos in state.items() if baseline.get(pid) != pos]
+    removed = [pid for pid in baseline if pid not in state]
+
+    body = delta_body_struct(len(changed), len(removed))
+    if body.size >= snapshot_body_struct(len(state)).size:
+        return None
+
+    buf = bytearray(HDR_LEN + body.size)
+    body.pack_into(
+        buf, HDR_LEN, baseline_id, len(changed), len(removed),
+        *itertools.chain.from_iterable((pid, x, y) for pid, (x, y) in changed),
+        *removed
+    )
+    return packetize(buf, MT_SNAPSHOT_DELTA, snap_id, ts, body.size)
+
 
-                clients[addr] = cid
-                seq_nums[addr] = 1
-                players[cid] = (random.randint(0, 19), random.randint(0, 19))
-                with metrics_lock:
-                    bytes_sent_per_client[cid] = 0
+def drop_oversize_snapshot(targets, error):
+    """Skip this tick's snapshot for `targets`: it can't be fragmented."""
+    global oversize_warned
+    stats.local()["dropped"]["snapshot_oversize"] += len(targets)
+    if not oversize_warned:
+        oversize_warned = True
+        print(f"[WARN] {error}; skipping those snapshots (counted as dropped "
+              f"snapshot_oversize, further occurrences not logged)")
 
-                x, y = players[cid]
-                ack_payload = struct.pack(">BBB", cid, x, y)
 
-                pkt = pack_header(MT_ACK, 0, seq_nums[addr], monotonic_ms(), ack_payload)
-                sock.sendto(pkt, addr)
+def build_snapshot_batches(ts):
+    """Assign each client the packets it gets this tick and their seq_nums.
 
-                with metrics_lock:
-                    bytes_sent_per_client[cid] += len(pkt)
-                    packet_sent += 1
+    Returns a list of (packets, targets) pairs for send_batch. Without AOI
+    every client shares one view of the world, so the full snapshot is
+    encoded once and clients sharing a delta baseline share one delta.
+    """
+    if AOI_RADIUS is None:
+        # copy only when delta history needs to hold on to this tick's state
+        if DELTA_SNAPSHOTS:
+            shared_view = dict(players)
+        elif world is not None:
+            shared_view = world
+        else:
+            shared_view = players
 
+    full_groups = {}       # id(view) -> (view, targets)
+    delta_groups = {}      # (baseline_id, id(view)) -> (baseline, view, targets)
+    budget = client_budget_bytes()
+
+    for addr, cid in list(clients.items()):
+        if not snapshot_due(send_rate[addr], budget):
+            continue
+        target = (addr, cid)
+        view = shared_view if AOI_RADIUS is None else visible_entities(cid)
+
+        if DELTA_SNAPSHOTS:
+            history = sent_history[addr]
+            baseline_id = acked_snapshot.get(addr)
+            if baseline_id in history:
+                key = (baseline_id, id(view))
+                delta_groups.setdefault(key, (history[baseline_id], view, []))[2].append(target)
+            else:
+                full_groups.setdefault(id(view), (view, []))[1].append(target)
+
+            history[snapshot_id] = view
+            while len(history) > DELTA_HISTORY:
+                history.popitem(last=False)
+        else:
+            full_groups.setdefault(id(view), (view, []))[1].append(target)
+
+    encoded = []
+    for (baseline_id, _), (baseline, view, targets) in delta_groups.items():
+        try:
+            packets = encode_delta(snapshot_id, ts, baseline_id, baseline, view)
+        except ValueError as e:
+            # a full snapshot of the same view would be larger still
+            drop_oversize_snapshot(targets, e)
             continue
+        if packets is None:
+            full_groups.setdefault(id(view), (view, []))[1].extend(targets)
+        else:
+            encoded.append((packets, targets))
 
-        if addr not in clients:
+    for view, targets in full_groups.values():
+        try:
+            packets = encode_snapshot(snapshot_id, ts, view, reuse=AOI_RADIUS is None)
+        except ValueError as e:
+            drop_oversize_snapshot(targets, e)
             continue
+        encoded.append((packets, targets))
+
+    # one seq_num per datagram, so fragments each get their own
+    batches = []
+    for packets, targets in encoded:
+        cost = sum(len(pkt) for pkt in packets)
+        seq_targets = []
+        for addr, cid in targets:
+            seq_targets.append((addr, cid, seq_nums[addr] + 1))
+            seq_nums[addr] += len(packets)
+            rate = send_rate[addr]
+            rate["tokens"] -= cost
+            rate["sent"] += 1
+        batches.append((packets, seq_targets))
+    return batches
+
+# ======================================================
+#                 SEND RATE CONTROL
+# ======================================================
+def new_send_rate():
+    return {"hz": float(TICK_HZ), "credit": 0.0, "tokens": 0.0, "sent": 0,
+            "report": None, "loss": 0.0, "rtt_ms": None}
+
+
+def client_budget_bytes():
+    """Each client's snapshot byte allowance per tick, or None if unlimited."""
+    kbps = CLIENT_BUDGET_KBPS
+    if EGRESS_CAP_KBPS is not None and clients:
+        share = EGRESS_CAP_KBPS / len(clients)
+        kbps = share if kbps is None else min(kbps, share)
+    if kbps is None:
+        return None
+    return kbps * 1000 / 8 / TICK_HZ
+
+
+def snapshot_due(rate, budget):
+    """Whether a client gets this tick's snapshot under its rate and budget.
+
+    The rate adds hz/TICK_HZ of credit per tick and a snapshot spends one,
+    so e.g. half the tick rate means every 2nd tick. The byte bucket may
+    go negative by one snapshot and must refill before the next.
+    """
+    rate["credit"] = min(1.0, rate["credit"] + rate["hz"] / TICK_HZ)
+    if budget is not None:
+        rate["tokens"] = min(budget * BUDGET_BURST_TICKS, rate["tokens"] + budget)
+        if rate["tokens"] <= 0:
+            return False
+    if rate["credit"] < 1.0 - 1e-9:
+        return False
+    rate["credit"] -= 1.0
+    return True
+
+
+def apply_report(addr, highest, received, rtt_ms):
+    """Fold a client's receiver report into its loss estimate and AIMD rate."""
+    rate = send_rate[addr]
+    if rtt_ms:
+        rate["rtt_ms"] = rtt_ms
+    prev, rate["report"] = rate["report"], (highest, received)
+    if prev is None or highest <= prev[0]:
+        return
+
+    expected = highest - prev[0]
+    rate["loss"] = loss = max(0.0, 1 - (received - prev[1]) / expected)
+    if not RATE_CONTROL:
+        return
+    if loss > LOSS_HIGH:
+        rate["hz"] = max(MIN_SNAPSHOT_HZ, rate["hz"] / 2)
+    elif loss < LOSS_LOW:
+        rate["hz"] = min(TICK_HZ, rate["hz"] + RATE_INCREASE_HZ)
+
+# ======================================================
+#                 SPATIAL INDEX (interest management)
+# ======================================================
+def grid_cell_size():
+    return GRID_CELL or AOI_RADIUS or WORLD_SIZE
+
+
+def grid_place(pid, x, y):
+    """Insert or move a player in the grid; O(1) unless its cell changed."""
+    cs = grid_cell_size()
+    cell = (x // cs, y // cs)
+    old = player_cell.get(pid)
+    if old == cell:
+        return
+    if old is not None:
+        members = grid[old]
+        members.discard(pid)
+        if not members:
+            del grid[old]
+    grid.setdefault(cell, set()).add(pid)
+    player_cell[pid] = cell
+
+
+def grid_remove(pid):
+    cell = player_cell.pop(pid, None)
+    if cell is None:
+        return
+    members = grid[cell]
+    members.discard(pid)
+    if not members:
+        del grid[cell]
+
+
+def torus_dist(a, b):
+    d = abs(a - b) % WORLD_SIZE
+    return min(d, WORLD_SIZE - d)
+
+
+def visible_entities(cid):
+    """Entities within AOI_RADIUS of client `cid`'s player (square AOI)."""
+    if cid not in players:
+        return {}
+    px, py = players[cid]
+
+    cs = grid_cell_size()
+    ncells = -(-WORLD_SIZE // cs)
+    # a short last cell means a wrap can cross one extra cell boundary
+    reach = -(-AOI_RADIUS // cs) + (1 if WORLD_SIZE % cs else 0)
+    if 2 * reach + 1 >= ncells:
+        span = range(ncells)
+        xs = ys = span
+    else:
+        cx, cy = player_cell[cid]
+        xs = [(cx + d) % ncells for d in range(-reach, reach + 1)]
+        ys = [(cy + d) % ncells for d in range(-reach, reach + 1)]
+
+    view = {}
+    for gx in xs:
+        for gy in ys:
+            for pid in grid.get((gx, gy), ()):
+                x, y = players[pid]
+                if torus_dist(x, px) <= AOI_RADIUS and torus_dist(y, py) <= AOI_RADIUS:
+                    view[pid] = (x, y)
+    return view
+
+# ======================================================
+#                 CSV LOGGING FILES
+# ======================================================
+# Rows are queued to background telemetry writers so disk stalls never
+# land on the tick or receive path. Opened by run_server().
+metrics_log = None
+server_pos_log = None
+tick_log = None
+clients_log = None
+recorder = None            # recording.PacketRecorder with --record
+
+
+LOG_FILES = ("server_metrics.csv", "server_positions.csv", "server_ticks.csv",
+             "server_clients.csv")
+
+
+def log_path(path):
+    # sharded workers write their own files; the parent merges them on exit
+    return path if shard is None else sharding.worker_log_path(path, shard[0])
+
+
+def worker_columns(fields, types):
+    """Lead with a `worker` column when sharded, so merged rows keep their shard."""
+    if shard is None:
+        return fields, types
+    return ["worker"] + fields, ["u2"] + types
+
+
+def worker_row(row):
+    return row if shard is None else [shard[0]] + row
+
+
+def open_logs():
+    global metrics_log, server_pos_log, tick_log, clients_log, recorder
+
+    metrics_log = telemetry.TelemetryWriter(log_path("server_metrics.csv"), *worker_columns([
+        "cpu_percent", "bandwidth_per_client_kbps",
+        "tick_hz", "tick_headroom_pct", "skipped_ticks", "max_lateness_ms",
+        "log_records_dropped", "events_new", "events_dup",
+        "sessions", "sessions_evicted", "sessions_resumed", "egress_kbps"
+    ], ["f8", "f8", "f8", "f8", "u4", "f8", "u4", "u4", "u4", "u4", "u4", "u4", "f8"]))
+    server_pos_log = telemetry.TelemetryWriter(
+        log_path("server_positions.csv"), ["timestamp_ms", "snapshot_id", "player_id", "x", "y"],
+        ["i8", "u4", "u4", "i4", "i4"]
+    )
+    tick_log = telemetry.TelemetryWriter(log_path("server_ticks.csv"), *worker_columns([
+        "snapshot_id", "budget_ms", "lateness_ms", "sim_ms", "log_ms",
+        "serialize_ms", "send_ms", "total_ms", "skipped_ticks"
+    ], ["u4", "f8", "f8", "f8", "f8", "f8", "f8", "f8", "u4"]))
+    # one row per client per metrics interval
+    clients_log = telemetry.TelemetryWriter(log_path("server_clients.csv"), *worker_columns([
+        "client_id", "snapshot_hz", "target_hz", "loss_pct", "rtt_ms", "kbps"
+    ], ["u4", "f8", "f8", "f8", "f8", "f8"]))
+    if RECORD_PATH is not None:
+        recorder = recording.PacketRecorder(RECORD_PATH, {
+            "seed": SEED, "tick_hz": TICK_HZ, "world_size": WORLD_SIZE,
+            "aoi_radius": AOI_RADIUS, "delta": DELTA_SNAPSHOTS, "rate_control": RATE_CONTROL,
+            "started_at": time.time(),
+        })
+
+
+def close_logs():
+    for log in (metrics_log, server_pos_log, tick_log, clients_log, recorder):
+        if log is not None:
+            log.close()
+
+# ======================================================
+#                 TICK SCHEDULER
+# ======================================================
+def new_tick_schedule():
+    period = 1 / TICK_HZ
+    now = time.monotonic()
+    if tick_epoch is None:
+        return {"period": period, "next": now + period}
+    # sharded workers share deadlines, so tick k means the same instant everywhere
+    return {"period": period, "next": tick_epoch + (int((now - tick_epoch) / period) + 1) * period}
+
+
+def due_ticks(sched, now):
+    """Advance the schedule past `now`.
+
+    Returns the deadlines of the ticks to run now (oldest first) and the
+    number of ticks dropped by the catch-up policy.
+    """
+    deadline = sched["next"]
+    if now < deadline:
+        return [], 0
+
+    period = sched["period"]
+    behind = int((now - deadline) / period) + 1
+    sched["next"] = deadline + behind * period
 
-        cid = clients[addr]
+    if TICK_POLICY == "skip":
+        run = 1
+    else:
+        run = min(behind, MAX_CATCHUP_TICKS)
+    skipped = behind - run
+
+    # drop the oldest deadlines so the ticks that run are the most recent
+    first = deadline + skipped * period
+    return [first + i * period for i in range(run)], skipped
+
+
+def run_due_ticks(sock, sched):
+    deadlines, skipped = due_ticks(sched, time.monotonic())
+    for i, deadline in enumerate(deadlines):
+        snapshot_tick(sock, deadline, skipped if i == 0 else 0)
+
+# ======================================================
+#                 RELIABLE EVENTS
+# ======================================================
+def record_event(addr, seq):
+    """Note a received event seq; return False if it is a duplicate."""
+    cum = event_cum[addr]
+    seen = event_seen[addr]
+    if seq <= cum or seq in seen:
+        return False
+
+    seen.add(seq)
+    if seq - cum > EVENT_REORDER_WINDOW:
+        cum = seq - EVENT_REORDER_WINDOW
+        seen.difference_update([s for s in seen if s <= cum])
+    while cum + 1 in seen:
+        cum += 1
+        seen.discard(cum)
+    event_cum[addr] = cum
+    return True
+
+
+def event_ack_payload(addr, seqs):
+    """ACK for the newest of `seqs`, the cumulative ACK and a 32-bit SACK bitmap.
+
+    Any other seqs in `seqs` the bitmap can't express follow as extra
+    u32s.
+    """
+    cum = event_cum[addr]
+    bitmap = 0
+    for s in event_seen[addr]:
+        if s - cum <= 32:
+            bitmap |= 1 << (s - cum - 1)
+    extra = [s for s in seqs[:-1] if s > cum + 32][-MAX_EXTRA_ACKS:]
+    return struct.pack(f">III{len(extra)}I", seqs[-1], cum, bitmap, *extra)
+
+
+def queue_event_ack(addr, seq):
+    # caller holds ack_lock
+    ack_pending.setdefault(addr, []).append(seq)
+    if addr not in ack_due:
+        ack_due[addr] = time.monotonic() + ACK_MAX_DELAY_MS / 1000
+
+
+def take_ack_trailer(addr):
+    """Pop the client's pending event ACKs as a snapshot trailer, if any."""
+    with ack_lock:
+        seqs = ack_pending.pop(addr, None)
+        if not seqs:
+            return None
+        ack_due.pop(addr, None)
+        body = event_ack_payload(addr, seqs)
+    return TRAILER_STRUCT.pack(TRAILER_EVENT_ACK, len(body)) + body
+
+
+def flush_due_acks(sock):
+    """Send standalone MT_ACKs for clients whose ACK delay has expired."""
+    if not ack_due:
+        return
+    now = time.monotonic()
+    packets = []
+    # session_lock first: the tick thread may be evicting these sessions
+    with session_lock, ack_lock:
+        expired = [addr for addr, due in ack_due.items() if due <= now]
+        for addr in expired:
+            del ack_due[addr]
+            seqs = ack_pending.pop(addr, None)
+            cid = clients.get(addr)
+            if not seqs or cid is None:
+                continue
+            seq_nums[addr] += 1
+            pkt = pack_header(MT_ACK, 0, seq_nums[addr], monotonic_ms(),
+                              event_ack_payload(addr, seqs))
+            packets.append((pkt, addr, cid))
+
+    for pkt, addr, cid in packets:
+        send_packet(sock, pkt, addr, cid)
+
+# ======================================================
+#                 SESSIONS
+# ======================================================
+# Per-address session state; sessions move between addresses on resume.
+ADDR_TABLES = (clients, seq_nums, acked_snapshot, sent_history, event_cum, event_seen,
+               compact_epoch, last_seen, send_rate)
+
+
+def new_idle_wheel():
+    # one spare slot so a full-timeout deadline never lands on the current slot
+    nslots = math.ceil(SESSION_TIMEOUT / WHEEL_RESOLUTION) + 1
+    return {"slots": [set() for _ in range(nslots)], "pos": 0,
+            "time": time.monotonic(), "where": {}}
+
+
+def wheel_schedule(addr, due):
+    """File `addr` under the first wheel slot at or after `due`."""
+    slots, where = idle_wheel["slots"], idle_wheel["where"]
+    ahead = math.ceil((due - idle_wheel["time"]) / WHEEL_RESOLUTION)
+    idx = (idle_wheel["pos"] + max(1, min(len(slots) - 1, ahead))) % len(slots)
+
+    old = where.get(addr)
+    if old is not None:
+        slots[old].discard(addr)
+    slots[idx].add(addr)
+    where[addr] = idx
+
+
+def expire_idle_sessions(now):
+    """Advance the wheel to `now`, evicting sessions idle past SESSION_TIMEOUT.
+
+    Packets only touch last_seen; a session whose slot comes up while still
+    active is filed again under its new deadline.
+    """
+    slots, where = idle_wheel["slots"], idle_wheel["where"]
+    with session_lock:
+        while now - idle_wheel["time"] >= WHEEL_RESOLUTION:
+            idle_wheel["time"] += WHEEL_RESOLUTION
+            idle_wheel["pos"] = pos = (idle_wheel["pos"] + 1) % len(slots)
+            bucket, slots[pos] = slots[pos], set()
+
+            for addr in bucket:
+                del where[addr]
+                if addr not in clients:
+                    continue
+                due = last_seen[addr] + SESSION_TIMEOUT
+                if due <= now:
+                    evict_session(addr)
+                else:
+                    wheel_schedule(addr, due)
+
+
+def open_session(addr, resume):
+    """Find or create the session for an INIT from `addr`.
+
+    `resume` is the (client_id, token) pair the client echoed back, if
+    any. Returns the client_id, or None when the server is full. Caller
+    holds session_lock.
+    """
+    if resume is not None:
+        cid, token = resume
+        old = client_addr.get(cid)
+        if old is not None and session_token[cid] == token:
+            if old != addr:
+                move_session(old, addr)
+            return cid
+
+    if addr in clients:
+        # INIT retransmitted because our reply was lost
+        return clients[addr]
+    if len(clients) >= MAX_CLIENTS:
+        return None
+
+    global next_client_id
+    if free_ids:
+        cid = heapq.heappop(free_ids)
+    else:
+        # sharded workers hand out interleaved ids so they never collide
+        cid = next_client_id
+        next_client_id += WORKERS
+
+    seq_nums[addr] = 1
+    sent_history[addr] = OrderedDict()
+    send_rate[addr] = new_send_rate()
+    event_cum[addr] = 0
+    event_seen[addr] = set()
+    last_seen[addr] = time.monotonic()
+    client_addr[cid] = addr
+    session_token[cid] = random.getrandbits(32)
+
+    players[cid] = (world_rng.randrange(WORLD_SIZE), world_rng.randrange(WORLD_SIZE))
+    if AOI_RADIUS is not None:
+        grid_place(cid, *players[cid])
+    if world is not None:
+        world.add(cid, *players[cid])
+    if owned is not None:
+        owned.add(cid)
+    stats.local()["sessions_opened"] += 1
+
+    # published last, once everything the tick thread reads is in place
+    clients[addr] = cid
+    wheel_schedule(addr, last_seen[addr] + SESSION_TIMEOUT)
+    return cid
+
+
+def move_session(old, new):
+    """Re-key a session from address `old` to `new` (caller holds session_lock)."""
+    if new in clients:
+        evict_session(new)
+
+    cid = clients[old]
+    for table in ADDR_TABLES:
+        if old in table:
+            table[new] = table.pop(old)
+    with ack_lock:
+        for table in (ack_pending, ack_due):
+            if old in table:
+                table[new] = table.pop(old)
+    client_addr[cid] = new
+    last_seen[new] = time.monotonic()
+    wheel_schedule(new, last_seen[new] + SESSION_TIMEOUT)
+
+    stats.local()["sessions_resumed"] += 1
+
+
+def evict_session(addr):
+    """Drop a session and free its player id (caller holds session_lock)."""
+    cid = clients[addr]
+    for table in ADDR_TABLES:
+        table.pop(addr, None)
+    with ack_lock:
+        ack_pending.pop(addr, None)
+        ack_due.pop(addr, None)
+    del client_addr[cid], session_token[cid]
+
+    players.pop(cid, None)
+    grid_remove(cid)
+    if world is not None:
+        world.remove(cid)
+    if owned is not None:
+        owned.discard(cid)
+    heapq.heappush(free_ids, cid)
+
+    stats.local()["sessions_evicted"] += 1
+
+# ======================================================
+#                 PACKET HANDLING
+# ======================================================
+def drop_reason(data):
+    """Why parse_header rejected `data`."""
+    if data and data[0] >> 5 == COMPACT_MARK:
+        return "bad_header"
+    if len(data) < HDR_LEN:
+        return "short"
+    return "bad_magic" if data[:4] != MAGIC else "bad_version"
+
+
+def handle_packet(sock: socket.socket, data, addr):
+    counts = stats.local()
+    counts["packets_recv"] += 1
+    counts["bytes_recv"] += len(data)
+    recv_size_hist.observe(len(data))
+
+    if len(data) > MAX_DATAGRAM:
+        counts["dropped"]["oversize"] += 1
+        return
+    header = parse_header(data)
+    if header is None:
+        counts["dropped"][drop_reason(data)] += 1
+        return
+
+    mtype, snap, seq, ser_ms, plen, hdr_len = header
+    if hdr_len + plen > len(data):
+        counts["dropped"]["truncated"] += 1
+        return
+    payload = data[hdr_len:hdr_len+plen]
+
+    # ----------------------
+    # INIT: NEW, RETRANSMITTED OR RESUMED SESSION
+    # ----------------------
+    if mtype == MT_INIT:
+        # INIT payload: name length, name, flags, then (client_id, token) to resume
+        name_len = payload[0] if payload else 0
+        flags = payload[1 + name_len] if len(payload) > 1 + name_len else 0
+        resume = None
+        if flags & INIT_FLAG_RESUME and len(payload) >= 8 + name_len:
+            resume = struct.unpack_from(">HI", payload, 2 + name_len)
+
+        with session_lock:
+            cid = open_session(addr, resume)
+            if cid is None:
+                counts["dropped"]["server_full"] += 1
+                return
+            # where the player is now: a retransmitted or resumed INIT comes
+            # after ticks have moved it, and the array world doesn't move
+            # `players` unless AOI or deltas need it
+            x, y = players[cid] if world is None else world.position(cid)
+            # the reply itself always uses the legacy header
+            epoch = compact_epoch.pop(addr, None) or monotonic_ms()
+            token = session_token[cid]
+            seq_nums[addr] += 1
+            reply_seq = seq_nums[addr]
+
+        compact = ALLOW_COMPACT_HEADER and flags & INIT_FLAG_COMPACT
+        reply_flags = ((INIT_FLAG_COMPACT if compact else 0)
+                       | (INIT_FLAG_DELTA if DELTA_SNAPSHOTS else 0))
+        ack_payload = struct.pack(">" + ENTITY_FMT + "BQI", cid, x, y,
+                                  reply_flags, epoch, token)
+        # answered with MT_INIT, so it can't be mistaken for an event ACK
+        pkt = pack_header(MT_INIT, 0, reply_seq, epoch, ack_payload)
+        send_packet(sock, pkt, addr, cid)
+        if compact:
+            compact_epoch[addr] = epoch
+        return
+
+    # The tick thread evicts idle sessions, so the session is looked up and
+    # its state touched under session_lock; replies are sent after release.
+    pkt = None
+    with session_lock:
+        cid = clients.get(addr)
+        if cid is None:
+            counts["dropped"]["unknown_addr"] += 1
+            return
+        last_seen[addr] = time.monotonic()
+
+        # ----------------------
+        # HEARTBEAT (liveness, time-sync request, receiver report)
+        # ----------------------
+        if mtype == MT_HEARTBEAT:
+            if plen >= REPORT_STRUCT.size:
+                _, highest, received, rtt_ms = REPORT_STRUCT.unpack_from(payload)
+                apply_report(addr, highest, received, rtt_ms)
+            if plen >= SYNC_REQ_STRUCT.size:
+                t1 = monotonic_us()
+                (t0,) = SYNC_REQ_STRUCT.unpack_from(payload)
+                seq_nums[addr] += 1
+                t2 = monotonic_us()
+                pkt = pack_header(MT_HEARTBEAT, 0, seq_nums[addr], t2 // 1000,
+                                  SYNC_REPLY_STRUCT.pack(t0, t1, t2))
 
         # ----------------------
         # CRITICAL EVENT FROM CLIENT
         # ----------------------
-        if mtype == MT_EVENT and plen >= 5:
+        elif mtype == MT_EVENT and plen >= 5:
             event_type, event_seq = struct.unpack(">BI", payload[:5])
 
-            # ACK the event
-            seq_nums[addr] += 1
-            ack_payload = struct.pack(">I", event_seq)
-            pkt = pack_header(MT_ACK, 0, seq_nums[addr], monotonic_ms(), ack_payload)
-            sock.sendto(pkt, addr)
+            # duplicates (retransmits whose ACK was lost) are re-ACKed, not re-applied
+            with ack_lock:
+                is_new = record_event(addr, event_seq)
+                if ACK_COALESCE:
+                    queue_event_ack(addr, event_seq)
+                else:
+                    # ACK the event
+                    seq_nums[addr] += 1
+                    ack_payload = event_ack_payload(addr, [event_seq])
+                    pkt = pack_header(MT_ACK, 0, seq_nums[addr], monotonic_ms(),
+                                      ack_payload)
+            counts["events_new" if is_new else "events_dup"] += 1
 
-            with metrics_lock:
-                bytes_sent_per_client[cid] += len(pkt)
-                packet_sent += 1
+        # ----------------------
+        # SNAPSHOT ACK (delta baseline)
+        # ----------------------
+        # Snapshots are never retransmitted; the ACK only moves the baseline
+        # future deltas are encoded against.
+        elif mtype == MT_ACK and snap > acked_snapshot.get(addr, 0):
+            acked_snapshot[addr] = snap
 
-            continue
+    if pkt is not None:
+        send_packet(sock, pkt, addr, cid)
 
-        # Ignore ACKs (server does no retransmission for snapshots)
 
-# ======================================================
-#                 SNAPSHOT LOOP
-# ======================================================
-def snapshot_loop(sock: socket.socket):
-    global snapshot_id, packet_sent
+def snapshot_tick(sock: socket.socket, deadline=None, skipped=0):
+    global snapshot_id
 
-    while True:
-        time.sleep(1 / TICK_HZ)
+    t_start = time.monotonic()
+    lateness_ms = (t_start - deadline) * 1000 if deadline is not None else 0.0
+    expire_idle_sessions(t_start)
+    if tick_epoch is not None and deadline is not None:
+        snapshot_id = round((deadline - tick_epoch) * TICK_HZ)
+    else:
         snapshot_id += 1
 
-        # movement simulation
-        for pid, (x, y) in list(players.items()):
-            nx = (x + random.choice([-1, 0, 1])) % 20
-            ny = (y + random.choice([-1, 0, 1])) % 20
-            players[pid] = (nx, ny)
+    # movement simulation
+    if world is not None:
+        # joins and evictions resize the arrays, under session_lock, from
+        # the receive thread in threaded mode
+        with session_lock:
+            world.step()
+            # AOI and delta encoding work on per-player dicts
+            if AOI_RADIUS is not None or DELTA_SNAPSHOTS:
+                players.update(world.to_dict())
+                if AOI_RADIUS is not None:
+                    for pid, (x, y) in players.items():
+                        grid_place(pid, x, y)
+    else:
+        # the receive thread adds and evicts players under session_lock
+        with session_lock:
+            movers = list(players if owned is None else owned)
+            for pid in movers:
+                x, y = players[pid]
+                nx = (x + world_rng.choice([-1, 0, 1])) % WORLD_SIZE
+                ny = (y + world_rng.choice([-1, 0, 1])) % WORLD_SIZE
+                players[pid] = (nx, ny)
+                if AOI_RADIUS is not None:
+                    grid_place(pid, nx, ny)
+            if shard is not None:
+                sync_shards(movers)
+    t_sim = time.monotonic()
+
+    ts = monotonic_ms()
+    if world is not None:
+        with session_lock:
+            if server_pos_log.binary:
+                rows = world.pack_positions(ts, snapshot_id)
+            else:
+                rows = world.format_positions(ts, snapshot_id)
+        server_pos_log.write_raw(rows)
+    else:
+        # each worker logs only the players it owns; merged logs cover the world
+        with session_lock:
+            rows = [(pid, players[pid]) for pid in movers if pid in players]
+        for pid, (x, y) in rows:
+            server_pos_log.write([ts, snapshot_id, pid, x, y])
+    t_log = time.monotonic()
+
+    # serialize once per tick (plus once per distinct delta baseline), then fan out
+    with session_lock:
+        batches = build_snapshot_batches(ts)
+    t_ser = time.monotonic()
+
+    for packets, targets in batches:
+        send_batch(sock, packets, targets)
+    t_end = time.monotonic()
+
+    busy = t_end - t_start
+    tick_log.write(worker_row([
+        snapshot_id, round(1000 / TICK_HZ, 3), round(lateness_ms, 3),
+        round((t_sim - t_start) * 1000, 3), round((t_log - t_sim) * 1000, 3),
+        round((t_ser - t_log) * 1000, 3), round((t_end - t_ser) * 1000, 3),
+        round(busy * 1000, 3), skipped
+    ]))
+
+    tick_hist.observe(busy * 1000)
+    lateness_hist.observe(lateness_ms)
+    send_hist.observe((t_end - t_ser) * 1000)
+    with metrics_lock:
+        tick_stats["ticks"] += 1
+        tick_stats["busy_s"] += busy
+        tick_stats["skipped"] += skipped
+        tick_stats["max_late_ms"] = max(tick_stats["max_late_ms"], lateness_ms)
+
+
+def sync_shards(movers):
+    """Publish this worker's players and mirror every other worker's.
+
+    Caller holds session_lock.
+    """
+    index, table = shard
+    table.publish(index, snapshot_id, {pid: players[pid] for pid in movers})
+
+    others = table.read_others(index)
+    for pid in remote_ids - others.keys():
+        del players[pid]
+        grid_remove(pid)
+    remote_ids.clear()
+    remote_ids.update(others)
+
+    players.update(others)
+    if AOI_RADIUS is not None:
+        for pid, (x, y) in others.items():
+            grid_place(pid, x, y)
+
 
-        ts = monotonic_ms()
-        for pid, (x, y) in players.items():
-            server_pos_writer.writerow([ts, snapshot_id, pid, x, y])
-        server_pos_file.flush()
+def new_metrics_state():
+    return {"time": time.monotonic(), "cpu": time.process_time(), "bytes": {},
+            "totals": stats.totals()}
 
-        payload = struct.pack(">H", len(players))
-        for pid, (x, y) in players.items():
-            payload += struct.pack(">BBB", pid, x, y)
 
+def metrics_tick(state):
+    now = time.monotonic()
+    now_cpu = time.process_time()
+    dt = now - state["time"]
+    cpu_dt = now_cpu - state["cpu"]
+
+    cpu_percent = (cpu_dt / dt) * 100 if dt > 0 else 0.0
+
+    # live sessions only; a reused id's total keeps growing, so its delta
+    # is still just this interval's bytes
+    last_bytes = state["bytes"]
+    totals = stats.keyed_totals("client_bytes")
+    bw_per_client = {}
+    for cid in list(client_addr):
+        delta = totals.get(cid, 0) - last_bytes.get(cid, 0)
+        bw_per_client[cid] = (delta * 8) / 1000.0 / dt if dt > 0 else 0.0
+        client_kbps_hist.observe(bw_per_client[cid])
+    state["bytes"] = totals
+
+    counters = stats.totals()
+    prev, state["totals"] = state["totals"], counters
+    events_new = counters["events_new"] - prev["events_new"]
+    events_dup = counters["events_dup"] - prev["events_dup"]
+    evicted = counters["sessions_evicted"] - prev["sessions_evicted"]
+    resumed = counters["sessions_resumed"] - prev["sessions_resumed"]
+
+    with metrics_lock:
+        ticks = tick_stats["ticks"]
+        busy_s = tick_stats["busy_s"]
+        skipped = tick_stats["skipped"]
+        max_late_ms = tick_stats["max_late_ms"]
+        tick_stats.update(ticks=0, busy_s=0.0, skipped=0, max_late_ms=0.0)
+
+    egress = sum(bw_per_client.values())
+    avg_bw = egress / len(bw_per_client) if bw_per_client else 0.0
+
+    # the tick counts sends and the receive thread folds in reports under
+    # session_lock; reading and resetting under it loses no count
+    rows = []
+    with session_lock:
         for addr, cid in clients.items():
-            seq_nums[addr] += 1
-            pkt = pack_header(MT_SNAPSHOT, snapshot_id, seq_nums[addr], ts, payload)
-            sock.sendto(pkt, addr)
+            rate = send_rate[addr]
+            sent, rate["sent"] = rate["sent"], 0
+            rows.append([cid, sent / dt if dt > 0 else 0.0, rate["hz"], rate["loss"] * 100,
+                         rate["rtt_ms"] or float("nan"), bw_per_client.get(cid, 0.0)])
+    for row in rows:
+        clients_log.write(worker_row(row))
+
+    # headroom = share of the tick budget left after the average tick's work
+    tick_hz = ticks / dt if dt > 0 else 0.0
+    headroom = (1 - (busy_s / ticks) * TICK_HZ) * 100 if ticks else 100.0
+
+    dropped = (server_pos_log.dropped + tick_log.dropped + metrics_log.dropped
+               + clients_log.dropped)
+    metrics_log.write(worker_row([cpu_percent, avg_bw, tick_hz, headroom, skipped, max_late_ms,
+                                  dropped, events_new, events_dup, len(bw_per_client), evicted,
+                                  resumed, egress]))
+
+    state["time"] = now
+    state["cpu"] = now_cpu
+
+# ======================================================
+#                 RECEIVE LOOP
+# ======================================================
+def recv_loop(sock: socket.socket):
+    while True:
+        try:
+            data, addr = sock.recvfrom(RECV_BUFFER)
+        except socket.timeout:
+            flush_due_acks(sock)
+            continue
+
+        handle_packet(sock, data, addr)
+        flush_due_acks(sock)
+
+# ======================================================
+#                 SNAPSHOT LOOP
+# ======================================================
+def snapshot_loop(sock: socket.socket):
+    sched = new_tick_schedule()
 
-            with metrics_lock:
-                bytes_sent_per_client[cid] += len(pkt)
-                packet_sent += 1
+    while True:
+        delay = sched["next"] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        run_due_ticks(sock, sched)
 
 # ======================================================
 #                 METRICS LOOP
 # ======================================================
 def metrics_loop():
-    last_time = time.time()
-    last_cpu = time.process_time()
-    last_bytes = {}
+    state = new_metrics_state()
 
     while True:
-        time.sleep(1)
-        now = time.time()
-        now_cpu = time.process_time()
-        dt = now - last_time
-        cpu_dt = now_cpu - last_cpu
+        time.sleep(METRICS_INTERVAL)
+        metrics_tick(state)
+
+# ======================================================
+#                 EVENT LOOP (single-threaded mode)
+# ======================================================
+def event_loop(sock: socket.socket):
+    # One thread drives receive, tick and metrics work. The socket is
+    # non-blocking and the selector sleeps until either a datagram arrives
+    # or the next timer is due, so an idle server does not spin.
+    sock.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+
+    state = new_metrics_state()
+    sched = new_tick_schedule()
+    next_metrics = time.monotonic() + METRICS_INTERVAL
 
-        cpu_percent = (cpu_dt / dt) * 100 if dt > 0 else 0.0
+    try:
+        while True:
+            wake = min(sched["next"], next_metrics)
+            if ack_due:
+                wake = min(wake, min(ack_due.values()))
+            timeout = max(0.0, wake - time.monotonic())
 
-        with metrics_lock:
-            bw_per_client = []
-            for cid, total_bytes in bytes_sent_per_client.items():
-                prev = last_bytes.get(cid, 0)
-                delta = total_bytes - prev
-                kbps = (delta * 8) / 1000.0
-                bw_per_client.append(kbps)
-                last_bytes[cid] = total_bytes
+            if sel.select(timeout):
+                # drain everything queued so a burst costs one wakeup
+                while True:
+                    try:
+                        data, addr = sock.recvfrom(RECV_BUFFER)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionResetError:
+                        # ICMP port unreachable from a departed client (Windows)
+                        continue
+                    handle_packet(sock, data, addr)
 
-        avg_bw = sum(bw_per_client) / len(bw_per_client) if bw_per_client else 0.0
-        metrics_writer.writerow([cpu_percent, avg_bw])
-        metrics_file.flush()
+            run_due_ticks(sock, sched)
+            flush_due_acks(sock)
 
-        last_time = now
-        last_cpu = now_cpu
+            now = time.monotonic()
+            if now >= next_metrics:
+                metrics_tick(state)
+                next_metrics += METRICS_INTERVAL
+    finally:
+        sel.close()
 
 # ======================================================
 #                 MAIN SERVER FUNCTION
 # ======================================================
-def run_server():
+def run_server(use_event_loop=False):
+    global idle_wheel
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if shard is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind(SERVER_ADDR)
-    sock.settimeout(0.001)
 
-    print("SERVER running at", SERVER_ADDR)
+    print("SERVER running at", SERVER_ADDR,
+          "(event loop)" if use_event_loop else "(threaded)",
+          f"worker {shard[0]}/{WORKERS}" if shard is not None else "")
 
-    threading.Thread(target=recv_loop, args=(sock,), daemon=True).start()
-    threading.Thread(target=snapshot_loop, args=(sock,), daemon=True).start()
-    threading.Thread(target=metrics_loop, daemon=True).start()
+    idle_wheel = new_idle_wheel()
+    open_logs()
+    if METRICS_PORT is not None:
+        # each sharded worker serves its own process's metrics on the next port up
+        port = METRICS_PORT + (shard[0] if shard is not None else 0)
+        metrics.serve(registry, "127.0.0.1", port)
+        print(f"Metrics at http://127.0.0.1:{port}/metrics")
+    # treat SIGTERM like Ctrl-C so queued log records still reach disk
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
     try:
-        while True:
-            time.sleep(1.0)
+        if use_event_loop:
+            event_loop(sock)
+        else:
+            sock.settimeout(0.001)
+            threading.Thread(target=recv_loop, args=(sock,), daemon=True).start()
+            threading.Thread(target=snapshot_loop, args=(sock,), daemon=True).start()
+            threading.Thread(target=metrics_loop, daemon=True).start()
+
+            while True:
+                time.sleep(1.0)
     except KeyboardInterrupt:
         print("Server shutting down.")
-        metrics_file.close()
-        server_pos_file.close()
+    finally:
+        # a second signal must not cut the log flush short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        close_logs()
+
+# ======================================================
+#                 SHARDED SERVER (multi-process)
+# ======================================================
+def run_worker(index, table, capacity, use_event_loop):
+    global shard, owned, next_client_id, MAX_CLIENTS, EGRESS_CAP_KBPS
+
+    shard = (index, table)
+    owned = set()
+    next_client_id = index + 1
+    MAX_CLIENTS = capacity
+    if EGRESS_CAP_KBPS is not None:
+        EGRESS_CAP_KBPS /= WORKERS
+    # forked workers would otherwise replay the parent's random stream
+    random.seed()
+    world_rng.seed(None if SEED is None else SEED + index)
+    run_server(use_event_loop)
+
+
+def run_sharded(use_event_loop=False):
+    global tick_epoch
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("--workers needs SO_REUSEPORT (Linux or BSD)")
+
+    capacity = -(-MAX_CLIENTS // WORKERS)
+    table = sharding.ShardTable(WORKERS, capacity)
+    tick_epoch = time.monotonic()
+
+    # fork so workers inherit the configuration and the shared-memory mapping
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=run_worker, args=(i, table, capacity, use_event_loop))
+             for i in range(WORKERS)]
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+    finally:
+        table.close(unlink=True)
+        ext = ".bin" if telemetry.FORMAT == "bin" else ".csv"
+        for name in LOG_FILES:
+            sharding.merge_worker_logs(name.replace(".csv", ext), WORKERS)
 
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="GCL1 game state server.")
+    parser.add_argument("--host", default=SERVER_ADDR[0],
+                        help="Address to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=SERVER_ADDR[1],
+                        help="UDP port to listen on (default: %(default)s)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Serve live counters and histograms as text on this local port "
+                             "(worker i of --workers uses port + i)")
+    parser.add_argument("--event-loop", action="store_true",
+                        help="Run receive, tick and metrics work on one selector-driven thread")
+    parser.add_argument("--tick-hz", type=int, default=TICK_HZ,
+                        help="Snapshot tick rate (default: %(default)s)")
+    parser.add_argument("--tick-policy", choices=["catchup", "skip"], default=TICK_POLICY,
+                        help="What to do with ticks missed while overloaded")
+    parser.add_argument("--max-clients", type=int, default=MAX_CLIENTS,
+                        help="Maximum concurrent sessions (default: %(default)s)")
+    parser.add_argument("--world-size", type=int, default=WORLD_SIZE,
+                        help="Side length of the square world (default: %(default)s)")
+    parser.add_argument("--aoi-radius", type=int, default=AOI_RADIUS,
+                        help="Only send each client entities within this distance (default: everything)")
+    parser.add_argument("--grid-cell", type=int, default=GRID_CELL,
+                        help="Spatial grid cell size (default: the AOI radius)")
+    parser.add_argument("--array-world", action="store_true",
+                        help="Keep world state in NumPy arrays and step it vectorized (needs numpy)")
+    parser.add_argument("--log-policy", choices=["drop", "block"], default=telemetry.POLICY,
+                        help="When the log buffer is full, drop records or stall the producer")
+    parser.add_argument("--log-flush-ms", type=int, default=int(telemetry.FLUSH_INTERVAL * 1000),
+                        help="Background log flush interval (default: %(default)s)")
+    parser.add_argument("--log-format", choices=["csv", "bin"], default=telemetry.FORMAT,
+                        help="Write logs as CSV or fixed-width binary records (see binlog.py)")
+    parser.add_argument("--ack-coalesce", action="store_true",
+                        help="Piggyback event ACKs on the next snapshot instead of sending them alone")
+    parser.add_argument("--ack-delay-ms", type=int, default=ACK_MAX_DELAY_MS,
+                        help="Longest an event ACK waits for a snapshot (default: %(default)s)")
+    parser.add_argument("--no-compact-header", action="store_true",
+                        help="Refuse compact-header negotiation; always use the 24-byte header")
+    parser.add_argument("--session-timeout", type=float, default=SESSION_TIMEOUT,
+                        help="Evict sessions silent for this many seconds (default: %(default)s)")
+    parser.add_argument("--rate-control", action="store_true",
+                        help="Adapt each client's snapshot rate to its reported loss (AIMD)")
+    parser.add_argument("--client-kbps", type=float, default=CLIENT_BUDGET_KBPS,
+                        help="Per-client snapshot bandwidth budget (default: unlimited)")
+    parser.add_argument("--egress-kbps", type=float, default=EGRESS_CAP_KBPS,
+                        help="Total snapshot bandwidth cap, shared evenly (default: unlimited)")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Shard sessions across this many processes sharing the port (default: %(default)s)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Send snapshots as deltas against each client's last ACKed snapshot")
+    parser.add_argument("--seed", type=int, default=SEED,
+                        help="Seed the world RNG (spawn points, movement) for a reproducible run "
+                             "(worker i of --workers uses seed + i)")
+    parser.add_argument("--record", metavar="PATH", default=RECORD_PATH,
+                        help="Record every sent datagram with its send time, for replay.py")
+    args = parser.parse_args()
+
+    SERVER_ADDR = (args.host, args.port)
+    METRICS_PORT = args.metrics_port
+    TICK_HZ = args.tick_hz
+    TICK_POLICY = args.tick_policy
+    DELTA_SNAPSHOTS = args.delta
+    ACK_COALESCE = args.ack_coalesce
+    ACK_MAX_DELAY_MS = args.ack_delay_ms
+    ALLOW_COMPACT_HEADER = not args.no_compact_header
+    MAX_CLIENTS = args.max_clients
+    WORLD_SIZE = args.world_size
+    AOI_RADIUS = args.aoi_radius
+    GRID_CELL = args.grid_cell
+    telemetry.POLICY = args.log_policy
+    telemetry.FORMAT = args.log_format
+    telemetry.FLUSH_INTERVAL = args.log_flush_ms / 1000
+    WORKERS = args.workers
+    SESSION_TIMEOUT = args.session_timeout
+    RATE_CONTROL = args.rate_control
+    CLIENT_BUDGET_KBPS = args.client_kbps
+    EGRESS_CAP_KBPS = args.egress_kbps
+    SEED = args.seed
+    RECORD_PATH = args.record
+    world_rng.seed(SEED)
+    if WORKERS > 1 and args.array_world:
+        parser.error("--array-world does not support --workers yet")
+    if WORKERS > 1 and RECORD_PATH is not None:
+        parser.error("--record does not support --workers yet")
+    if args.array_world:
+        from array_world import ArrayWorld
+        world = ArrayWorld(WORLD_SIZE, seed=SEED)
+    if WORKERS > 1:
+        run_sharded(use_event_loop=args.event_loop)
+    else:
+        run_server(use_event_loop=args.event_loop)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import functools, os, struct
+from multiprocessing import shared_memory
+
+import binlog
+
+# ======================================================
+#                 SHARED WORLD TABLE LAYOUT
+# ======================================================
+# One slot per worker process:
+#
+#   u32 version | u32 tick | u32 count | capacity x (u16 id, u16 x, u16 y)
+#
+# Entity records use the snapshot wire layout (">HHH"). `version` is a
+# seqlock: odd while the owner is writing, so readers retry instead of
+# seeing a torn partition.
+SLOT_HDR = struct.Struct("<III")
+RECORD_LEN = 6
+READ_RETRIES = 8
+
+
+@functools.lru_cache(maxsize=64)
+def records_struct(count):
+    return struct.Struct(">" + "HHH" * count)
+
+
+class ShardTable:
+    """Per-worker player partitions in a multiprocessing.shared_memory block.
+
+    Created by the parent before forking; workers use the inherited mapping,
+    each writing only its own slot and reading the rest.
+    """
+
+    def __init__(self, workers, capacity):
+        self.workers = workers
+        self.capacity = capacity
+        self.slot_size = SLOT_HDR.size + RECORD_LEN * capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_size * workers)
+        self.shm.buf[:self.slot_size * workers] = bytes(self.slot_size * workers)
+        self._last = [{} for _ in range(workers)]   # last consistent read per slot
+
+    def publish(self, index, tick, entities):
+        """Write this worker's players ({pid: (x, y)}) into its slot."""
+        buf = self.shm.buf
+        base = index * self.slot_size
+        items = list(entities.items())[:self.capacity]
+
+        version = SLOT_HDR.unpack_from(buf, base)[0]
+        SLOT_HDR.pack_into(buf, base, version + 1, tick, len(items))
+        records_struct(len(items)).pack_into(
+            buf, base + SLOT_HDR.size,
+            *(v for pid, (x, y) in items for v in (pid, x, y))
+        )
+        SLOT_HDR.pack_into(buf, base, version + 2, tick, len(items))
+
+    def read(self, index):
+        """Return {pid: (x, y)} for one slot, or its last consistent copy."""
+        buf = self.shm.buf
+        base = index * self.slot_size
+        for _ in range(READ_RETRIES):
+            v1, _, count = SLOT_HDR.unpack_from(buf, base)
+            if v1 & 1:
+                continue
+            count = min(count, self.capacity)
+            raw = bytes(buf[base + SLOT_HDR.size:base + SLOT_HDR.size + RECORD_LEN * count])
+            if SLOT_HDR.unpack_from(buf, base)[0] != v1:
+                continue
+            state = {pid: (x, y) for pid, x, y in struct.iter_unpack(">HHH", raw)}
+            self._last[index] = state
+            return state
+        return self._last[index]
+
+    def read_others(self, index):
+        """Merged players of every slot except `index`."""
+        merged = {}
+        for i in range(self.workers):
+            if i != index:
+                merged.update(self.read(i))
+        return merged
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# ======================================================
+#                 LOG MERGING
+# ======================================================
+def worker_log_path(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+def merge_worker_logs(path, workers):
+    """Concatenate per-worker logs into `path`, keeping the first header.
+
+    Later CSV parts skip their header line and later binary parts skip
+    their schema header, which is identical across workers. The server's
+    per-worker metrics, tick and client logs lead with a `worker` column,
+    so merged rows can still be told apart.
+    """
+    parts = [worker_log_path(path, i) for i in range(workers)]
+    parts = [p for p in parts if os.path.exists(p)]
+    if not parts:
+        return
+
+    with open(path, "wb") as out:
+        for n, part in enumerate(parts):
+            with open(part, "rb") as f:
+                if n > 0:
+                    if binlog.is_binlog(part):
+                        f.seek(binlog.read_header(part)[1])
+                    else:
+                        f.readline()
+                out.write(f.read())
+            os.remove(part)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+import argparse, asyncio, random, struct, time
+from collections import deque
+
+import client
+import telemetry
+from client import (
+    MT_INIT, MT_SNAPSHOT, MT_EVENT, MT_ACK, MT_HEARTBEAT,
+    MT_SNAPSHOT_DELTA, MT_SNAPSHOT_FRAG, ENTITY_LEN, TRAILER_EVENT_ACK,
+    INIT_FLAG_COMPACT, INIT_FLAG_RESUME,
+)
+
+# ======================================================
+#                 SWARM CONFIGURATION
+# ======================================================
+# Virtual clients speak the same protocol as client.py (INIT, snapshot
+# ACKs, heartbeats with receiver reports, critical events with RTO
+# retransmission) and decode with its functions, but render nothing. Each
+# has its own UDP socket, since the server keys sessions by address; raise
+# the open-file limit (ulimit -n) for more than ~1000 clients.
+SERVER_ADDR = client.SERVER_ADDR
+CLIENTS = 100
+RAMP_SECONDS = 5.0         # joins are spread evenly over this long
+RUN_SECONDS = 30
+SESSION_SECONDS = None     # mean session length (uniform 0.5x..1.5x); None = whole run
+REJOIN = False             # replace a client whose session ended with a new one
+EVENT_INTERVAL = client.EVENT_INTERVAL   # per client; 0 disables events
+COMPACT_HEADER = False
+REPORT_INTERVAL = 1.0
+SERVICE_INTERVAL = 0.02    # timers (heartbeats, retransmits) for all clients, per pass
+INIT_RETRY = 0.5           # seconds between INITs until the server answers
+SEED = None
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list (NaN when empty)."""
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+# ======================================================
+#                 AGGREGATE STATISTICS
+# ======================================================
+def new_window():
+    return {
+        "snapshots": 0, "received": 0, "lost": 0, "dups": 0, "partial": 0,
+        "latency": [], "event_ack": [], "events_sent": 0, "events_failed": 0,
+    }
+
+
+def merge_window(total, window):
+    for key, value in window.items():
+        total[key] += value
+
+
+def summarize(window, seconds, connected):
+    latency = sorted(window["latency"])
+    acks = sorted(window["event_ack"])
+    seen = window["received"] + window["lost"]
+    return {
+        "clients": connected,
+        "snapshots_per_s": window["snapshots"] / seconds if seconds > 0 else 0.0,
+        "latency_p50_ms": percentile(latency, 50),
+        "latency_p95_ms": percentile(latency, 95),
+        "latency_p99_ms": percentile(latency, 99),
+        "loss_pct": 100.0 * window["lost"] / seen if seen else 0.0,
+        "dup_snapshots": window["dups"],
+        "partial_snapshots": window["partial"],
+        "event_ack_p50_ms": percentile(acks, 50),
+        "event_ack_p95_ms": percentile(acks, 95),
+        "events_sent": window["events_sent"],
+        "events_failed": window["events_failed"],
+    }
+
+
+REPORT_FIELDS = [
+    "clients", "snapshots_per_s", "latency_p50_ms", "latency_p95_ms", "latency_p99_ms",
+    "loss_pct", "dup_snapshots", "partial_snapshots", "event_ack_p50_ms", "event_ack_p95_ms", "events_sent", "events_failed",
+]
+
+# ======================================================
+#                 VIRTUAL CLIENT
+# ======================================================
+class Bot(asyncio.DatagramProtocol):
+    """One headless client session; counts into `swarm.window`."""
+
+    def __init__(self, swarm, name, session_seconds):
+        self.swarm = swarm
+        self.name = name
+        self.transport = None
+        self.client_id = None
+        self.epoch = None
+        self.local_epoch = None    # self.epoch on our clock, for compact headers we send
+        self.token = None
+        self.delta = False         # server sends deltas: ACK applied snapshots
+        self.seq_out = 1
+
+        self.seqs = client.new_seq_tracker()
+        self.sync = {"samples": deque(maxlen=client.CLOCK_FILTER), "offset_ms": None, "rtt_ms": None}
+        # the same reassembly, delta history and late check as client.py
+        self.rx = client.new_receiver()
+
+        self.rtt = {"srtt": None, "rttvar": None, "rto": client.EVENT_RTO_MS}
+        self.in_flight = {}
+        self.event_seq = 0
+
+        now = time.monotonic()
+        self.started = now
+        self.ends = None if session_seconds is None else now + session_seconds
+        self.last_init = now
+        self.last_heard = now
+        self.next_heartbeat = None
+        self.heartbeats = 0
+        # spread the swarm's events instead of sending them in lockstep
+        self.next_event = now + 2.0 + swarm.rng.random() * (EVENT_INTERVAL or 1.0)
+        self.closed = False
+
+    # --------------------------
+    # sending
+    # --------------------------
+    def send(self, msg_type, snapshot_id, payload):
+        sent_ms = client.monotonic_ms()
+        if self.epoch is None or msg_type == MT_INIT:
+            pkt = client.pack_header(msg_type, snapshot_id, self.seq_out, sent_ms, payload)
+        else:
+            pkt = client.pack_compact(msg_type, snapshot_id, self.seq_out, sent_ms, payload,
+                                      self.local_epoch)
+        self.transport.sendto(pkt)
+        self.seq_out += 1
+        return sent_ms
+
+    def send_init(self):
+        flags = INIT_FLAG_COMPACT if COMPACT_HEADER else 0
+        payload = bytes([len(self.name)]) + self.name.encode()
+        if self.client_id is not None and self.token is not None:
+            payload += bytes([flags | INIT_FLAG_RESUME]) + struct.pack(">HI", self.client_id, self.token)
+        else:
+            payload += bytes([flags])
+        self.send(MT_INIT, 0, payload)
+        self.last_init = time.monotonic()
+
+    def send_event(self):
+        self.event_seq += 1
+        ev = {"seq": self.event_seq, "attempts": 1, "rto": self.rtt["rto"]}
+        ev["first"] = ev["last"] = self.send(MT_EVENT, 0, struct.pack(">BI", 2, self.event_seq))
+        self.in_flight[self.event_seq] = ev
+        self.swarm.window["events_sent"] += 1
+
+    # --------------------------
+    # asyncio callbacks
+    # --------------------------
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send_init()
+
+    def error_received(self, exc):
+        # ICMP port unreachable while the server is down; keep retrying
+        pass
+
+    def datagram_received(self, data, addr):
+        recv_us = client.monotonic_us()
+        recv_ms = recv_us // 1000
+        header = client.parse_header(data, self.epoch)
+        if header is None:
+            return
+        mtype, snap, seq, ser_ms, plen, hdr_len = header
+        payload = data[hdr_len:hdr_len + plen]
+        self.last_heard = time.monotonic()
+        window = self.swarm.window
+
+        if mtype == MT_INIT:
+            if plen < ENTITY_LEN:
+                return
+            cid, _, _, epoch, token, self.delta = client.parse_init_reply(payload)
+            if epoch != self.epoch:
+                self.epoch, self.local_epoch = epoch, recv_ms
+            if token is not None:
+                self.token = token
+            if cid != self.client_id:
+                if self.client_id is None:
+                    self.swarm.connected += 1
+                    self.next_heartbeat = time.monotonic()   # sync burst
+                self.client_id = cid
+                self.seqs = client.new_seq_tracker()
+            # the reply takes a seq of its own, so a resume leaves no gap
+            client.track_seq(self.seqs, seq)
+            return
+
+        if self.client_id is None:
+            return
+        lost_before = self.seqs["lost"]
+        client.track_seq(self.seqs, seq)
+        window["received"] += 1
+        window["lost"] += self.seqs["lost"] - lost_before
+
+        if len(data) > hdr_len + plen:
+            for kind, body in client.parse_trailers(data[hdr_len + plen:]):
+                if kind == TRAILER_EVENT_ACK and len(body) >= 4:
+                    self.handle_event_ack(body, recv_ms)
+
+        if mtype in (MT_SNAPSHOT, MT_SNAPSHOT_DELTA, MT_SNAPSHOT_FRAG):
+            rx = self.rx
+            dups, partial = rx["dups"], rx["partial"]
+            frame = client.receive_snapshot(rx, mtype, snap, ser_ms, payload)
+            window["dups"] += rx["dups"] - dups
+            window["partial"] += rx["partial"] - partial
+            if frame is None:
+                return
+
+            if self.delta:
+                self.send(MT_ACK, snap, b"")
+
+            window["snapshots"] += 1
+            offset_ms = self.sync["offset_ms"]
+            if offset_ms is not None:
+                window["latency"].append(recv_ms - (ser_ms - offset_ms))
+
+        elif mtype == MT_ACK and plen >= 4:
+            self.handle_event_ack(payload, recv_ms)
+
+        elif mtype == MT_HEARTBEAT and plen >= 24:
+            t0, t1, t2 = struct.unpack_from(">QQQ", payload)
+            client.update_clock(self.sync, t0, t1, t2, recv_us)
+
+    def handle_event_ack(self, ack_payload, recv_ms):
+        acked, cum_ack = client.parse_event_ack(ack_payload)
+        for ev_seq in list(self.in_flight):
+            if ev_seq > cum_ack and ev_seq not in acked:
+                continue
+            ev = self.in_flight.pop(ev_seq)
+            if ev["attempts"] == 1:
+                client.update_rto(self.rtt, recv_ms - ev["first"])
+            self.swarm.window["event_ack"].append(recv_ms - ev["first"])
+
+    # --------------------------
+    # timers, driven by Swarm.service
+    # --------------------------
+    def service(self, now):
+        if self.client_id is None:
+            if now - self.last_init >= INIT_RETRY:
+                self.send_init()
+            return
+
+        now_ms = client.monotonic_ms()
+        for ev in list(self.in_flight.values()):
+            if now_ms - ev["last"] < ev["rto"]:
+                continue
+            if ev["attempts"] >= client.MAX_EVENT_RETRIES:
+                del self.in_flight[ev["seq"]]
+                self.swarm.window["events_failed"] += 1
+                continue
+            ev["attempts"] += 1
+            ev["rto"] = min(client.MAX_EVENT_RTO_MS, ev["rto"] * 2)
+            ev["last"] = self.send(MT_EVENT, 0, struct.pack(">BI", 2, ev["seq"]))
+
+        if now - self.last_heard >= client.SERVER_TIMEOUT:
+            if now - self.last_init >= client.HEARTBEAT_INTERVAL:
+                self.send_init()
+        elif now >= self.next_heartbeat:
+            sync_rtt = self.sync["rtt_ms"]
+            rtt_ms = min(0xFFFF, max(1, round(sync_rtt))) if sync_rtt is not None else 0
+            report = struct.pack(">QIIH", client.monotonic_us(), self.seqs["highest"] or 0,
+                                 self.seqs["received"] & 0xFFFFFFFF, rtt_ms)
+            self.send(MT_HEARTBEAT, 0, report)
+            self.heartbeats += 1
+            self.next_heartbeat = now + (client.SYNC_BURST_INTERVAL if self.heartbeats < client.SYNC_BURST
+                                         else client.HEARTBEAT_INTERVAL)
+
+        if EVENT_INTERVAL:
+            while len(self.in_flight) < client.EVENT_WINDOW and now >= self.next_event:
+                self.send_event()
+                self.next_event += EVENT_INTERVAL
+
+    def close(self):
+        # no goodbye in the protocol: the server evicts the session when idle
+        if not self.closed:
+            self.closed = True
+            if self.client_id is not None:
+                self.swarm.connected -= 1
+            self.transport.close()
+
+# ======================================================
+#                 SWARM DRIVER
+# ======================================================
+class Swarm:
+    def __init__(self):
+        self.rng = random.Random(SEED)
+        self.bots = []
+        self.joined = 0
+        self.connected = 0
+        self.window = new_window()
+        self.total = new_window()
+
+    def session_length(self):
+        if SESSION_SECONDS is None:
+            return None
+        return SESSION_SECONDS * self.rng.uniform(0.5, 1.5)
+
+    async def join(self):
+        loop = asyncio.get_running_loop()
+        self.joined += 1
+        bot = Bot(self, f"bot{self.joined}", self.session_length())
+        await loop.create_datagram_endpoint(lambda: bot, remote_addr=SERVER_ADDR)
+        self.bots.append(bot)
+
+    async def ramp(self, start, stop):
+        for i in range(CLIENTS):
+            delay = start + RAMP_SECONDS * i / CLIENTS - time.monotonic()
+            if time.monotonic() + max(0.0, delay) >= stop:
+                return
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.join()
+
+    async def service(self, stop):
+        while time.monotonic() < stop:
+            now = time.monotonic()
+            ended = [bot for bot in self.bots if bot.ends is not None and now >= bot.ends]
+            for bot in ended:
+                bot.close()
+                self.bots.remove(bot)
+                if REJOIN:
+                    await self.join()
+            for bot in self.bots:
+                bot.service(now)
+            await asyncio.sleep(SERVICE_INTERVAL)
+
+    async def report(self, stop, log):
+        last = time.monotonic()
+        while time.monotonic() < stop:
+            await asyncio.sleep(min(REPORT_INTERVAL, max(0.0, stop - time.monotonic())))
+            now = time.monotonic()
+            window, self.window = self.window, new_window()
+            merge_window(self.total, window)
+            stats = summarize(window, now - last, self.connected)
+            last = now
+            log.write([round(now - self.started, 3)] + [stats[f] for f in REPORT_FIELDS])
+            print(f"[SWARM] clients={stats['clients']} snaps/s={stats['snapshots_per_s']:.0f} "
+                  f"latency p50/p95/p99={stats['latency_p50_ms']:.1f}/{stats['latency_p95_ms']:.1f}/"
+                  f"{stats['latency_p99_ms']:.1f} ms loss={stats['loss_pct']:.2f}% "
+                  f"dups={stats['dup_snapshots']} partial={stats['partial_snapshots']} "
+                  f"event-ack p50/p95={stats['event_ack_p50_ms']:.1f}/{stats['event_ack_p95_ms']:.1f} ms")
+
+    async def run(self):
+        self.started = time.monotonic()
+        stop = self.started + RUN_SECONDS
+        log = telemetry.TelemetryWriter(
+            "swarm_metrics.csv", ["elapsed_s"] + REPORT_FIELDS,
+            ["f8", "u4", "f8", "f8", "f8", "f8", "f8", "u4", "u4", "f8", "f8", "u4", "u4"]
+        )
+        try:
+            await asyncio.gather(self.ramp(self.started, stop), self.service(stop), self.report(stop, log))
+        finally:
+            for bot in self.bots:
+                bot.close()
+            log.close()
+
+        stats = summarize(self.total, RUN_SECONDS, self.joined)
+        print(f"[SWARM] run total: {self.joined} clients joined, "
+              f"{stats['snapshots_per_s']:.0f} snapshots/s, "
+              f"latency p50/p95/p99={stats['latency_p50_ms']:.1f}/{stats['latency_p95_ms']:.1f}/"
+              f"{stats['latency_p99_ms']:.1f} ms, loss={stats['loss_pct']:.2f}%, "
+              f"{stats['dup_snapshots']} duplicate and {stats['partial_snapshots']} partial snapshots, "
+              f"event-ack p50/p95={stats['event_ack_p50_ms']:.1f}/{stats['event_ack_p95_ms']:.1f} ms, "
+              f"events {stats['events_failed']}/{stats['events_sent']} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless GCL1 client swarm (load generator).")
+    parser.add_argument("--clients", type=int, default=CLIENTS,
+                        help="Virtual clients to start (default: %(default)s)")
+    parser.add_argument("--ramp", type=float, default=RAMP_SECONDS,
+                        help="Seconds over which clients join, evenly spaced (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=RUN_SECONDS,
+                        help="Length of the whole run in seconds (default: %(default)s)")
+    parser.add_argument("--session-seconds", type=float, default=SESSION_SECONDS,
+                        help="Mean client session length; each lasts 0.5x to 1.5x of it")
+    parser.add_argument("--rejoin", action="store_true",
+                        help="Start a new client whenever a session ends (steady churn)")
+    parser.add_argument("--event-interval", type=float, default=EVENT_INTERVAL,
+                        help="Seconds between critical events per client, 0 for none (default: %(default)s)")
+    parser.add_argument("--compact-header", action="store_true",
+                        help="Negotiate the compact variable-length header")
+    parser.add_argument("--server", default=f"{SERVER_ADDR[0]}:{SERVER_ADDR[1]}",
+                        help="Server host:port (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=SEED,
+                        help="Seed for session lengths and event phases")
+    parser.add_argument("--log-format", choices=["csv", "bin"], default=telemetry.FORMAT,
+                        help="Write swarm_metrics as CSV or fixed-width binary records")
+    args = parser.parse_args()
+
+    host, _, port = args.server.rpartition(":")
+    SERVER_ADDR = (host, int(port))
+    CLIENTS = args.clients
+    RAMP_SECONDS = args.ramp
+    RUN_SECONDS = args.duration
+    SESSION_SECONDS = args.session_seconds
+    REJOIN = args.rejoin
+    EVENT_INTERVAL = args.event_interval
+    COMPACT_HEADER = args.compact_header
+    SEED = args.seed
+    telemetry.FORMAT = args.log_format
+    asyncio.run(Swarm().run())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import csv, os, threading, time
+from collections import deque
+
+import binlog
+
+# ======================================================
+#                 DEFAULTS
+# ======================================================
+FLUSH_INTERVAL = 0.5       # seconds between background flushes
+BATCH_SIZE = 1024          # records that wake the writer early
+CAPACITY = 65536           # records buffered before the policy kicks in
+POLICY = "drop"            # "drop" new records or "block" the producer when full
+FORMAT = "csv"             # "csv" text, or "bin" fixed-width records (see binlog.py)
+
+
+# ======================================================
+#                 BACKGROUND LOG WRITER
+# ======================================================
+class TelemetryWriter:
+    """Log whose rows are buffered in memory and written by a daemon thread.
+
+    Producers only append to a bounded ring buffer; file formatting and
+    flushes happen on the writer thread every `flush_interval` seconds or
+    once `batch_size` records are queued. When the buffer is full, "drop"
+    discards the new record and counts it in `dropped`; "block" waits for
+    the writer to make room.
+
+    In "bin" format `types` gives a binlog type code per column and the
+    file is written next to `path` with a .bin extension. With `header`
+    None the file is a plain byte stream that write_raw() chunks are
+    appended to as-is (see recording.py).
+    """
+
+    def __init__(self, path, header, types=None, flush_interval=None, batch_size=None,
+                 capacity=None, policy=None, fmt=None):
+        self.flush_interval = FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.batch_size = batch_size or BATCH_SIZE
+        self.capacity = capacity or CAPACITY
+        self.policy = policy or POLICY
+        if self.policy not in ("drop", "block"):
+            raise ValueError(f"Unknown telemetry policy '{self.policy}'")
+
+        self.dropped = 0
+        self._buf = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.raw = header is None
+        self.binary = self.raw or (fmt or FORMAT) == "bin"
+        if self.raw:
+            self.path = path
+            self._file = open(path, "wb")
+        elif self.binary:
+            self.path = os.path.splitext(path)[0] + ".bin"
+            fields = list(zip(header, types))
+            self._file = open(self.path, "wb")
+            binlog.write_header(self._file, fields)
+            self._record = binlog.record_struct(fields)
+        else:
+            self.path = path
+            self._file = open(path, "w", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(header)
+        self._file.flush()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # ----------------------
+    # producer side
+    # ----------------------
+    def _put(self, item):
+        with self._cond:
+            while len(self._buf) >= self.capacity:
+                if self.policy == "drop" or self._closed:
+                    self.dropped += 1
+                    return
+                self._cond.notify_all()
+                self._cond.wait()
+            self._buf.append(item)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify_all()
+
+    def write(self, row):
+        self._put(row)
+
+    def write_raw(self, chunk):
+        """Queue preformatted data: CSV text lines, or packed records in bin format."""
+        self._put(chunk)
+
+    # ----------------------
+    # writer thread
+    # ----------------------
+    def _drain(self):
+        with self._cond:
+            batch = list(self._buf)
+            self._buf.clear()
+            self._cond.notify_all()
+
+        if not batch:
+            return
+        write = self._file.write
+        if self.binary:
+            if self.raw:
+                write(b"".join(batch))
+            else:
+                pack = self._record.pack
+                write(b"".join(item if isinstance(item, bytes) else pack(*item) for item in batch))
+        else:
+            writerow = self._writer.writerow
+            for item in batch:
+                if isinstance(item, str):
+                    write(item)
+                else:
+                    writerow(item)
+        self._file.flush()
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                while (not self._closed and len(self._buf) < self.batch_size
+                       and time.monotonic() < deadline):
+                    self._cond.wait(max(0.0, deadline - time.monotonic()))
+                closed = self._closed
+            self._drain()
+            deadline = time.monotonic() + self.flush_interval
+            if closed:
+                return
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._drain()
+        self._file.close()
@@ -0,0 +1,46 @@
+import csv, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import analyze
+import client
+
+
+def write_csv(path, fields, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        writer.writerows(rows)
+
+
+def run_pair(tmp_path, metrics_rows):
+    write_csv(tmp_path / "server_positions.csv", ["timestamp_ms", "snapshot_id", "player_id", "x", "y"],
+              [[0, 1, 1, 0, 0]])
+    write_csv(tmp_path / "client_display.csv", client.DISPLAY_FIELDS, [[0, 1, 1, 0.0, 0.0]])
+    write_csv(tmp_path / "client_metrics.csv", client.METRICS_FIELDS, metrics_rows)
+    out = analyze.analyze_pair(str(tmp_path / "server_positions.csv"), str(tmp_path),
+                               str(tmp_path / "pair.npz"))
+    with np.load(out) as data:
+        return tuple(int(v) for v in data["loss"])
+
+
+def metrics_row(cid, seq, lost):
+    return [cid, seq, seq, 0, 0, 1.0, 0.0, 1.0, 0.0, lost, 0, 0.0, 0]
+
+
+def test_reordered_stream_is_not_loss(tmp_path):
+    # seq 2 arrives after 3: the client's running counter starts at 1 and
+    # drops back to 0, which a first/last difference reads as negative loss
+    order = [3, 2, 4, 5, 7, 6, 8]
+    lost = [1, 0, 0, 0, 1, 0, 0]
+    rows = [metrics_row(1, s, n) for s, n in zip(order, lost)]
+    assert run_pair(tmp_path, rows) == (0, 7)
+
+
+def test_seq_gaps_count_per_session(tmp_path):
+    # seq 3 and 9 never arrive; session 2 starts numbering again
+    rows = [metrics_row(1, s, 0) for s in (1, 2, 4, 4, 5)]
+    rows += [metrics_row(2, s, 0) for s in (7, 8, 10)]
+    assert run_pair(tmp_path, rows) == (2, 9)
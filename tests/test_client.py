@@ -0,0 +1,51 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import client
+
+
+def new_rtt():
+    return {"srtt": None, "rttvar": None, "rto": client.EVENT_RTO_MS}
+
+
+def test_rto_follows_rfc6298():
+    rtt = new_rtt()
+    client.update_rto(rtt, 100)
+    assert (rtt["srtt"], rtt["rttvar"], rtt["rto"]) == (100, 50, 300)
+
+    client.update_rto(rtt, 100)
+    assert rtt["rttvar"] == pytest.approx(37.5)
+    assert rtt["rto"] == pytest.approx(250)
+
+
+def test_rto_is_clamped():
+    rtt = new_rtt()
+    client.update_rto(rtt, 1)
+    assert rtt["rto"] == client.MIN_EVENT_RTO_MS
+
+    rtt = new_rtt()
+    client.update_rto(rtt, 5000)
+    assert rtt["rto"] == client.MAX_EVENT_RTO_MS
+
+
+def test_playout_orders_reordered_snapshots():
+    pb = client.new_playout()
+    # snapshot 3 overtakes 2; server ticks are 50 ms apart
+    for snap, x, arrival in ((1, 0, 0), (3, 2, 100), (2, 1, 110)):
+        client.playout_insert(pb, snap, 1000 + 50 * (snap - 1), ((1,), (x,), (0,)), arrival)
+    assert list(pb["frames"]) == [1, 2, 3]
+    assert pb["newest"] == (3, 1100)
+
+    # render 75 ms of server time in: halfway between snapshots 2 and 3
+    pb["delay_ms"] = 50
+    render_snap, (ids, xs, ys) = client.playout_render(pb, 125)
+    assert ids == (1,)
+    assert render_snap == pytest.approx(2.5, abs=0.05)
+    assert xs[0] == pytest.approx(1.5, abs=0.05)
+
+    # a snapshot older than what was rendered is too late to play
+    assert client.playout_late(pb, 1050)
+    assert not client.playout_late(pb, 1100)
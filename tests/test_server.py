@@ -0,0 +1,359 @@
+import os, struct, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import array_world
+import client
+import server
+
+
+def connect(monkeypatch, num_players):
+    """One session in a world of `num_players` players."""
+    addr = ("127.0.0.1", 40000)
+    monkeypatch.setattr(server, "players", {pid: (pid % 20, pid // 20 % 20)
+                                            for pid in range(1, num_players + 1)})
+    monkeypatch.setattr(server, "clients", {addr: 1})
+    monkeypatch.setattr(server, "seq_nums", {addr: 1})
+    monkeypatch.setattr(server, "send_rate", {addr: server.new_send_rate()})
+    monkeypatch.setattr(server, "sent_history", {addr: {}})
+    monkeypatch.setattr(server, "acked_snapshot", {})
+    monkeypatch.setattr(server, "last_seen", {addr: 0.0})
+    monkeypatch.setattr(server, "oversize_warned", False)
+    return addr
+
+
+def unpack(pkt):
+    """(mtype, snapshot_id, ts, payload) of one server packet."""
+    data = bytes(pkt)
+    mtype, snap, _, ts, plen, hdr_len = client.parse_header(data)
+    return mtype, snap, ts, data[hdr_len:hdr_len + plen]
+
+
+def receive_batches(rx, batches):
+    """Feed one tick's packets through the client's receive path."""
+    frame = None
+    for packets, _ in batches:
+        for pkt in packets:
+            mtype, snap, ts, payload = unpack(pkt)
+            frame = client.receive_snapshot(rx, mtype, snap, ts, payload) or frame
+    return frame
+
+
+def as_dict(frame):
+    ids, xs, ys = frame
+    return dict(zip(ids, zip(xs, ys)))
+
+
+def test_delta_against_acked_baseline(monkeypatch):
+    addr = connect(monkeypatch, 5)
+    monkeypatch.setattr(server, "DELTA_SNAPSHOTS", True)
+    monkeypatch.setattr(server, "snapshot_id", 10)
+    rx = client.new_receiver()
+
+    # nothing ACKed yet: a full snapshot
+    batches = server.build_snapshot_batches(0)
+    assert unpack(batches[0][0][0])[0] == server.MT_SNAPSHOT
+    assert as_dict(receive_batches(rx, batches)) == server.players
+
+    # ACKed: the next tick is a delta against it, with a move, a leave and a join
+    server.handle_packet(None, client.pack_header(server.MT_ACK, 10, 2, 0, b""), addr)
+    assert server.acked_snapshot[addr] == 10
+    server.players[2] = (7, 7)
+    del server.players[3]
+    server.players[9] = (1, 2)
+    monkeypatch.setattr(server, "snapshot_id", 11)
+    batches = server.build_snapshot_batches(0)
+    mtype, _, _, payload = unpack(batches[0][0][0])
+    assert mtype == server.MT_SNAPSHOT_DELTA
+    assert as_dict(receive_batches(rx, batches)) == server.players
+
+    # a client that no longer holds the baseline can't apply the delta
+    stale = client.new_receiver()
+    assert client.receive_snapshot(stale, mtype, 11, 0, payload) is None
+    assert stale["undecodable"] == 1
+
+
+def oversize_drops():
+    return server.stats.keyed_totals("dropped").get("snapshot_oversize", 0)
+
+
+def test_small_world_is_fragmented(monkeypatch):
+    addr = connect(monkeypatch, 1000)
+    batches = server.build_snapshot_batches(0)
+    assert len(batches) == 1
+    packets, targets = batches[0]
+    assert 1 < len(packets) <= server.MAX_FRAGMENTS
+    assert targets == [(addr, 1, 2)]
+
+
+def fragments(snap, num_players):
+    """Fragment packets of a full snapshot of `num_players` players."""
+    world = {pid: (pid % 20, pid // 20 % 20) for pid in range(1, num_players + 1)}
+    return world, [unpack(pkt) for pkt in server.encode_snapshot(snap, snap, world)]
+
+
+def test_fragment_reassembly_with_duplicate():
+    world, frags = fragments(1, 1000)
+    assert len(frags) > 2 and all(f[0] == server.MT_SNAPSHOT_FRAG for f in frags)
+    rx = client.new_receiver()
+
+    # fragment 0 arrives twice, the rest out of order
+    results = [client.receive_snapshot(rx, mtype, snap, ts, payload)
+               for mtype, snap, ts, payload in [frags[0], frags[0]] + frags[:0:-1]]
+    assert results[:-1] == [None] * (len(results) - 1)
+    assert as_dict(results[-1]) == world
+    assert not rx["pending"] and rx["partial"] == 0
+
+    # a fragment of a snapshot already applied is a duplicate
+    mtype, snap, ts, payload = frags[1]
+    assert client.receive_snapshot(rx, mtype, snap, ts, payload) is None
+    assert rx["dups"] == 1
+
+
+def test_missing_fragment_counts_as_partial():
+    _, first = fragments(1, 1000)
+    world, second = fragments(2, 1000)
+    rx = client.new_receiver()
+
+    for mtype, snap, ts, payload in first[:-1]:
+        assert client.receive_snapshot(rx, mtype, snap, ts, payload) is None
+    assert list(rx["pending"]) == [1]
+
+    # the next snapshot completes; the one missing a fragment is given up
+    frame = None
+    for mtype, snap, ts, payload in second:
+        frame = client.receive_snapshot(rx, mtype, snap, ts, payload)
+    assert as_dict(frame) == world
+    assert not rx["pending"] and rx["partial"] == 1
+
+
+def test_oversize_world_skips_snapshot(monkeypatch, capsys):
+    # more entity bytes than MAX_FRAGMENTS fragments can carry
+    count = server.MAX_FRAGMENTS * server.FRAG_CHUNK // server.ENTITY_LEN + 1
+    addr = connect(monkeypatch, count)
+    before = oversize_drops()
+
+    assert server.build_snapshot_batches(0) == []
+    assert server.build_snapshot_batches(0) == []
+    assert oversize_drops() == before + 2
+    # no seq_num was spent on the skipped snapshots
+    assert server.seq_nums[addr] == 1
+    # warned once, not every tick
+    assert capsys.readouterr().out.count("[WARN]") == 1
+
+
+def test_event_sack_round_trip(monkeypatch):
+    addr = ("127.0.0.1", 40005)
+    monkeypatch.setattr(server, "event_cum", {addr: 0})
+    monkeypatch.setattr(server, "event_seen", {addr: set()})
+    for seq in (1, 2, 4, 5, 40):
+        assert server.record_event(addr, seq)
+    assert not server.record_event(addr, 4)   # duplicate
+
+    # 3 is missing; 40 is past the bitmap, so it rides as an extra seq
+    acked, cum = client.parse_event_ack(server.event_ack_payload(addr, [40, 5]))
+    assert cum == 2
+    assert acked == {4, 5, 40}
+
+    # a bare ACK carries only the triggering seq
+    assert client.parse_event_ack(struct.pack(">I", 7)) == ({7}, 0)
+
+
+def test_event_ack_rides_on_snapshot(monkeypatch):
+    addr = connect(monkeypatch, 3)
+    monkeypatch.setattr(server, "event_cum", {addr: 0})
+    monkeypatch.setattr(server, "event_seen", {addr: set()})
+    monkeypatch.setattr(server, "ack_pending", {})
+    monkeypatch.setattr(server, "ack_due", {})
+    with server.ack_lock:
+        server.record_event(addr, 1)
+        server.queue_event_ack(addr, 1)
+
+    sock = FakeSocket()
+    for packets, targets in server.build_snapshot_batches(0):
+        server.send_batch(sock, packets, targets)
+    (data, _), = sock.sent
+    mtype, _, _, _, plen, hdr_len = client.parse_header(data)
+    assert mtype == server.MT_SNAPSHOT
+
+    (kind, body), = client.parse_trailers(data[hdr_len + plen:])
+    assert kind == client.TRAILER_EVENT_ACK
+    assert client.parse_event_ack(body) == ({1}, 1)
+    # taken off the standalone ACK timer
+    assert not server.ack_pending and not server.ack_due
+
+
+VARINT_EDGES = (0, 1, 127, 128, 16383, 16384, 2**21 - 1, 2**21, 2**32 - 1, 2**64 - 1)
+
+
+def test_varint_round_trip_at_boundaries():
+    for n in VARINT_EDGES:
+        for encode, decode in ((server.encode_varint, client.decode_varint),
+                               (client.encode_varint, server.decode_varint)):
+            data = bytes(encode(n))
+            # a byte after the varint is left alone
+            assert decode(data + b"\xff", 0) == (n, len(data))
+    assert [len(server.encode_varint(n)) for n in (127, 128, 16383, 16384)] == [1, 2, 2, 3]
+
+
+def test_compact_header_round_trip():
+    epoch = 1_000_000
+    cases = [(0, 0, epoch, epoch), (127, 128, epoch + 16383, epoch + 16383),
+             (2**32 - 1, 2**32 - 1, epoch + 2**32, epoch + 2**32),
+             (5, 6, epoch - 5, epoch)]   # stamped before the epoch: clamped to it
+    for snap, seq, ts, seen_ts in cases:
+        for payload in (b"", b"x" * server.PAYLOAD_LIMIT):
+            legacy = server.pack_header(server.MT_SNAPSHOT, snap, seq, ts, payload)
+            down = server.to_compact(legacy, epoch)
+            assert len(down) < len(legacy)
+            assert client.parse_header(down, epoch) == (
+                server.MT_SNAPSHOT, snap, seq, seen_ts, len(payload), len(down) - len(payload))
+
+            # the server reports a compact timestamp as ms since the epoch
+            up = client.pack_compact(server.MT_EVENT, snap, seq, ts, payload, epoch)
+            assert server.parse_header(up) == (
+                server.MT_EVENT, snap, seq, seen_ts - epoch, len(payload), len(up) - len(payload))
+
+    # a compact packet is unreadable until the epoch is agreed, and a cut one is rejected
+    assert client.parse_header(down) is None
+    assert server.parse_header(up[:3]) is None
+
+
+def fresh_sessions(monkeypatch, workers=1, index=None):
+    """Empty session tables, as in worker `index` of `workers` if given."""
+    # cleared in place: ADDR_TABLES holds the module's own dicts
+    for table in server.ADDR_TABLES + (server.players, server.client_addr, server.session_token):
+        table.clear()
+    monkeypatch.setattr(server, "free_ids", [])
+    monkeypatch.setattr(server, "idle_wheel", server.new_idle_wheel())
+    monkeypatch.setattr(server, "WORKERS", workers)
+    if index is None:
+        monkeypatch.setattr(server, "next_client_id", 1)
+    else:
+        monkeypatch.setattr(server, "shard", (index, None))
+        monkeypatch.setattr(server, "owned", set())
+        monkeypatch.setattr(server, "next_client_id", index + 1)
+
+
+def test_resume_moves_session_to_new_address(monkeypatch):
+    fresh_sessions(monkeypatch)
+    old, new = ("127.0.0.1", 40001), ("127.0.0.1", 40002)
+    cid = server.open_session(old, None)
+    token = server.session_token[cid]
+
+    assert server.open_session(new, (cid, token)) == cid
+    assert server.clients == {new: cid}
+
+
+def test_resume_on_another_worker_opens_new_session(monkeypatch):
+    # the session lives on worker 0; the rebound address hashes to worker 1,
+    # whose tables don't have it, so the resume falls back to a new session
+    fresh_sessions(monkeypatch, workers=2, index=1)
+    new = ("127.0.0.1", 40002)
+    cid = server.open_session(new, (1, 0x1234))
+
+    assert cid == 2
+    assert server.clients == {new: 2}
+    assert server.owned == {2}
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((bytes(data), addr))
+
+
+def sent_seqs(sock):
+    return [server.parse_header(data)[2] for data, _ in sock.sent]
+
+
+def test_init_reply_takes_its_own_seq(monkeypatch):
+    fresh_sessions(monkeypatch)
+    sock, addr = FakeSocket(), ("127.0.0.1", 40003)
+    init = server.pack_header(server.MT_INIT, 0, 1, 0, b"\x00\x00")
+    sync = server.pack_header(server.MT_HEARTBEAT, 0, 2, 0, server.SYNC_REQ_STRUCT.pack(0))
+
+    server.handle_packet(sock, init, addr)
+    server.handle_packet(sock, init, addr)   # retransmitted INIT
+    server.handle_packet(sock, sync, addr)
+    assert sent_seqs(sock) == [2, 3, 4]
+
+
+def test_packets_after_eviction_are_dropped(monkeypatch):
+    fresh_sessions(monkeypatch)
+    sock, addr = FakeSocket(), ("127.0.0.1", 40004)
+    with server.session_lock:
+        server.open_session(addr, None)
+        server.evict_session(addr)
+    before = server.stats.keyed_totals("dropped").get("unknown_addr", 0)
+
+    for mtype, payload in ((server.MT_HEARTBEAT, server.SYNC_REQ_STRUCT.pack(0)),
+                           (server.MT_EVENT, b"\x01\x00\x00\x00\x01"),
+                           (server.MT_ACK, b"")):
+        server.handle_packet(sock, server.pack_header(mtype, 5, 1, 0, payload), addr)
+    server.flush_due_acks(sock)
+
+    assert sock.sent == []
+    assert server.stats.keyed_totals("dropped").get("unknown_addr", 0) == before + 3
+
+
+def init_packet(resume=None):
+    """An INIT with no name, asking to resume (client_id, token) if given."""
+    if resume is None:
+        payload = b"\x00\x00"
+    else:
+        payload = b"\x00" + bytes([server.INIT_FLAG_RESUME]) + struct.pack(">HI", *resume)
+    return server.pack_header(server.MT_INIT, 0, 1, 0, payload)
+
+
+def init_reply(sock):
+    """(client_id, token) of the last INIT reply sent."""
+    _, _, _, payload = unpack(sock.sent[-1][0])
+    cid, _, _, _, token, _ = client.parse_init_reply(payload)
+    return cid, token
+
+
+def test_resume_after_eviction_opens_new_session(monkeypatch):
+    fresh_sessions(monkeypatch)
+    sock = FakeSocket()
+    old, new, other = ("127.0.0.1", 40006), ("127.0.0.1", 40007), ("127.0.0.1", 40008)
+    server.handle_packet(sock, init_packet(), old)
+    cid, token = init_reply(sock)
+
+    # idle past SESSION_TIMEOUT: the tick thread's wheel evicts the session
+    server.expire_idle_sessions(server.idle_wheel["time"] + server.SESSION_TIMEOUT
+                                + 2 * server.WHEEL_RESOLUTION)
+    assert not server.clients
+    resumed = server.stats.totals()["sessions_resumed"]
+
+    # the stale token opens a fresh session with a new token (the id may be reused)
+    server.handle_packet(sock, init_packet((cid, token)), new)
+    new_cid, new_token = init_reply(sock)
+    assert new_token != token
+    assert server.clients == {new: new_cid}
+
+    # and can't take over the session that now holds the freed id
+    server.handle_packet(sock, init_packet((cid, token)), other)
+    assert init_reply(sock)[0] != new_cid
+    assert server.clients[new] == new_cid
+    assert server.stats.totals()["sessions_resumed"] == resumed
+
+
+def test_reinit_reply_has_current_position(monkeypatch):
+    fresh_sessions(monkeypatch)
+    monkeypatch.setattr(server, "world", array_world.ArrayWorld(server.WORLD_SIZE, seed=1))
+    sock, addr = FakeSocket(), ("127.0.0.1", 40009)
+    server.handle_packet(sock, init_packet(), addr)
+    _, _, _, payload = unpack(sock.sent[-1][0])
+    cid, x, y = client.parse_init_reply(payload)[:3]
+    assert (x, y) == server.world.position(cid)
+
+    for _ in range(20):
+        server.world.step()
+    # the INIT reply was lost: the retransmit is answered with where the player is now
+    server.handle_packet(sock, init_packet(), addr)
+    _, _, _, payload = unpack(sock.sent[-1][0])
+    assert client.parse_init_reply(payload)[1:3] == server.world.position(cid)
+    assert server.world.position(cid) != (x, y)
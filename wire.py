@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+import argparse, csv, mmap, struct, sys
+
+import numpy as np
+
+import binlog
+import metrics
+from client import (
+    MAGIC, VERSION, HDR_FMT, HDR_LEN, COMPACT_MARK, MT_EVENT, MT_ACK, MT_INIT,
+    decode_varint,
+)
+
+# ======================================================
+#                 PACKET RECORDS
+# ======================================================
+# Captures (pcap or pcapng) are memory-mapped and decoded straight from
+# the mapping into fixed-size NumPy chunks of PACKET_FIELDS records, so a
+# multi-GB file never needs more than CHUNK_RECORDS records in memory.
+# Only UDP to or from one of the server ports is kept. The types are binlog
+# codes, so --export writes a file that binlog.load() memory-maps back.
+PACKET_FIELDS = [
+    ("ts_ns", "i8"),           # capture time
+    ("session", "u4"),         # index into the session list (client address, server port)
+    ("direction", "u2"),       # UP (client -> server) or DOWN
+    ("wire_len", "u4"),        # original frame length
+    ("udp_len", "u4"),         # UDP payload length
+    ("msg_type", "u2"),        # NOT_GCL1 if the payload is not a GCL1 packet
+    ("compact", "u2"),         # 1 for the compact header (header_ts is then epoch-relative)
+    ("snapshot_id", "u4"),
+    ("seq_num", "u4"),
+    ("header_ts", "i8"),
+    ("payload_len", "u4"),
+    ("event_seq", "u4"),       # MT_EVENT seq, or the seq an MT_ACK answers
+]
+PACKET_DTYPE = binlog.numpy_dtype(PACKET_FIELDS)
+CHUNK_RECORDS = 1 << 16
+UP, DOWN = 0, 1
+NOT_GCL1 = 0xFFFF
+SERVER_PORTS = (7777,)
+
+HDR_STRUCT = struct.Struct(HDR_FMT)
+U32 = struct.Struct(">I")
+
+# link types: Ethernet, BSD loopback, raw IP (three codes), OpenBSD loopback, Linux cooked v1/v2
+LINK_ETHERNET, LINK_NULL, LINK_LOOP = 1, 0, 108
+LINK_RAW = (101, 12, 14)
+LINK_SLL, LINK_SLL2 = 113, 276
+
+# ======================================================
+#                 CAPTURE FILE FORMATS
+# ======================================================
+def iter_frames(buf):
+    """Yield (ts_ns, linktype, offset, caplen, wire_len) for every frame in a mapped capture."""
+    if len(buf) < 4:
+        return
+    magic = buf[:4]
+    if magic == b"\x0a\x0d\x0d\x0a":
+        yield from iter_pcapng(buf)
+        return
+
+    for order in "<>":
+        (m,) = struct.unpack(order + "I", magic)
+        if m in (0xA1B2C3D4, 0xA1B23C4D):
+            break
+    else:
+        raise ValueError("not a pcap or pcapng file")
+    ns_scale = 1 if m == 0xA1B23C4D else 1000
+    (linktype,) = struct.unpack_from(order + "I", buf, 20)
+    linktype &= 0x0FFFFFFF
+    rec = struct.Struct(order + "IIII")
+
+    off, end = 24, len(buf)
+    while off + 16 <= end:
+        sec, frac, caplen, wire_len = rec.unpack_from(buf, off)
+        off += 16
+        if off + caplen > end:
+            return                     # cut short by the capturing process
+        yield sec * 1_000_000_000 + frac * ns_scale, linktype, off, caplen, wire_len
+        off += caplen
+
+
+def tsresol_ns(value):
+    """Nanoseconds per timestamp unit from a pcapng if_tsresol option."""
+    exp = value & 0x7F
+    if value & 0x80:
+        return 1e9 / (1 << exp)
+    return 10 ** (9 - exp) if exp <= 9 else 10.0 ** (9 - exp)
+
+
+def iter_pcapng(buf):
+    order = "<"
+    interfaces = []                    # (linktype, ns per unit) per IDB in this section
+    off, end = 0, len(buf)
+    while off + 12 <= end:
+        (btype,) = struct.unpack_from(order + "I", buf, off)
+        if btype == 0x0A0D0D0A:
+            # section header: its byte-order magic decides the rest of the section
+            bom = buf[off + 8:off + 12]
+            order = "<" if bom == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+        (blen,) = struct.unpack_from(order + "I", buf, off + 4)
+        if blen < 12 or off + blen > end:
+            return
+        body = off + 8
+
+        if btype == 1:                 # interface description
+            linktype = struct.unpack_from(order + "H", buf, body)[0]
+            unit = 1000
+            opt, opt_end = body + 8, off + blen - 4
+            while opt + 4 <= opt_end:
+                code, length = struct.unpack_from(order + "HH", buf, opt)
+                if code == 0:
+                    break
+                if code == 9 and length >= 1:
+                    unit = tsresol_ns(buf[opt + 4])
+                opt += 4 + (length + 3) // 4 * 4
+            interfaces.append((linktype, unit))
+        elif btype == 6:               # enhanced packet
+            iface, hi, lo, caplen, wire_len = struct.unpack_from(order + "IIIII", buf, body)
+            if iface < len(interfaces):
+                linktype, unit = interfaces[iface]
+                yield int(((hi << 32) | lo) * unit), linktype, body + 20, caplen, wire_len
+        elif btype == 3 and interfaces:   # simple packet: no timestamp
+            (wire_len,) = struct.unpack_from(order + "I", buf, body)
+            caplen = min(wire_len, blen - 16)
+            yield 0, interfaces[0][0], body + 4, caplen, wire_len
+        elif btype == 2:               # obsolete packet block
+            iface, _, hi, lo, caplen, wire_len = struct.unpack_from(order + "HHIIII", buf, body)
+            if iface < len(interfaces):
+                linktype, unit = interfaces[iface]
+                yield int(((hi << 32) | lo) * unit), linktype, body + 20, caplen, wire_len
+        off += blen
+
+# ======================================================
+#                 LINK / IP / UDP / GCL1 DECODING
+# ======================================================
+def ip_start(buf, linktype, off, end):
+    """Offset of the IP header inside a frame, or None."""
+    if linktype == LINK_ETHERNET:
+        off += 12
+        while off + 2 <= end and buf[off:off + 2] in (b"\x81\x00", b"\x88\xa8"):
+            off += 4                   # VLAN tags
+        if off + 2 > end or buf[off:off + 2] not in (b"\x08\x00", b"\x86\xdd"):
+            return None
+        return off + 2
+    if linktype in (LINK_NULL, LINK_LOOP):
+        return off + 4
+    if linktype in LINK_RAW:
+        return off
+    if linktype == LINK_SLL:
+        return off + 16
+    if linktype == LINK_SLL2:
+        return off + 20
+    return None
+
+
+def udp_of(buf, off, end):
+    """(src addr bytes, dst addr bytes, sport, dport, payload offset, payload len) or None."""
+    if off >= end:
+        return None
+    version = buf[off] >> 4
+    if version == 4:
+        ihl = (buf[off] & 0x0F) * 4
+        if off + ihl + 8 > end or buf[off + 9] != 17:
+            return None
+        if struct.unpack_from(">H", buf, off + 6)[0] & 0x1FFF:
+            return None                # non-first IP fragment: no UDP header
+        src, dst = bytes(buf[off + 12:off + 16]), bytes(buf[off + 16:off + 20])
+        udp = off + ihl
+    elif version == 6:
+        if off + 48 > end or buf[off + 6] != 17:
+            return None
+        src, dst = bytes(buf[off + 8:off + 24]), bytes(buf[off + 24:off + 40])
+        udp = off + 40
+    else:
+        return None
+    sport, dport, length = struct.unpack_from(">HHH", buf, udp)
+    return src, dst, sport, dport, udp + 8, max(0, length - 8)
+
+
+def decode_gcl1(buf, off, end):
+    """(msg_type, compact, snapshot_id, seq_num, header_ts, payload_len, event_seq)
+    of the datagram at buf[off:end]; msg_type is NOT_GCL1 if it isn't one."""
+    if off >= end:
+        return NOT_GCL1, 0, 0, 0, 0, 0, 0
+    if buf[off] >> 5 == COMPACT_MARK:
+        try:
+            snap, p = decode_varint(buf, off + 1)
+            seq, p = decode_varint(buf, p)
+            ts, p = decode_varint(buf, p)
+            plen, p = decode_varint(buf, p)
+        except IndexError:
+            return NOT_GCL1, 0, 0, 0, 0, 0, 0
+        if p > end:
+            return NOT_GCL1, 0, 0, 0, 0, 0, 0
+        mtype, compact = buf[off] & 0x1F, 1
+    elif off + HDR_LEN <= end:
+        magic, ver, mtype, snap, seq, ts, plen = HDR_STRUCT.unpack_from(buf, off)
+        if magic != MAGIC or ver != VERSION:
+            return NOT_GCL1, 0, 0, 0, 0, 0, 0
+        p, compact = off + HDR_LEN, 0
+    else:
+        return NOT_GCL1, 0, 0, 0, 0, 0, 0
+
+    event_seq = 0
+    if mtype == MT_EVENT and plen >= 5 and p + 5 <= end:
+        event_seq = U32.unpack_from(buf, p + 1)[0]
+    elif mtype == MT_ACK and plen >= 4 and p + 4 <= end:
+        event_seq = U32.unpack_from(buf, p)[0]
+    return mtype, compact, snap, seq, ts, plen, event_seq
+
+
+def read_packets(path, ports=SERVER_PORTS, sessions=None):
+    """Yield PACKET_DTYPE chunks of GCL1-port UDP traffic from a capture.
+
+    `sessions` (a dict, filled in as new ones appear) maps
+    (client address, client port, server port) to the record's session id.
+    """
+    ports = set(ports)
+    sessions = {} if sessions is None else sessions
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        rows = []
+        for ts_ns, linktype, off, caplen, wire_len in iter_frames(buf):
+            end = off + caplen
+            ip = ip_start(buf, linktype, off, end)
+            udp = udp_of(buf, ip, end) if ip is not None else None
+            if udp is None:
+                continue
+            src, dst, sport, dport, p, length = udp
+            if dport in ports:
+                key, direction = (src, sport, dport), UP
+            elif sport in ports:
+                key, direction = (dst, dport, sport), DOWN
+            else:
+                continue
+            session = sessions.get(key)
+            if session is None:
+                session = sessions[key] = len(sessions)
+
+            rows.append((ts_ns, session, direction, wire_len, length)
+                        + decode_gcl1(buf, p, min(end, p + length)))
+            if len(rows) == CHUNK_RECORDS:
+                yield np.array(rows, dtype=PACKET_DTYPE)
+                rows = []
+        if rows:
+            yield np.array(rows, dtype=PACKET_DTYPE)
+
+# ======================================================
+#                 PER-SESSION STATISTICS
+# ======================================================
+# Interarrival times go into the metrics.py log buckets (in ms). Loss is
+# counted against the seq_num range seen on the wire: every GCL1 packet in
+# one direction of a session carries consecutive seq_nums. A seq below the
+# highest already seen is a reorder, one seen before a duplicate.
+IA_BOUNDS = np.array(metrics.HIST_BOUNDS)
+
+
+class Flow:
+    """Running statistics for one direction of one session."""
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.first_ns = self.last_ns = None
+        self.ia_counts = np.zeros(len(IA_BOUNDS), dtype=np.int64)
+        self.seq_base = None
+        self.seen = np.zeros(0, dtype=bool)    # seq_num - seq_base -> seen
+        self.max_seq = -1
+        self.reordered = 0
+        self.duplicates = 0
+        self.events = set()
+        self.event_retransmits = 0
+        self.inits = 0
+
+    def add(self, recs):
+        ts = recs["ts_ns"]
+        self.packets += len(recs)
+        self.bytes += int(recs["wire_len"].sum())
+        prev = ts[:0] if self.last_ns is None else np.array([self.last_ns])
+        gaps_ms = np.diff(np.concatenate([prev, ts])) / 1e6
+        if len(gaps_ms):
+            idx = np.minimum(np.searchsorted(IA_BOUNDS, gaps_ms), len(IA_BOUNDS) - 1)
+            self.ia_counts += np.bincount(idx, minlength=len(IA_BOUNDS))
+        if self.first_ns is None:
+            self.first_ns = int(ts[0])
+        self.last_ns = int(ts[-1])
+
+        gcl = recs[recs["msg_type"] != NOT_GCL1]
+        if len(gcl):
+            self.track_seqs(gcl["seq_num"].astype(np.int64))
+        self.inits += int(np.count_nonzero(gcl["msg_type"] == MT_INIT))
+        for seq in gcl["event_seq"][gcl["msg_type"] == MT_EVENT].tolist():
+            if seq in self.events:
+                self.event_retransmits += 1
+            else:
+                self.events.add(seq)
+
+    def track_seqs(self, seqs):
+        if self.seq_base is None:
+            self.seq_base = int(seqs.min())
+        low = int(seqs.min())
+        if low < self.seq_base:
+            self.seen = np.concatenate([np.zeros(self.seq_base - low, bool), self.seen])
+            self.seq_base = low
+        rel = seqs - self.seq_base
+        need = int(rel.max()) + 1
+        if need > len(self.seen):
+            grown = np.zeros(max(need, 2 * len(self.seen)), bool)
+            grown[:len(self.seen)] = self.seen
+            self.seen = grown
+
+        # duplicates: seen in an earlier chunk, or earlier in this one
+        first = np.zeros(len(rel), bool)
+        first[np.unique(rel, return_index=True)[1]] = True
+        dup = self.seen[rel] | ~first
+        # highest seq before each packet, carried over from earlier chunks
+        running = np.maximum.accumulate(np.concatenate([[self.max_seq], seqs]))
+        self.reordered += int(np.count_nonzero((seqs < running[:-1]) & ~dup))
+        self.duplicates += int(np.count_nonzero(dup))
+        self.max_seq = int(running[-1])
+        self.seen[rel] = True
+
+    def summary(self):
+        duration = (self.last_ns - self.first_ns) / 1e9 if self.packets > 1 else 0.0
+        expected = distinct = 0
+        if self.seq_base is not None:
+            expected = self.max_seq - self.seq_base + 1
+            distinct = int(np.count_nonzero(self.seen))
+        cum = np.cumsum(self.ia_counts)
+
+        def ia_pct(q):
+            if cum[-1] == 0:
+                return float("nan")
+            return float(IA_BOUNDS[np.searchsorted(cum, q / 100 * cum[-1])])
+
+        return {
+            "packets": self.packets, "bytes": self.bytes, "duration_s": round(duration, 3),
+            "kbps": self.bytes * 8 / 1000 / duration if duration > 0 else 0.0,
+            "interarrival_p50_ms": ia_pct(50), "interarrival_p95_ms": ia_pct(95),
+            "interarrival_p99_ms": ia_pct(99),
+            "seq_lost": expected - distinct,
+            "loss_pct": 100.0 * (expected - distinct) / expected if expected else 0.0,
+            "reordered": self.reordered, "duplicates": self.duplicates,
+            "event_retransmits": self.event_retransmits, "init_packets": self.inits,
+        }
+
+
+SUMMARY_FIELDS = [
+    "session", "client", "server_port", "direction", "packets", "bytes", "duration_s", "kbps",
+    "interarrival_p50_ms", "interarrival_p95_ms", "interarrival_p99_ms",
+    "seq_lost", "loss_pct", "reordered", "duplicates", "event_retransmits", "init_packets",
+]
+
+
+def format_addr(addr, port):
+    if len(addr) == 4:
+        return f"{'.'.join(str(b) for b in addr)}:{port}"
+    return f"[{':'.join(addr[i:i + 2].hex() for i in range(0, 16, 2))}]:{port}"
+
+
+def analyze(path, ports=SERVER_PORTS, export=None):
+    """Per-session, per-direction summary rows for a capture."""
+    sessions = {}
+    flows = {}
+    out = None
+    if export is not None:
+        out = open(export, "wb")
+        binlog.write_header(out, PACKET_FIELDS)
+    try:
+        for chunk in read_packets(path, ports, sessions):
+            if out is not None:
+                out.write(chunk.tobytes())
+            keys = chunk["session"].astype(np.int64) * 2 + chunk["direction"]
+            for key in np.unique(keys).tolist():
+                flows.setdefault(key, Flow()).add(chunk[keys == key])
+    finally:
+        if out is not None:
+            out.close()
+
+    names = {sid: (format_addr(addr, port), server_port)
+             for (addr, port, server_port), sid in sessions.items()}
+    rows = []
+    for key in sorted(flows):
+        session, direction = divmod(key, 2)
+        client, server_port = names[session]
+        rows.append({"session": session, "client": client, "server_port": server_port,
+                     "direction": "up" if direction == UP else "down",
+                     **flows[key].summary()})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire-level GCL1 statistics from a pcap/pcapng capture.")
+    parser.add_argument("capture", help="pcap or pcapng file (e.g. trace.pcap)")
+    parser.add_argument("--port", type=int, action="append", default=None,
+                        help="Server-side UDP port; repeat for several (default: 7777)")
+    parser.add_argument("--out", default=None, help="Write the summary as CSV")
+    parser.add_argument("--export", default=None,
+                        help="Write every decoded packet as a binary log (see binlog.py)")
+    args = parser.parse_args()
+
+    rows = analyze(args.capture, args.port or SERVER_PORTS, args.export)
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.DictWriter(f, SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(f"{'client':<22} {'port':>5} {'dir':<4} {'pkts':>7} {'kbps':>8} {'ia p50':>7} "
+          f"{'p95':>6} {'lost':>5} {'loss%':>6} {'reord':>5} {'dup':>4} {'ev-rtx':>6}")
+    for r in rows:
+        print(f"{r['client']:<22} {r['server_port']:>5} {r['direction']:<4} {r['packets']:>7} "
+              f"{r['kbps']:>8.1f} {r['interarrival_p50_ms']:>7.2f} {r['interarrival_p95_ms']:>6.2f} "
+              f"{r['seq_lost']:>5} {r['loss_pct']:>6.2f} {r['reordered']:>5} {r['duplicates']:>4} "
+              f"{r['event_retransmits']:>6}")
+    if not rows:
+        print("no GCL1 traffic on the given ports", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()